@@ -0,0 +1,133 @@
+"""Measure sync, backfill and redaction throughput against the fake homeserver.
+
+A :class:`tests.fake_homeserver.FakeHomeserver` is filled with synthetic
+rooms and served on a local port, so the numbers cover the real client
+stack (retry layer, token bucket, mautrix parsing) but not a real server.
+Three phases are timed:
+
+* initial sync with the cleaner's media-only filter,
+* backward ``/messages`` pagination through every room,
+* draining the redaction outbox for ``--redact`` uploads, with single and
+  MSC2244 mass redactions.
+
+``--latency`` adds a per-request delay and ``--rate-limit`` makes the
+server answer 429 above that many requests per second.  Single
+redactions are paced by the client's ``http.rate`` (``--client-rate``).
+
+Usage::
+
+    PYTHONPATH=.:framework python benchmarks/bench_fake_homeserver.py \
+        [--rooms 20] [--events 5000] [--redact 1000] [--latency 0.002] [--rate-limit 0] \
+        [--client-rate 20]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from mautrix.types import EventType, PaginationDirection, RoomEventFilter, RoomID, SyncToken
+from catcord_bots.config import RequestPolicy
+from catcord_bots.matrix import MatrixSession, create_client
+from cleaner.cleaner import init_db
+from cleaner.event_main import build_sync_filter
+from cleaner.outbox import RedactionOutbox, enqueue_redaction
+from tests.fake_homeserver import FakeHomeserver
+
+
+def make_server(args, mass: bool) -> FakeHomeserver:
+    hs = FakeHomeserver(
+        latency=args.latency,
+        rate_limit=args.rate_limit or None,
+        rate_burst=50,
+        mass_redaction=mass,
+    )
+    for i in range(args.rooms):
+        hs.generate_room(args.events, media_fraction=0.3, seed=i)
+    return hs
+
+
+def connect(hs: FakeHomeserver, url: str, args) -> MatrixSession:
+    policy = RequestPolicy(rate=args.client_rate, burst=max(1, int(args.client_rate)))
+    return create_client(hs.user_id, url, "token", policy)
+
+
+async def bench_read(args) -> dict:
+    hs = make_server(args, mass=False)
+    timeline = RoomEventFilter(types=[EventType.ROOM_MESSAGE], contains_url=True)
+    async with hs.serve() as url:
+        session = connect(hs, url, args)
+        try:
+            start = time.perf_counter()
+            filter_id = await session.client.create_filter(build_sync_filter([], e2ee=False))
+            data = await session.client.sync(timeout=0, filter_id=filter_id)
+            sync_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            pages = events = 0
+            for room_id, room in data["rooms"]["join"].items():
+                token = room["timeline"]["prev_batch"]
+                while token:
+                    resp = await session.client.get_messages(
+                        RoomID(room_id), PaginationDirection.BACKWARD,
+                        from_token=SyncToken(token), limit=100, filter_json=timeline,
+                    )
+                    pages += 1
+                    events += len(resp.events)
+                    token = resp.end
+            paginate_s = time.perf_counter() - start
+        finally:
+            await session.close()
+    return {"sync": sync_s, "paginate": paginate_s, "pages": pages, "events": events}
+
+
+async def bench_redact(args, mass: bool) -> dict:
+    hs = make_server(args, mass=mass)
+    targets = [
+        (e["event_id"], room_id)
+        for room_id in sorted(hs.rooms)
+        for e in hs.messages(room_id)
+        if "url" in e["content"]
+    ][:args.redact]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        for event_id, room_id in targets:
+            enqueue_redaction(conn, event_id, room_id, "benchmark")
+        conn.commit()
+        async with hs.serve() as url:
+            session = connect(hs, url, args)
+            try:
+                outbox = RedactionOutbox(session, conn, min_interval=0.0, mass_batch=100 if mass else 0)
+                start = time.perf_counter()
+                left = await outbox.drain()
+                seconds = time.perf_counter() - start
+            finally:
+                await session.close()
+        conn.close()
+    return {"seconds": seconds, "left": left, "requests": hs.counts["redact"] + hs.counts["send"]}
+
+
+async def run(args) -> None:
+    read = await bench_read(args)
+    print(f"rooms:       {args.rooms:>8}   events/room {args.events:,}   latency {args.latency * 1000:.1f}ms")
+    print(f"sync:        {read['sync']:>8.3f}s")
+    print(f"paginate:    {read['paginate']:>8.3f}s   {read['pages']:,} pages, "
+          f"{read['events'] / read['paginate']:,.0f} events/s")
+    for mass in (False, True):
+        result = await bench_redact(args, mass)
+        label = "mass redact" if mass else "redact"
+        print(f"{label + ':':12} {result['seconds']:>8.3f}s   {args.redact / result['seconds']:,.0f} events/s, "
+              f"{result['requests']:,} requests, {result['left']} left")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--rooms", type=int, default=20)
+    p.add_argument("--events", type=int, default=5000)
+    p.add_argument("--redact", type=int, default=1000)
+    p.add_argument("--latency", type=float, default=0.002)
+    p.add_argument("--rate-limit", type=float, default=0)
+    p.add_argument("--client-rate", type=float, default=RequestPolicy().rate)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare the parallel media scanner with a single-threaded ``os.walk``.
+
+Both sides stat every file so they return the same ``(path, size, mtime)``
+data.  Without ``--path`` a synthetic Synapse-style store is generated.
+Drop the page cache between runs (``echo 3 > /proc/sys/vm/drop_caches``)
+to measure true cold scans.
+
+Usage::
+
+    PYTHONPATH=.:framework python benchmarks/bench_scan.py [--path /srv/media] \
+        [--files 100000] [--workers 16]
+"""
+import argparse
+import os
+import tempfile
+import time
+from cleaner.scan import scan_media
+
+
+def make_store(root: str, files: int) -> None:
+    """Create a synthetic ``local_content/ab/cd/<id>`` tree.
+
+    :param root: Directory to populate
+    :type root: str
+    :param files: Number of files to create
+    :type files: int
+    """
+    for i in range(files):
+        h = f"{i:08x}"
+        d = os.path.join(root, "local_content", h[-2:], h[-4:-2])
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, h), "wb") as f:
+            f.write(b"x")
+
+
+def walk_records(root: str) -> int:
+    count = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            st = os.stat(os.path.join(dirpath, name))
+            count += st.st_size >= 0
+    return count
+
+
+def timed(fn) -> tuple[int, float]:
+    start = time.perf_counter()
+    n = fn()
+    return n, time.perf_counter() - start
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--path")
+    p.add_argument("--files", type=int, default=100000)
+    p.add_argument("--workers", type=int, default=16)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = args.path
+        if not root:
+            root = tmpdir
+            make_store(root, args.files)
+        walk_n, walk_s = timed(lambda: walk_records(root))
+        scan_n, scan_s = timed(lambda: sum(1 for _ in scan_media(root, args.workers)))
+    print(f"os.walk:    {walk_n:>10,} files  {walk_s:.3f}s")
+    print(f"scan_media: {scan_n:>10,} files  {scan_s:.3f}s  ({args.workers} workers)")
+    if scan_s:
+        print(f"speedup:    {walk_s / scan_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare /sync payload size of the legacy and lean cleaner sync filters.
+
+Runs one initial sync (``timeout=0``) per filter against the homeserver in
+the given cleaner config and prints the size of each JSON response.
+
+Usage::
+
+    PYTHONPATH=.:framework python benchmarks/bench_sync_filter.py \
+        --config cleaner/config.yaml [--e2ee]
+"""
+import argparse
+import asyncio
+import json
+import time
+from mautrix.types import EventType, Filter, EventFilter, RoomFilter, RoomEventFilter
+from catcord_bots.config import load_yaml, FrameworkConfig
+from catcord_bots.matrix import create_client
+from cleaner.event_main import build_sync_filter
+
+
+def legacy_sync_filter() -> Filter:
+    """Return the filter the event daemon used before the lean filter.
+
+    :return: Legacy sync filter
+    :rtype: Filter
+    """
+    return Filter(
+        account_data=EventFilter(not_types=["*"]),
+        room=RoomFilter(
+            account_data=RoomEventFilter(not_types=["*"]),
+            timeline=RoomEventFilter(types=[EventType.ROOM_MESSAGE, EventType.ROOM_ENCRYPTED]),
+        ),
+    )
+
+
+async def measure(session, sync_filter: Filter) -> tuple[int, float]:
+    """Run one initial sync with an inline filter.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param sync_filter: Filter to apply
+    :type sync_filter: Filter
+    :return: Response size in bytes and duration in seconds
+    :rtype: tuple[int, float]
+    """
+    start = time.perf_counter()
+    data = await session.api.request(
+        method="GET",
+        path="/_matrix/client/v3/sync",
+        query_params={
+            "timeout": "0",
+            "filter": json.dumps(sync_filter.serialize()),
+        },
+    )
+    duration = time.perf_counter() - start
+    return len(json.dumps(data).encode("utf-8")), duration
+
+
+async def main_async(args) -> None:
+    raw = load_yaml(args.config)
+    cfg = FrameworkConfig.from_dict(raw)
+    session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token, cfg.http)
+    try:
+        before = await measure(session, legacy_sync_filter())
+        after = await measure(session, build_sync_filter(cfg.rooms_allowlist, args.e2ee))
+    finally:
+        await session.close()
+    print(f"legacy filter: {before[0]:>12,} bytes  {before[1]:.3f}s")
+    print(f"lean filter:   {after[0]:>12,} bytes  {after[1]:.3f}s")
+    if before[0]:
+        print(f"reduction:     {100 * (1 - after[0] / before[0]):.1f}%")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--config", default="/config/config.yaml")
+    p.add_argument("--e2ee", action="store_true", help="Benchmark the E2EE variant")
+    asyncio.run(main_async(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
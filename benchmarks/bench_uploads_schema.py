@@ -0,0 +1,188 @@
+"""Compare the flat ``uploads`` table with the interned schema (migrations 8 and 11).
+
+A database at schema version 7 is filled with synthetic uploads, measured,
+then migrated in place and measured again.  Both sides are vacuumed first,
+so file sizes are comparable.  Query times are the best of ``--repeat``
+runs of:
+
+* ``retention``: the full retention query (cron run),
+* ``batch``: one incremental retention batch of ``--batch`` rows,
+* ``pressure``: the full pressure ordering (dry run),
+* ``refill``: the first pressure page, as read by the eviction queue and
+  by a live pressure run,
+* ``per_room``: a per-room byte sum.
+
+Usage::
+
+    PYTHONPATH=.:framework python benchmarks/bench_uploads_schema.py \
+        [--rows 500000] [--rooms 200] [--senders 2000] [--repeat 3] [--batch 100]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from cleaner.cleaner import DAY_MS, Policy, compile_retention_query, pressure_query
+from cleaner.db import MIGRATIONS, connect, migrate
+
+MIMETYPES = ["image/png", "image/jpeg", "image/webp", "video/mp4", "audio/ogg", "application/pdf"]
+SERVERS = ["matrix.example.org", "chat.example.net", "media.example.com"]
+
+
+def make_rows(rows: int, rooms: int, senders: int):
+    rnd = random.Random(0)
+    now = int(time.time() * 1000)
+    for i in range(rows):
+        yield (
+            f"${i:012d}abcdefghijklmnopqrstuvwxyz0123",
+            f"!room{rnd.randrange(rooms):06d}abcdefgh:matrix.example.org",
+            f"@user{rnd.randrange(senders):06d}:matrix.example.org",
+            f"mxc://{rnd.choice(SERVERS)}/{rnd.getrandbits(128):032x}",
+            rnd.choice(MIMETYPES),
+            rnd.randrange(1, 50 * 1024 * 1024),
+            now - rnd.randrange(365 * 86400 * 1000),
+        )
+
+
+def build_flat(path: str, args) -> sqlite3.Connection:
+    """Create a version 7 database holding ``args.rows`` uploads.
+
+    :param path: Database path
+    :type path: str
+    :param args: Parsed arguments
+    :return: Open connection
+    :rtype: sqlite3.Connection
+    """
+    conn = connect(path)
+    for statements in MIGRATIONS[:7]:
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("PRAGMA user_version = 7")
+    conn.executemany(
+        "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+        make_rows(args.rows, args.rooms, args.senders),
+    )
+    conn.commit()
+    return conn
+
+
+def db_size(conn: sqlite3.Connection, path: str) -> int:
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+def best_of(conn: sqlite3.Connection, sql: str, params, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def flat_retention_query(policy: Policy, now_ms: int):
+    """Retention query as compiled for the flat schema (version 7)."""
+    rules = policy.effective_rules()
+    whens, params = [], []
+    for i, rule in enumerate(rules):
+        params += [i, now_ms - rule.max_age_days * DAY_MS]
+    for i, rule in enumerate(rules):
+        whens.append(f"WHEN COALESCE(mimetype, '') GLOB ? THEN {i}")
+    params += [r.mimetype for r in rules]
+    params.append(max(p for p in params[1:2 * len(rules):2]))
+    values = ", ".join("(?, ?)" for _ in rules)
+    sql = f"""
+        WITH rules(idx, cutoff) AS (VALUES {values})
+        SELECT u.event_id, u.room_id, u.mxc_uri, u.mimetype, u.size, u.timestamp, u.rule
+        FROM (
+            SELECT event_id, room_id, mxc_uri, mimetype, size, timestamp,
+                   CASE {' '.join(whens)} END AS rule
+            FROM uploads
+            WHERE timestamp < ?
+        ) u
+        JOIN rules r ON r.idx = u.rule
+        WHERE u.timestamp < r.cutoff
+        ORDER BY (u.mimetype LIKE 'image/%') ASC, u.timestamp ASC, u.size DESC
+    """
+    return sql, params
+
+
+FLAT_PRESSURE = """
+    SELECT event_id, room_id, sender, mxc_uri, mimetype, size, timestamp
+    FROM uploads
+    ORDER BY (mimetype LIKE 'image/%') ASC, size DESC, timestamp ASC
+"""
+
+
+def measure(conn: sqlite3.Connection, path: str, repeat: int, batch: int, interned: bool) -> dict:
+    """Time the hot queries the cleaner runs against either schema.
+
+    :param conn: Open connection
+    :type conn: sqlite3.Connection
+    :param path: Database path
+    :type path: str
+    :param repeat: Runs per query
+    :type repeat: int
+    :param batch: Rows per incremental retention batch
+    :type batch: int
+    :param interned: Use the ``upload_records`` queries instead of the flat ones
+    :type interned: bool
+    :return: Size and best query times
+    :rtype: dict
+    """
+    now_ms = int(time.time() * 1000)
+    if interned:
+        retention = compile_retention_query(Policy(), now_ms)
+        expire = compile_retention_query(Policy(), now_ms, limit=batch)
+        pressure = pressure_query()
+        refill = pressure_query(256)
+        per_room = ("SELECT r.room_id, t.bytes FROM (SELECT room, SUM(size) AS bytes "
+                    "FROM upload_records GROUP BY room) t LEFT JOIN rooms r ON r.id = t.room", [])
+    else:
+        retention = flat_retention_query(Policy(), now_ms)
+        expire = (retention[0] + " LIMIT ?", retention[1] + [batch])
+        pressure = (FLAT_PRESSURE, [])
+        refill = (FLAT_PRESSURE + " LIMIT ?", [256])
+        per_room = ("SELECT room_id, SUM(size) FROM uploads GROUP BY room_id", [])
+    return {
+        "size": db_size(conn, path),
+        "retention": best_of(conn, *retention, repeat),
+        "batch": best_of(conn, *expire, repeat),
+        "pressure": best_of(conn, *pressure, repeat),
+        "refill": best_of(conn, *refill, repeat),
+        "per_room": best_of(conn, *per_room, repeat),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--rows", type=int, default=500000)
+    p.add_argument("--rooms", type=int, default=200)
+    p.add_argument("--senders", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--batch", type=int, default=100)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/uploads.db"
+        conn = build_flat(path, args)
+        before = measure(conn, path, args.repeat, args.batch, interned=False)
+        start = time.perf_counter()
+        migrate(conn)
+        migrate_s = time.perf_counter() - start
+        after = measure(conn, path, args.repeat, args.batch, interned=True)
+        conn.close()
+
+    print(f"rows:       {args.rows:>12,}   migration {migrate_s:.2f}s")
+    print(f"{'':10}  {'flat':>12}  {'interned':>12}  {'ratio':>6}")
+    mib = 1024 * 1024
+    print(f"{'db size':10}  {before['size'] / mib:>10.1f}MB  {after['size'] / mib:>10.1f}MB  "
+          f"{after['size'] / before['size']:>6.2f}")
+    for key in ("retention", "batch", "pressure", "refill", "per_room"):
+        print(f"{key:10}  {before[key]:>11.3f}s  {after[key]:>11.3f}s  {after[key] / before[key]:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""Live disk accounting for the media store via inotify.
+
+:class:`MediaAccounting` keeps running byte and file counters per shard,
+per mimetype class and per room.  It is seeded once from a scan of the
+store and the uploads index, then kept current by inotify events, so
+pressure checks and summaries never walk the store.
+
+inotify is Linux only and is reached through ``ctypes``; call
+:func:`inotify_available` before :meth:`MediaAccounting.start`.
+"""
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import sqlite3
+import struct
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cleaner.db import mime_class
+from cleaner.scan import scan_media
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+UNKNOWN = "unknown"
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def inotify_available() -> bool:
+    """Check whether inotify can be used on this platform.
+
+    :return: True on Linux with an inotify-capable libc
+    :rtype: bool
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(_load_libc(), "inotify_init1")
+    except OSError:
+        return False
+
+
+def media_id_for_path(media_root: str, path: str) -> Optional[str]:
+    """Recover the media ID from a Synapse local media path.
+
+    ``local_content/ab/cd/efgh`` and thumbnails under
+    ``local_thumbnails/ab/cd/efgh/`` both map to ``abcdefgh``.
+
+    :param media_root: Media store root
+    :type media_root: str
+    :param path: File path under the root
+    :type path: str
+    :return: Media ID, ``None`` for remote or unrecognised paths
+    :rtype: Optional[str]
+    """
+    parts = os.path.relpath(path, media_root).split(os.sep)
+    if len(parts) >= 4 and parts[0] in ("local_content", "local_thumbnails"):
+        return "".join(parts[1:4])
+    return None
+
+
+def shard_for_path(media_root: str, path: str) -> str:
+    """Return the two-level shard directory a file lives in, e.g. ``local_content/ab``."""
+    parts = os.path.relpath(path, media_root).split(os.sep)[:-1]
+    return "/".join(parts[:2]) if parts else "."
+
+
+class MediaAccounting:
+    """In-memory usage counters for the media store.
+
+    Per-shard, per-class and per-room counters are logical sizes.  The
+    disk total counts each inode once, so hardlinked duplicates are not
+    counted twice.  :meth:`usage_ratio` adds the tracked change since the
+    last ``statvfs`` to that reading and re-reads ``statvfs`` every
+    ``resync_interval`` seconds to pick up writes outside the store.
+
+    :param media_root: Media store root
+    :type media_root: str
+    :param resync_interval: Seconds between ``statvfs`` re-reads
+    :type resync_interval: float
+    """
+
+    def __init__(self, media_root: str, resync_interval: float = 300.0) -> None:
+        self.media_root = media_root
+        self.resync_interval = resync_interval
+        self.files: Dict[str, Tuple[int, Tuple[int, int], Optional[str]]] = {}
+        self.inodes: Dict[Tuple[int, int], List[int]] = {}
+        self.uploads: Dict[str, Tuple[str, str]] = {}
+        self.by_shard: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self.by_class: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self.by_room: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self.disk_bytes = 0
+        self.degraded = False
+        self._media_paths: Dict[str, Set[str]] = defaultdict(set)
+        self._base: Optional[Tuple[int, int, int]] = None
+        self._synced_at = 0.0
+        self._fd: Optional[int] = None
+        self._wds: Dict[int, str] = {}
+        self._reseed_task: Optional[asyncio.Task] = None
+
+    def _bump(self, path: str, size: int, media_id: Optional[str], sign: int) -> None:
+        room, cls = self.uploads.get(media_id or "", (UNKNOWN, UNKNOWN))
+        for counter, key in (
+            (self.by_shard, shard_for_path(self.media_root, path)),
+            (self.by_class, cls),
+            (self.by_room, room),
+        ):
+            entry = counter[key]
+            entry[0] += sign * size
+            entry[1] += sign
+            if entry[1] <= 0:
+                del counter[key]
+
+    def add_file(self, path: str, st: os.stat_result) -> None:
+        """Count a created or rewritten file.
+
+        :param path: File path
+        :type path: str
+        :param st: Stat result of the file
+        :type st: os.stat_result
+        """
+        self.remove_file(path)
+        key = (st.st_dev, st.st_ino)
+        media_id = media_id_for_path(self.media_root, path)
+        self.files[path] = (st.st_size, key, media_id)
+        if media_id:
+            self._media_paths[media_id].add(path)
+        self._bump(path, st.st_size, media_id, 1)
+        inode = self.inodes.get(key)
+        if inode is None:
+            self.inodes[key] = [st.st_size, 1]
+            self.disk_bytes += st.st_size
+        else:
+            inode[1] += 1
+
+    def remove_file(self, path: str) -> None:
+        """Stop counting a deleted or moved-away file.
+
+        :param path: File path
+        :type path: str
+        """
+        entry = self.files.pop(path, None)
+        if entry is None:
+            return
+        size, key, media_id = entry
+        if media_id:
+            self._media_paths[media_id].discard(path)
+            if not self._media_paths[media_id]:
+                del self._media_paths[media_id]
+        self._bump(path, size, media_id, -1)
+        inode = self.inodes[key]
+        inode[1] -= 1
+        if inode[1] <= 0:
+            del self.inodes[key]
+            self.disk_bytes -= inode[0]
+
+    def remove_tree(self, path: str) -> None:
+        """Stop counting every file under a removed directory."""
+        prefix = path.rstrip(os.sep) + os.sep
+        for p in [p for p in self.files if p.startswith(prefix)]:
+            self.remove_file(p)
+
+    def note_upload(self, mxc_uri: str, room_id: str, mimetype: str) -> None:
+        """Attribute a media ID to its room and mimetype class.
+
+        Files usually land before the upload event arrives; their bytes move
+        from ``unknown`` to the room and class here.
+
+        :param mxc_uri: MXC URI of the upload
+        :type mxc_uri: str
+        :param room_id: Upload room
+        :type room_id: str
+        :param mimetype: Upload mimetype
+        :type mimetype: str
+        """
+        if not isinstance(mxc_uri, str) or "/" not in mxc_uri[6:]:
+            return
+        media_id = mxc_uri[6:].split("/", 1)[1]
+        paths = list(self._media_paths.get(media_id, ()))
+        for p in paths:
+            self._bump(p, self.files[p][0], media_id, -1)
+        self.uploads[media_id] = (room_id, mime_class(mimetype))
+        for p in paths:
+            self._bump(p, self.files[p][0], media_id, 1)
+
+    def load_uploads(self, conn: sqlite3.Connection) -> None:
+        """Attribute every indexed upload.
+
+        :param conn: Uploads database connection
+        :type conn: sqlite3.Connection
+        """
+        for mxc_uri, room_id, mimetype in conn.execute(
+            "SELECT mxc_uri, room_id, mimetype FROM uploads"
+        ):
+            self.note_upload(mxc_uri, room_id, mimetype)
+
+    def usage_ratio(self) -> float:
+        """Estimate disk usage of the media filesystem.
+
+        :return: Used fraction between 0 and 1
+        :rtype: float
+        """
+        now = time.monotonic()
+        if self._base is None or self.degraded or now - self._synced_at >= self.resync_interval:
+            st = os.statvfs(self.media_root)
+            self._base = ((st.f_blocks - st.f_bavail) * st.f_frsize, st.f_blocks * st.f_frsize, self.disk_bytes)
+            self._synced_at = now
+        used, total, base_disk = self._base
+        return min(1.0, max(0.0, (used + self.disk_bytes - base_disk) / total))
+
+    def summary(self, top: int = 3) -> Dict[str, Any]:
+        """Return totals and the largest rooms, classes and shards.
+
+        :param top: Entries per breakdown
+        :type top: int
+        :return: JSON-serialisable summary
+        :rtype: Dict[str, Any]
+        """
+        def largest(counter: Dict[str, List[int]]) -> List[Dict[str, Any]]:
+            items = sorted(counter.items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+            return [{"key": k, "bytes": b, "files": n} for k, (b, n) in items]
+
+        return {
+            "files": len(self.files),
+            "disk_bytes": self.disk_bytes,
+            "rooms": largest(self.by_room),
+            "classes": largest(self.by_class),
+            "shards": largest(self.by_shard),
+        }
+
+    def format_summary(self, top: int = 3) -> str:
+        """Render the largest rooms and classes as two short lines.
+
+        :param top: Entries per line
+        :type top: int
+        :return: Human-readable breakdown
+        :rtype: str
+        """
+        summary = self.summary(top)
+
+        def line(label: str, entries: List[Dict[str, Any]]) -> str:
+            parts = [f"{e['key']} {e['bytes'] / 1024 ** 3:.2f} GB" for e in entries]
+            return f"{label}: {', '.join(parts) if parts else 'none'}"
+
+        return "\n".join([line("largest_rooms", summary["rooms"]), line("largest_types", summary["classes"])])
+
+    def _watch(self, path: str) -> None:
+        wd = _load_libc().inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed for {path}: {os.strerror(err)}")
+        self._wds[wd] = path
+
+    def _watch_tree(self, root: str) -> None:
+        for dirpath, _, _ in os.walk(root):
+            self._watch(dirpath)
+
+    @staticmethod
+    def _stat_tree(root: str) -> List[Tuple[str, os.stat_result]]:
+        found = []
+        for f in scan_media(root):
+            try:
+                found.append((f.path, os.stat(f.path)))
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _seed(self, found: List[Tuple[str, os.stat_result]]) -> None:
+        for path, st in found:
+            self.add_file(path, st)
+
+    async def start(self, conn: Optional[sqlite3.Connection] = None) -> None:
+        """Watch the store, then seed counters from one scan.
+
+        Watches are added before the scan, so files created meanwhile are
+        counted exactly once.
+
+        :param conn: Uploads database used for room attribution
+        :type conn: Optional[sqlite3.Connection]
+        :raises OSError: When inotify is unavailable or the watch limit is hit
+        """
+        if not inotify_available():
+            raise OSError("inotify is not available on this platform")
+        fd = _load_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._fd = fd
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._watch_tree, self.media_root)
+            if conn is not None:
+                self.load_uploads(conn)
+            self._seed(await loop.run_in_executor(None, self._stat_tree, self.media_root))
+        except Exception:
+            self.close()
+            raise
+        loop.add_reader(fd, self._on_readable)
+
+    def close(self) -> None:
+        """Stop watching and release the inotify descriptor."""
+        if self._reseed_task is not None:
+            self._reseed_task.cancel()
+            self._reseed_task = None
+        if self._fd is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._fd)
+        except RuntimeError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+        self._wds.clear()
+
+    async def _reseed(self) -> None:
+        print("inotify queue overflow; re-seeding media accounting", flush=True)
+        found = await asyncio.get_running_loop().run_in_executor(None, self._stat_tree, self.media_root)
+        self.files.clear()
+        self.inodes.clear()
+        self._media_paths.clear()
+        self.by_shard.clear()
+        self.by_class.clear()
+        self.by_room.clear()
+        self.disk_bytes = 0
+        self._base = None
+        self._seed(found)
+        self._reseed_task = None
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            name = os.fsdecode(data[start:start + length].rstrip(b"\0"))
+            offset = start + length
+            try:
+                self._handle(wd, mask, name)
+            except Exception as e:
+                print(f"Media accounting event failed: {e!r}", flush=True)
+
+    def _handle(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            if self._reseed_task is None:
+                self._reseed_task = asyncio.ensure_future(self._reseed())
+            return
+        directory = self._wds.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    # Unwatched directories make the counters drift; fall back to statvfs.
+                    print(f"Media accounting degraded: {e}", flush=True)
+                    self.degraded = True
+                self._seed(self._stat_tree(path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove_tree(path)
+            return
+        if mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+            try:
+                self.add_file(path, os.stat(path))
+            except FileNotFoundError:
+                self.remove_file(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.remove_file(path)
@@ -0,0 +1,259 @@
+"""Compressed cold-storage tier for expired media.
+
+Archived files are appended to per-day archives (by upload date) on a
+second mount.  Every file is written as its own compressed member, gzip
+or xz from the standard library, and its offset and compressed length are
+recorded in the ``archived_media`` table.  A single file can then be
+restored by seeking to its member and decompressing only that range.
+"""
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import lzma
+import os
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from cleaner.dedupe import remove_media_file, unlink_media
+
+CHUNK_SIZE = 1024 * 1024
+SUFFIXES = {"gzip": ".gz", "lzma": ".xz"}
+
+
+def _compressor(compression: str):
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "lzma":
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+    raise ValueError(f"Unsupported archive compression: {compression}")
+
+
+def _decompressor(compression: str):
+    if compression == "gzip":
+        return zlib.decompressobj(31)
+    if compression == "lzma":
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    raise ValueError(f"Unsupported archive compression: {compression}")
+
+
+def archive_path(archive_root: str, timestamp_ms: int, compression: str) -> str:
+    """Return the per-day archive for an upload timestamp.
+
+    :param archive_root: Archive mount
+    :type archive_root: str
+    :param timestamp_ms: Upload timestamp in milliseconds
+    :type timestamp_ms: int
+    :param compression: ``gzip`` or ``lzma``
+    :type compression: str
+    :return: Archive file path
+    :rtype: str
+    """
+    day = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+    return os.path.join(archive_root, f"{day}{SUFFIXES[compression]}")
+
+
+def append_member(archive: str, src: str, compression: str) -> Tuple[int, int]:
+    """Stream ``src`` into ``archive`` as one compressed member.
+
+    The archive is locked while appending, so the cron cleaner and the
+    event daemon can archive into the same day concurrently.
+
+    :param archive: Archive file path
+    :type archive: str
+    :param src: File to archive
+    :type src: str
+    :param compression: ``gzip`` or ``lzma``
+    :type compression: str
+    :return: Member offset and compressed length
+    :rtype: Tuple[int, int]
+    """
+    comp = _compressor(compression)
+    os.makedirs(os.path.dirname(archive) or ".", exist_ok=True)
+    with open(archive, "ab") as out, open(src, "rb") as f:
+        fcntl.flock(out, fcntl.LOCK_EX)
+        try:
+            offset = out.seek(0, os.SEEK_END)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                out.write(comp.compress(chunk))
+            out.write(comp.flush())
+            out.flush()
+            os.fsync(out.fileno())
+            return offset, out.tell() - offset
+        finally:
+            fcntl.flock(out, fcntl.LOCK_UN)
+
+
+def archive_files(
+    conn: sqlite3.Connection,
+    archive_root: str,
+    compression: str,
+    event_id: str,
+    room_id: str,
+    mxc_uri: str,
+    timestamp_ms: int,
+    paths: List[str],
+) -> int:
+    """Move media files into the archive tier.
+
+    Each file is recorded in ``archived_media`` before it is unlinked from
+    the primary store.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param archive_root: Archive mount
+    :type archive_root: str
+    :param compression: ``gzip`` or ``lzma``
+    :type compression: str
+    :param event_id: Upload event ID
+    :type event_id: str
+    :param room_id: Room of the upload event
+    :type room_id: str
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :param timestamp_ms: Upload timestamp in milliseconds
+    :type timestamp_ms: int
+    :param paths: Media files of the upload
+    :type paths: List[str]
+    :return: Bytes freed on the primary disk
+    :rtype: int
+    """
+    archive = archive_path(archive_root, timestamp_ms, compression)
+    freed = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        offset, length = append_member(archive, path, compression)
+        _record_member(conn, path, event_id, room_id, mxc_uri, archive, offset, length, size, compression)
+        freed += unlink_media(conn, path)
+    conn.commit()
+    return freed
+
+
+async def archive_files_async(
+    conn: sqlite3.Connection,
+    archive_root: str,
+    compression: str,
+    event_id: str,
+    room_id: str,
+    mxc_uri: str,
+    timestamp_ms: int,
+    paths: List[str],
+) -> int:
+    """Like :func:`archive_files`, for callers on the event loop.
+
+    Compressing, fsyncing and unlinking run in an executor thread; only the
+    ``archived_media`` writes run on the loop, since the connection belongs
+    to it.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param archive_root: Archive mount
+    :type archive_root: str
+    :param compression: ``gzip`` or ``lzma``
+    :type compression: str
+    :param event_id: Upload event ID
+    :type event_id: str
+    :param room_id: Room of the upload event
+    :type room_id: str
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :param timestamp_ms: Upload timestamp in milliseconds
+    :type timestamp_ms: int
+    :param paths: Media files of the upload
+    :type paths: List[str]
+    :return: Bytes freed on the primary disk
+    :rtype: int
+    """
+    loop = asyncio.get_running_loop()
+    archive = archive_path(archive_root, timestamp_ms, compression)
+    freed = 0
+    for path in paths:
+        size, (offset, length) = await loop.run_in_executor(
+            None, lambda: (os.path.getsize(path), append_member(archive, path, compression))
+        )
+        _record_member(conn, path, event_id, room_id, mxc_uri, archive, offset, length, size, compression)
+        freed += await loop.run_in_executor(None, remove_media_file, path)
+        conn.execute("DELETE FROM media_hashes WHERE path = ?", (path,))
+    conn.commit()
+    return freed
+
+
+def _record_member(
+    conn: sqlite3.Connection, path: str, event_id: str, room_id: str, mxc_uri: str,
+    archive: str, offset: int, length: int, size: int, compression: str,
+) -> None:
+    # Committed before the source is unlinked, so a crash never loses the file.
+    conn.execute(
+        "INSERT OR REPLACE INTO archived_media "
+        "(path, event_id, room_id, mxc_uri, archive, offset, length, size, "
+        "compression, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (path, event_id, room_id, mxc_uri, archive, offset, length, size,
+         compression, int(time.time() * 1000)),
+    )
+    conn.commit()
+
+
+def restore_file(conn: sqlite3.Connection, path: str, dest: Optional[str] = None) -> int:
+    """Stream one archived file back out by offset.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param path: Original media path of the archived file
+    :type path: str
+    :param dest: Output path, defaults to the original path
+    :type dest: Optional[str]
+    :return: Bytes written
+    :rtype: int
+    :raises KeyError: When the file is not archived
+    :raises ValueError: When the restored size does not match the index
+    """
+    row = conn.execute(
+        "SELECT archive, offset, length, size, compression FROM archived_media WHERE path = ?",
+        (path,),
+    ).fetchone()
+    if row is None:
+        raise KeyError(path)
+    archive, offset, length, size, compression = row
+    dest = dest or path
+    decomp = _decompressor(compression)
+    tmp = f"{dest}.restore-tmp"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    written = 0
+    try:
+        with open(archive, "rb") as f, open(tmp, "wb") as out:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                data = decomp.decompress(chunk)
+                out.write(data)
+                written += len(data)
+        if written != size:
+            raise ValueError(f"Restored {written} bytes for {path}, expected {size}")
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return written
+
+
+def archived_paths(conn: sqlite3.Connection, mxc_uri: str) -> List[str]:
+    """List archived files belonging to an MXC URI.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :return: Original media paths
+    :rtype: List[str]
+    """
+    rows = conn.execute(
+        "SELECT path FROM archived_media WHERE mxc_uri = ? ORDER BY path", (mxc_uri,)
+    ).fetchall()
+    return [r[0] for r in rows]
@@ -0,0 +1,223 @@
+"""Backfill of timeline gaps left by limited syncs.
+
+When a room's sync timeline comes back with ``limited: true`` the server
+skipped events between ``prev_batch`` and the last event the daemon saw.
+:class:`GapBackfill` remembers the newest handled event per room in the
+``room_cursors`` table and pages ``/messages`` backwards from
+``prev_batch`` down to it in background tasks, handing every event to the
+regular message handler.  Backfills are bounded in pages per gap and in
+concurrent rooms, and never block the sync loop.
+
+Each gap is stored in ``backfill_gaps`` (room, pagination token, old
+cursor) in the same commit that advances the room cursor.  The token is
+moved forward after every page and the row is deleted only once the
+backfill reaches the old cursor, so gaps cut short by ``max_pages``, an
+error, cancellation or a restart are resumed by :meth:`GapBackfill.resume`.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from mautrix.types import PaginationDirection, RoomEventFilter, RoomID, SyncToken
+
+from catcord_bots.matrix import MatrixSession
+
+# (event_id, timestamp) of the newest handled timeline event.
+Cursor = Tuple[str, int]
+
+
+class GapBackfill:
+    """Schedules and runs backfills for limited sync timelines.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param handler: Called with each backfilled event
+    :type handler: Callable[[Any], Awaitable[None]]
+    :param timeline_filter: Filter applied to ``/messages``, same as the sync timeline
+    :type timeline_filter: Optional[RoomEventFilter]
+    :param concurrency: Rooms backfilled at once
+    :type concurrency: int
+    :param page_size: Events per ``/messages`` request
+    :type page_size: int
+    :param max_pages: Pages fetched per gap before giving up
+    :type max_pages: int
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        conn: sqlite3.Connection,
+        handler: Callable[[Any], Awaitable[None]],
+        timeline_filter: Optional[RoomEventFilter] = None,
+        concurrency: int = 4,
+        page_size: int = 100,
+        max_pages: int = 50,
+    ) -> None:
+        self.session = session
+        self.conn = conn
+        self.handler = handler
+        self.timeline_filter = timeline_filter
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self.cursors: Dict[str, Cursor] = {
+            room: (event_id, ts)
+            for room, event_id, ts in conn.execute(
+                "SELECT room_id, event_id, timestamp FROM room_cursors"
+            )
+        }
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def close(self) -> None:
+        """Cancel running backfills."""
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def note_sync(self, data: Dict[str, Any]) -> int:
+        """Schedule backfills for limited timelines and advance the cursors.
+
+        Call with the raw sync response before it is handled.
+
+        :param data: Sync response
+        :type data: Dict[str, Any]
+        :return: Backfills scheduled
+        :rtype: int
+        """
+        gaps = []
+        updates = []
+        for room_id, room in ((data.get("rooms") or {}).get("join") or {}).items():
+            timeline = room.get("timeline") or {}
+            events = timeline.get("events") or []
+            if timeline.get("limited") and timeline.get("prev_batch"):
+                cursor = self.cursors.get(room_id)
+                if cursor is None:
+                    print(f"Limited timeline in {room_id} with no cursor, not backfilling", flush=True)
+                else:
+                    gap_id = self.conn.execute(
+                        "INSERT INTO backfill_gaps (room_id, from_token, event_id, timestamp) VALUES (?, ?, ?, ?)",
+                        (room_id, timeline["prev_batch"], *cursor),
+                    ).lastrowid
+                    gaps.append((room_id, timeline["prev_batch"], cursor, gap_id))
+            if events:
+                last = events[-1]
+                cursor = (str(last.get("event_id")), int(last.get("origin_server_ts") or 0))
+                self.cursors[room_id] = cursor
+                updates.append((room_id, *cursor))
+        if updates:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO room_cursors (room_id, event_id, timestamp) VALUES (?, ?, ?)",
+                updates,
+            )
+        if gaps or updates:
+            self.conn.commit()
+        for gap in gaps:
+            self.schedule(*gap)
+        return len(gaps)
+
+    def resume(self) -> int:
+        """Schedule the gaps left unfinished by a previous run.
+
+        :return: Backfills scheduled
+        :rtype: int
+        """
+        rows = self.conn.execute(
+            "SELECT id, room_id, from_token, event_id, timestamp FROM backfill_gaps ORDER BY id"
+        ).fetchall()
+        for gap_id, room_id, token, event_id, ts in rows:
+            self.schedule(room_id, token, (event_id, ts), gap_id)
+        if rows:
+            print(f"Resuming {len(rows)} backfill gaps", flush=True)
+        return len(rows)
+
+    def schedule(
+        self, room_id: str, from_token: str, cursor: Cursor, gap_id: Optional[int] = None
+    ) -> None:
+        """Backfill one gap in the background.
+
+        :param room_id: Room with the gap
+        :type room_id: str
+        :param from_token: ``prev_batch`` of the limited timeline
+        :type from_token: str
+        :param cursor: Newest event handled before the gap
+        :type cursor: Cursor
+        :param gap_id: ``backfill_gaps`` row tracking the gap
+        :type gap_id: Optional[int]
+        """
+        task = asyncio.create_task(self._guarded(room_id, from_token, cursor, gap_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _guarded(
+        self, room_id: str, from_token: str, cursor: Cursor, gap_id: Optional[int]
+    ) -> None:
+        async with self._slots:
+            try:
+                handled = await self.backfill(room_id, from_token, cursor, gap_id)
+                print(f"Backfilled {handled} events in {room_id}", flush=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backfill of {room_id} failed: {e!r}", flush=True)
+
+    async def backfill(
+        self, room_id: str, from_token: str, cursor: Cursor, gap_id: Optional[int] = None
+    ) -> int:
+        """Page backwards from ``from_token`` until the cursor is reached.
+
+        With ``gap_id`` the gap's token is advanced after every page and the
+        gap is deleted once the cursor (or the start of the room) is reached.
+
+        :param room_id: Room with the gap
+        :type room_id: str
+        :param from_token: ``prev_batch`` of the limited timeline
+        :type from_token: str
+        :param cursor: Newest event handled before the gap
+        :type cursor: Cursor
+        :param gap_id: ``backfill_gaps`` row tracking the gap
+        :type gap_id: Optional[int]
+        :return: Events handed to the handler
+        :rtype: int
+        """
+        stop_id, stop_ts = cursor
+        token: Optional[str] = from_token
+        handled = 0
+        for _ in range(self.max_pages):
+            resp = await self.session.client.get_messages(
+                RoomID(room_id),
+                direction=PaginationDirection.BACKWARD,
+                from_token=SyncToken(token),
+                limit=self.page_size,
+                filter_json=self.timeline_filter,
+            )
+            for event in resp.events:
+                if str(event.event_id) == stop_id or int(event.timestamp) < stop_ts:
+                    self._close_gap(gap_id)
+                    return handled
+                try:
+                    await self.handler(event)
+                except Exception as e:
+                    print(f"Backfilled event {event.event_id} failed: {e!r}", flush=True)
+                handled += 1
+            token = resp.end
+            if not resp.events or not token:
+                self._close_gap(gap_id)
+                return handled
+            if gap_id is not None:
+                self.conn.execute("UPDATE backfill_gaps SET from_token = ? WHERE id = ?", (token, gap_id))
+                self.conn.commit()
+        print(f"Backfill of {room_id} stopped after {self.max_pages} pages, resuming on restart", flush=True)
+        return handled
+
+    def _close_gap(self, gap_id: Optional[int]) -> None:
+        if gap_id is not None:
+            self.conn.execute("DELETE FROM backfill_gaps WHERE id = ?", (gap_id,))
+            self.conn.commit()
@@ -1,15 +1,26 @@
 from __future__ import annotations
+import asyncio
 import os
 import sqlite3
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+import fnmatch
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict, Any
+from typing import List, Optional, Set, Tuple, Dict, Any, Iterable, Iterator, TYPE_CHECKING
 from mautrix.types import RoomID, EventID, MessageEvent, PaginationDirection
-from catcord_bots.matrix import MatrixSession, send_text
+from catcord_bots.matrix import MatrixSession, notify
 from catcord_bots.state import payload_fingerprint, should_send
 from catcord_bots.formatting import format_retention_stats
 from cleaner.messages import build_status_message, derive_status_label
+from cleaner.db import UPLOAD_COLUMNS_SQL, UPLOAD_JOINS_SQL, open_db
+from cleaner.scan import scan_media
+from cleaner.dedupe import remove_media_file
+from cleaner.archive import archive_files_async
+from cleaner.accounting import MediaAccounting
+from cleaner.outbox import enqueue_redaction
+
+if TYPE_CHECKING:
+    from cleaner.eviction import EvictionQueue
 
 
 def get_disk_usage_ratio(path: str) -> float:
@@ -19,28 +30,18 @@ def get_disk_usage_ratio(path: str) -> float:
 
 def count_media_files(media_root: str) -> int:
     """Count total files under media_root."""
-    count = 0
-    for root, _, files in os.walk(media_root):
-        count += len(files)
-    return count
+    return sum(1 for _ in scan_media(media_root))
 
 
 def init_db(db_path: str) -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.Connection(db_path)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS uploads (
-            event_id TEXT PRIMARY KEY,
-            room_id TEXT,
-            sender TEXT,
-            mxc_uri TEXT,
-            mimetype TEXT,
-            size INTEGER,
-            timestamp INTEGER
-        )
-    """)
-    conn.commit()
-    return conn
+    """Open the uploads index through the shared access layer.
+
+    :param db_path: Path to ``uploads.db``
+    :type db_path: str
+    :return: Open, migrated connection
+    :rtype: sqlite3.Connection
+    """
+    return open_db(db_path)
 
 
 def parse_mxc(mxc: str) -> Optional[Tuple[str, str]]:
@@ -53,16 +54,67 @@ def parse_mxc(mxc: str) -> Optional[Tuple[str, str]]:
 
 
 def find_media_files(media_root: str, mxc: str) -> List[Path]:
-    parsed = parse_mxc(mxc)
-    if not parsed:
-        return []
-    _, media_id = parsed
-    hits: List[Path] = []
-    for root, _, files in os.walk(media_root):
-        for fn in files:
-            if media_id in fn:
-                hits.append(Path(root) / fn)
-    return hits
+    return resolve_media_paths(media_root, [mxc])[mxc]
+
+
+MEDIA_NAME_SEPARATORS = "_-."
+
+
+def media_keys(path: str) -> Set[str]:
+    """Return the media IDs a stored file can belong to.
+
+    A file matches an ID equal to its name, to the part of its name before
+    or after any ``_``, ``-`` or ``.`` (``media_<id>``, ``<id>.png``), or to
+    the ID Synapse splits over ``ab/cd/rest`` directories, for content and
+    thumbnails alike.
+
+    :param path: Media file path
+    :type path: str
+    :return: Candidate media IDs
+    :rtype: Set[str]
+    """
+    parts = path.split(os.sep)
+    base = parts[-1]
+    keys = {base}
+    for i, ch in enumerate(base):
+        if ch in MEDIA_NAME_SEPARATORS:
+            keys.add(base[:i])
+            keys.add(base[i + 1:])
+    for end in (len(parts), len(parts) - 1):
+        if end >= 3 and len(parts[end - 3]) == 2 and len(parts[end - 2]) == 2:
+            keys.add("".join(parts[end - 3:end]))
+    keys.discard("")
+    return keys
+
+
+def resolve_media_paths(media_root: str, mxc_uris: Iterable[str]) -> Dict[str, List[Path]]:
+    """Find the files of many uploads in a single scan of the media store.
+
+    Each scanned file is looked up by its :func:`media_keys` in a dict of the
+    wanted media IDs, so the cost is one pass over the store whatever the
+    number of URIs.
+
+    :param media_root: Media store root
+    :type media_root: str
+    :param mxc_uris: MXC URIs to resolve
+    :type mxc_uris: Iterable[str]
+    :return: Files per MXC URI, empty for unknown or invalid URIs
+    :rtype: Dict[str, List[Path]]
+    """
+    found: Dict[str, List[Path]] = {}
+    ids: Dict[str, List[str]] = {}
+    for mxc in mxc_uris:
+        found[mxc] = []
+        parsed = parse_mxc(mxc)
+        if parsed and parsed[1]:
+            ids.setdefault(parsed[1], []).append(mxc)
+    if not ids:
+        return found
+    for f in scan_media(media_root):
+        owners = {mxc for key in media_keys(f.path) for mxc in ids.get(key, ())}
+        for mxc in owners:
+            found[mxc].append(Path(f.path))
+    return found
 
 
 def extract_mxc_and_info(event) -> tuple[str | None, str, int]:
@@ -125,12 +177,426 @@ async def sync_uploads(session: MatrixSession, conn: sqlite3.Connection, rooms_a
             print(f"Sync error in {room_id}: {e}")
 
 
+async def unlink_upload_files(conn: sqlite3.Connection, paths: Iterable[Path]) -> int:
+    """Remove media files in an executor thread and drop their cached hashes.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param paths: Files to remove
+    :type paths: Iterable[Path]
+    :return: Bytes freed on disk
+    :rtype: int
+    """
+    files = [str(p) for p in paths]
+    if not files:
+        return 0
+    freed = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: sum(remove_media_file(f) for f in files)
+    )
+    conn.executemany("DELETE FROM media_hashes WHERE path = ?", [(f,) for f in files])
+    return freed
+
+
+async def delete_upload(
+    session: MatrixSession,
+    conn: sqlite3.Connection,
+    media_root: str,
+    event_id: str,
+    room_id: str,
+    mxc_uri: str,
+    reason: str,
+    paths: Optional[List[Path]] = None,
+    defer_redaction: bool = False,
+) -> int:
+    """Redact an upload event, unlink its files and drop it from the index.
+
+    With ``defer_redaction`` the files are unlinked first and the redaction
+    is queued in the outbox in the same transaction that drops the index
+    row, so no network round trip happens here.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param event_id: Upload event ID
+    :type event_id: str
+    :param room_id: Room of the upload event
+    :type room_id: str
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :param reason: Redaction reason suffix
+    :type reason: str
+    :param paths: Already resolved media files, found by scanning when omitted
+    :type paths: Optional[List[Path]]
+    :param defer_redaction: Queue the redaction in the outbox instead of sending it
+    :type defer_redaction: bool
+    :return: Bytes freed on disk, excluding files still hardlinked elsewhere
+    :rtype: int
+    :raises Exception: When the redaction request fails
+    """
+    loop = asyncio.get_running_loop()
+    if paths is None:
+        paths = await loop.run_in_executor(None, find_media_files, media_root, mxc_uri)
+    if defer_redaction:
+        # A crash before the commit leaves the row; the next run finds no files and redacts.
+        freed = await unlink_upload_files(conn, paths)
+        enqueue_redaction(conn, event_id, room_id, f"Catcord cleanup: {reason}")
+        conn.execute("DELETE FROM upload_records WHERE event_id = ?", (event_id,))
+        conn.commit()
+        return freed
+    await session.client.redact(RoomID(room_id), EventID(event_id), reason=f"Catcord cleanup: {reason}")
+    freed = await unlink_upload_files(conn, paths)
+    conn.execute("DELETE FROM upload_records WHERE event_id = ?", (event_id,))
+    conn.commit()
+    return freed
+
+
+async def archive_upload(
+    conn: sqlite3.Connection,
+    media_root: str,
+    policy: Policy,
+    event_id: str,
+    room_id: str,
+    mxc_uri: str,
+    timestamp: int,
+    paths: Optional[List[Path]] = None,
+) -> int:
+    """Move an upload's files to the archive tier and drop it from the index.
+
+    The upload event is not redacted; the files can be restored later.
+    Compression and fsync run in an executor thread.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Cleanup policy with ``archive_root`` set
+    :type policy: Policy
+    :param event_id: Upload event ID
+    :type event_id: str
+    :param room_id: Room of the upload event
+    :type room_id: str
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :param timestamp: Upload timestamp in milliseconds
+    :type timestamp: int
+    :param paths: Already resolved media files, found by scanning when omitted
+    :type paths: Optional[List[Path]]
+    :return: Bytes freed on the primary disk
+    :rtype: int
+    """
+    if paths is None:
+        paths = await asyncio.get_running_loop().run_in_executor(
+            None, find_media_files, media_root, mxc_uri
+        )
+    freed = await archive_files_async(
+        conn, policy.archive_root, policy.archive_compression,
+        event_id, room_id, mxc_uri, timestamp, [str(p) for p in paths],
+    )
+    conn.execute("DELETE FROM upload_records WHERE event_id = ?", (event_id,))
+    conn.commit()
+    return freed
+
+
+async def expire_upload(
+    session: MatrixSession,
+    conn: sqlite3.Connection,
+    media_root: str,
+    policy: Policy,
+    rule: int,
+    event_id: str,
+    room_id: str,
+    mxc_uri: str,
+    timestamp: int,
+    reason: str,
+    paths: Optional[List[Path]] = None,
+) -> Tuple[str, int]:
+    """Apply the action of a retention rule to one upload.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param rule: Index into :meth:`Policy.effective_rules`
+    :type rule: int
+    :param event_id: Upload event ID
+    :type event_id: str
+    :param room_id: Room of the upload event
+    :type room_id: str
+    :param mxc_uri: MXC URI of the uploaded media
+    :type mxc_uri: str
+    :param timestamp: Upload timestamp in milliseconds
+    :type timestamp: int
+    :param reason: Redaction reason suffix
+    :type reason: str
+    :param paths: Already resolved media files, found by scanning when omitted
+    :type paths: Optional[List[Path]]
+    :return: Action taken and bytes freed
+    :rtype: Tuple[str, int]
+    """
+    action = policy.effective_rules()[rule].action
+    if action == "archive":
+        return action, await archive_upload(
+            conn, media_root, policy, event_id, room_id, mxc_uri, timestamp, paths
+        )
+    return action, await delete_upload(
+        session, conn, media_root, event_id, room_id, mxc_uri, reason, paths,
+        defer_redaction=policy.redaction_outbox,
+    )
+
+
+DAY_MS = 86400 * 1000
+
+
+@dataclass
+class RetentionRule:
+    """One row of the retention rules table; the first matching rule wins.
+
+    :param mimetype: Mimetype glob, e.g. ``video/*``
+    :type mimetype: str
+    :param room: Room ID the rule is limited to
+    :type room: Optional[str]
+    :param sender: Sender the rule is limited to
+    :type sender: Optional[str]
+    :param min_size: Minimum upload size in bytes
+    :type min_size: int
+    :param max_age_days: Days to keep matching uploads, ``None`` keeps them forever
+    :type max_age_days: Optional[int]
+    :param action: ``delete`` to redact and delete, ``archive`` to move to cold storage
+    :type action: str
+    """
+    mimetype: str = "*"
+    room: Optional[str] = None
+    sender: Optional[str] = None
+    min_size: int = 0
+    max_age_days: Optional[int] = None
+    action: str = "delete"
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "RetentionRule":
+        """Create a rule from a config mapping.
+
+        :param d: Rule configuration
+        :type d: Dict[str, Any]
+        :return: Retention rule
+        :rtype: RetentionRule
+        :raises ValueError: When the action is unknown
+        """
+        age = d.get("max_age_days")
+        action = str(d.get("action") or "delete")
+        if action not in ("delete", "archive"):
+            raise ValueError(f"Unknown retention action: {action}")
+        return RetentionRule(
+            mimetype=str(d.get("mimetype") or "*"),
+            room=d.get("room") or None,
+            sender=d.get("sender") or None,
+            min_size=int(d.get("min_size") or 0),
+            max_age_days=None if age is None else int(age),
+            action=action,
+        )
+
+    def matches(self, room_id: str, sender: str, mimetype: str, size: int) -> bool:
+        """Check whether an upload falls under this rule.
+
+        :param room_id: Upload room
+        :type room_id: str
+        :param sender: Upload sender
+        :type sender: str
+        :param mimetype: Upload mimetype
+        :type mimetype: str
+        :param size: Upload size in bytes
+        :type size: int
+        :return: True if the rule applies
+        :rtype: bool
+        """
+        return (
+            fnmatch.fnmatchcase(mimetype or "", self.mimetype)
+            and (self.room is None or self.room == room_id)
+            and (self.sender is None or self.sender == sender)
+            and (size or 0) >= self.min_size
+        )
+
+
 @dataclass
 class Policy:
     image_days: int = 90
     non_image_days: int = 30
     pressure: float = 0.85
     emergency: float = 0.92
+    rules: List[RetentionRule] = field(default_factory=list)
+    archive_root: Optional[str] = None
+    archive_compression: str = "gzip"
+    redaction_outbox: bool = False
+
+    def effective_rules(self) -> List[RetentionRule]:
+        """Return the configured rules followed by the image/non-image defaults.
+
+        :return: Ordered retention rules
+        :rtype: List[RetentionRule]
+        """
+        return self.rules + [
+            RetentionRule(mimetype="image/*", max_age_days=self.image_days),
+            RetentionRule(mimetype="*", max_age_days=self.non_image_days),
+        ]
+
+    def rule_for(self, room_id: str, sender: str, mimetype: str, size: int) -> int:
+        """Return the index of the first rule matching an upload.
+
+        :param room_id: Upload room
+        :type room_id: str
+        :param sender: Upload sender
+        :type sender: str
+        :param mimetype: Upload mimetype
+        :type mimetype: str
+        :param size: Upload size in bytes
+        :type size: int
+        :return: Index into :meth:`effective_rules`
+        :rtype: int
+        """
+        for i, rule in enumerate(self.effective_rules()):
+            if rule.matches(room_id, sender, mimetype, size):
+                return i
+        return len(self.effective_rules()) - 1
+
+
+def policy_from_config(raw: Dict[str, Any]) -> Policy:
+    """Build the cleanup policy from the ``policy`` config section.
+
+    :param raw: Full bot configuration
+    :type raw: Dict[str, Any]
+    :return: Cleanup policy
+    :rtype: Policy
+    :raises ValueError: When archive rules are configured without an archive root
+    """
+    pol = raw.get("policy") or {}
+    rd = pol.get("retention_days") or {}
+    thr = pol.get("disk_thresholds") or {}
+    arc = pol.get("archive") or {}
+    policy = Policy(
+        image_days=int(rd.get("image", 90)),
+        non_image_days=int(rd.get("non_image", 30)),
+        pressure=float(thr.get("pressure", 0.85)),
+        emergency=float(thr.get("emergency", 0.92)),
+        rules=[RetentionRule.from_dict(r) for r in (pol.get("rules") or [])],
+        archive_root=arc.get("root") or None,
+        archive_compression=str(arc.get("compression") or "gzip"),
+        redaction_outbox=bool((pol.get("redaction_outbox") or {}).get("enabled", False)),
+    )
+    if policy.archive_compression not in ("gzip", "lzma"):
+        raise ValueError(f"Unknown archive compression: {policy.archive_compression}")
+    if not policy.archive_root and any(r.action == "archive" for r in policy.rules):
+        raise ValueError("policy.archive.root is required for archive rules")
+    return policy
+
+
+def rule_case_sql(policy: Policy) -> Tuple[str, List[Any]]:
+    """Compile the rules table into a CASE expression yielding the rule index.
+
+    Conditions compare the integer keys of ``upload_records u``; rule
+    strings are looked up in the dictionary tables once per statement.
+
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :return: SQL expression over ``upload_records u`` and its parameters
+    :rtype: Tuple[str, List[Any]]
+    """
+    whens: List[str] = []
+    params: List[Any] = []
+    for i, rule in enumerate(policy.effective_rules()):
+        conds = []
+        if rule.mimetype != "*":
+            conds.append(
+                "(u.mimetype IN (SELECT id FROM mimetypes WHERE mimetype GLOB ?) "
+                "OR (u.mimetype IS NULL AND '' GLOB ?))"
+            )
+            params += [rule.mimetype, rule.mimetype]
+        if rule.room is not None:
+            conds.append("u.room = (SELECT id FROM rooms WHERE room_id = ?)")
+            params.append(rule.room)
+        if rule.sender is not None:
+            conds.append("u.sender = (SELECT id FROM senders WHERE sender = ?)")
+            params.append(rule.sender)
+        if rule.min_size:
+            conds.append("COALESCE(u.size, 0) >= ?")
+            params.append(rule.min_size)
+        whens.append(f"WHEN {' AND '.join(conds) or '1'} THEN {i}")
+    return f"CASE {' '.join(whens)} END", params
+
+
+def compile_retention_query(
+    policy: Policy, now_ms: int, limit: Optional[int] = None
+) -> Tuple[str, List[Any]]:
+    """Compile the rules table into one query returning expired uploads.
+
+    The CASE expression from :func:`rule_case_sql` picks each row's rule and
+    a second CASE maps the rule to its cutoff, so rules without a maximum
+    age never match.  Rows are read in ``idx_upload_records_expiry`` order
+    (non-images first, oldest first), which lets a limited batch stop after
+    ``limit`` matches instead of sorting every expired upload.  Strings are
+    joined in for the returned rows only.
+
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param now_ms: Current time in milliseconds
+    :type now_ms: int
+    :param limit: Optional row limit
+    :type limit: Optional[int]
+    :return: SQL and parameters
+    :rtype: Tuple[str, List[Any]]
+    """
+    cutoffs = [
+        None if r.max_age_days is None else now_ms - r.max_age_days * DAY_MS
+        for r in policy.effective_rules()
+    ]
+    case_sql, params = rule_case_sql(policy)
+    cutoff_sql = " ".join(f"WHEN {i} THEN ?" for i in range(len(cutoffs)))
+    params = params + cutoffs
+    sql = f"""
+        SELECT e.event_id, r.room_id,
+               CASE WHEN e.server IS NULL THEN e.media_id
+                    ELSE 'mxc://' || v.server || '/' || e.media_id END,
+               m.mimetype, e.size, e.timestamp, e.rule
+        FROM (
+            SELECT u.event_id, u.room, u.server, u.media_id, u.mimetype, u.size, u.timestamp,
+                   u.is_image, {case_sql} AS rule
+            FROM upload_records u
+        ) e
+        LEFT JOIN rooms r ON r.id = e.room
+        LEFT JOIN servers v ON v.id = e.server
+        LEFT JOIN mimetypes m ON m.id = e.mimetype
+        WHERE e.timestamp < CASE e.rule {cutoff_sql} END
+        ORDER BY e.is_image ASC, e.timestamp ASC, e.size DESC
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def iter_expired(
+    conn: sqlite3.Connection, policy: Policy, now_ms: Optional[int] = None
+) -> Iterator[Tuple[str, str, str, str, int, int, int]]:
+    """Stream all expired uploads in a single query.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param now_ms: Current time in milliseconds, defaults to now
+    :type now_ms: Optional[int]
+    :return: ``(event_id, room_id, mxc_uri, mimetype, size, timestamp, rule)`` rows
+    :rtype: Iterator[Tuple[str, str, str, str, int, int, int]]
+    """
+    if now_ms is None:
+        now_ms = int(datetime.now().timestamp() * 1000)
+    sql, params = compile_retention_query(policy, now_ms)
+    yield from conn.execute(sql, params)
 
 
 async def run_retention(
@@ -144,29 +610,24 @@ async def run_retention(
     print_effective_config: bool = False,
 ) -> None:
     start_time = datetime.now()
-    cutoff_img = int((datetime.now() - timedelta(days=policy.image_days)).timestamp() * 1000)
-    cutoff_non = int((datetime.now() - timedelta(days=policy.non_image_days)).timestamp() * 1000)
-
-    cur = conn.execute("""
-        SELECT event_id, room_id, mxc_uri, mimetype, size, timestamp
-        FROM uploads
-        WHERE (mimetype LIKE 'image/%' AND timestamp < ?)
-           OR (mimetype NOT LIKE 'image/%' AND timestamp < ?)
-        ORDER BY (mimetype LIKE 'image/%') ASC, timestamp ASC, size DESC
-    """, (cutoff_img, cutoff_non))
-    candidates = cur.fetchall()
-    candidates_count = len(candidates)
-
     used = get_disk_usage_ratio(media_root)
     total_files = count_media_files(media_root)
 
+    candidates_count = 0
     deleted = 0
+    archived = 0
     freed = 0
     deleted_images = 0
     deleted_non_images = 0
-    for event_id, room_id, mxc_uri, mimetype, size, ts in candidates:
-        paths = find_media_files(media_root, mxc_uri)
+    rules = policy.effective_rules()
+    for event_id, room_id, mxc_uri, mimetype, size, ts, rule in iter_expired(conn, policy):
+        candidates_count += 1
         if dry_run:
+            paths = find_media_files(media_root, mxc_uri)
+            if rules[rule].action == "archive":
+                print(f"[DRY-RUN] Would archive {event_id} files={len(paths)}")
+                archived += 1
+                continue
             print(f"[DRY-RUN] Would redact+delete {event_id} files={len(paths)}")
             deleted += 1
             if mimetype.startswith("image/"):
@@ -175,13 +636,14 @@ async def run_retention(
                 deleted_non_images += 1
             continue
         try:
-            await session.client.redact(RoomID(room_id), EventID(event_id), reason="Catcord cleanup: retention")
-            for p in paths:
-                if p.exists():
-                    freed += p.stat().st_size
-                    p.unlink()
-            conn.execute("DELETE FROM uploads WHERE event_id = ?", (event_id,))
-            conn.commit()
+            action, upload_freed = await expire_upload(
+                session, conn, media_root, policy, rule,
+                event_id, room_id, mxc_uri, ts, "retention",
+            )
+            freed += upload_freed
+            if action == "archive":
+                archived += 1
+                continue
             deleted += 1
             if mimetype.startswith("image/"):
                 deleted_images += 1
@@ -190,10 +652,13 @@ async def run_retention(
         except Exception as e:
             print(f"retention failed {event_id}: {e}")
 
+    if archived:
+        print(f"Archived {archived} uploads to {policy.archive_root}")
+
     if not notifications_room:
         return
 
-    action_happened = deleted > 0
+    action_happened = deleted > 0 or archived > 0
     force_notify = print_effective_config
 
     # Gate notification BEFORE building payload
@@ -226,6 +691,7 @@ async def run_retention(
         "total_files_count": total_files,
         "actions": {
             "deleted_count": deleted,
+            "archived_count": archived,
             "freed_gb": round(freed / 1024 / 1024 / 1024, 2),
             "deleted_by_type": {
                 "images": deleted_images,
@@ -241,9 +707,8 @@ async def run_retention(
 
     # Check dedupe (only if send_zero enabled or action happened)
     if send_zero or action_happened:
-        state_path = "/state/retention_last.fp"
         fp = payload_fingerprint(summary_payload)
-        if not should_send(state_path, fp, force_notify):
+        if not should_send("retention", fp, force_notify):
             print(f"Not sending: deduped (unchanged)")
             return
 
@@ -266,11 +731,100 @@ async def run_retention(
     stats = format_retention_stats(summary_payload)
     message = f"{prefix}{status_msg}\n\n{stats}"
 
-    try:
-        await send_text(session, notifications_room, message)
-        print(f"Sent message to {notifications_room}")
-    except Exception as e:
-        print(f"Failed to send message: {e}")
+    await notify(session, notifications_room, message)
+
+
+# Pressure order: non-images first, largest first, oldest first.  Matches
+# ``idx_upload_records_pressure`` so a limited query reads only its rows.
+PRESSURE_ORDER_SQL = "u.is_image ASC, u.size DESC, u.timestamp ASC"
+# Age order for cleanup ahead of pressure; reads ``idx_upload_records_timestamp``.
+AGE_ORDER_SQL = "u.timestamp ASC"
+PRESSURE_PAGE = 256
+
+
+def pressure_query(
+    limit: Optional[int] = None, order_sql: str = PRESSURE_ORDER_SQL
+) -> Tuple[str, List[Any]]:
+    """Build the query returning uploads in pressure order.
+
+    With a limit the top rows are picked from ``upload_records`` alone and
+    only those get their strings joined in.
+
+    :param limit: Optional row limit
+    :type limit: Optional[int]
+    :param order_sql: ORDER BY terms over ``upload_records u``
+    :type order_sql: str
+    :return: SQL returning ``uploads`` view columns, and its parameters
+    :rtype: Tuple[str, List[Any]]
+    """
+    if limit is None:
+        return f"SELECT {UPLOAD_COLUMNS_SQL} FROM upload_records u {UPLOAD_JOINS_SQL} ORDER BY {order_sql}", []
+    top = f"SELECT * FROM upload_records u ORDER BY {order_sql} LIMIT ?"
+    sql = f"SELECT {UPLOAD_COLUMNS_SQL} FROM ({top}) u {UPLOAD_JOINS_SQL} ORDER BY {order_sql}"
+    return sql, [limit]
+
+
+def _paged_candidates(
+    conn: sqlite3.Connection, order_sql: str, seen: Set[str]
+) -> Iterator[Tuple[str, str, str, str, str, int, int, Optional[List[Path]]]]:
+    # Pages start at PRESSURE_PAGE rows and double.  Each re-reads the head
+    # of the order and skips uploads already yielded, so rows the caller
+    # deleted drop out and rows it kept (dry runs, failures) are not
+    # yielded twice.
+    limit = PRESSURE_PAGE
+    while True:
+        rows = conn.execute(*pressure_query(limit, order_sql)).fetchall()
+        for row in rows:
+            if row[0] not in seen:
+                seen.add(row[0])
+                yield (*row, None)
+        if len(rows) < limit:
+            return
+        limit = max(2 * limit, len(seen) + PRESSURE_PAGE)
+
+
+def pressure_candidates(
+    conn: sqlite3.Connection, eviction: Optional["EvictionQueue"] = None
+) -> Iterator[Tuple[str, str, str, str, str, int, int, Optional[List[Path]]]]:
+    """Yield uploads in pressure order, warm queue first.
+
+    Once the queue is exhausted the index is read in doubling pages, so a
+    run that stops early never sorts the whole table, and one that reads it
+    all reads each row at most about twice.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param eviction: Warm candidate queue
+    :type eviction: Optional[EvictionQueue]
+    :return: ``(event_id, room_id, sender, mxc_uri, mimetype, size, timestamp, paths)``
+        rows; ``paths`` is ``None`` when not resolved yet
+    :rtype: Iterator[Tuple[str, str, str, str, str, int, int, Optional[List[Path]]]]
+    """
+    seen: Set[str] = set()
+    if eviction is not None:
+        while True:
+            c = eviction.pop()
+            if c is None:
+                break
+            if c.event_id in seen:
+                continue
+            seen.add(c.event_id)
+            yield (c.event_id, c.room_id, c.sender, c.mxc_uri, c.mimetype, c.size,
+                   c.timestamp, c.paths)
+    yield from _paged_candidates(conn, PRESSURE_ORDER_SQL, seen)
+
+
+def age_candidates(
+    conn: sqlite3.Connection,
+) -> Iterator[Tuple[str, str, str, str, str, int, int, Optional[List[Path]]]]:
+    """Yield uploads oldest first, for cleanup before the pressure threshold.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :return: Rows shaped like :func:`pressure_candidates`, ``paths`` always ``None``
+    :rtype: Iterator[Tuple[str, str, str, str, str, int, int, Optional[List[Path]]]]
+    """
+    return _paged_candidates(conn, AGE_ORDER_SQL, set())
 
 
 async def run_pressure(
@@ -282,9 +836,39 @@ async def run_pressure(
     send_zero: bool,
     dry_run: bool,
     print_effective_config: bool = False,
+    accounting: Optional[MediaAccounting] = None,
+    eviction: Optional["EvictionQueue"] = None,
 ) -> None:
+    """Delete or archive uploads until disk usage drops below the pressure threshold.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param notifications_room: Room for summaries, ``None`` to stay silent
+    :type notifications_room: Optional[str]
+    :param send_zero: Send summaries when nothing was deleted
+    :type send_zero: bool
+    :param dry_run: Report without deleting
+    :type dry_run: bool
+    :param print_effective_config: Force sending the summary
+    :type print_effective_config: bool
+    :param accounting: Live counters used instead of ``statvfs`` when given
+    :type accounting: Optional[MediaAccounting]
+    :param eviction: Warm candidate queue consumed before querying the index
+    :type eviction: Optional[EvictionQueue]
+    """
+    def usage() -> float:
+        if accounting is not None:
+            return accounting.usage_ratio()
+        return get_disk_usage_ratio(media_root)
+
     start_time = datetime.now()
-    used = get_disk_usage_ratio(media_root)
+    used = usage()
 
     if used < policy.pressure:
         print(f"disk usage {used:.3f} < {policy.pressure:.3f}, no action")
@@ -325,9 +909,8 @@ async def run_pressure(
             },
         }
 
-        state_path = "/state/pressure_last.fp"
         fp = payload_fingerprint(summary_payload)
-        if not should_send(state_path, fp, force_notify):
+        if not should_send("pressure", fp, force_notify):
             print(f"Not sending: deduped (unchanged)")
             return
 
@@ -339,30 +922,29 @@ async def run_pressure(
         )
         message = f"{prefix}{status_msg}"
 
-        try:
-            await send_text(session, notifications_room, message)
-            print(f"Sent message to {notifications_room}")
-        except Exception as e:
-            print(f"Failed to send message: {e}")
+        await notify(session, notifications_room, message)
         return
 
-    cur = conn.execute("""
-        SELECT event_id, room_id, mxc_uri, mimetype, size, timestamp
-        FROM uploads
-        ORDER BY (mimetype LIKE 'image/%') ASC, size DESC, timestamp ASC
-    """)
     deleted = 0
+    archived = 0
     freed = 0
     deleted_images = 0
     deleted_non_images = 0
     disk_before = used * 100
+    rules = policy.effective_rules()
 
-    for event_id, room_id, mxc_uri, mimetype, size, ts in cur.fetchall():
-        used = get_disk_usage_ratio(media_root)
+    candidates = pressure_candidates(conn, None if dry_run else eviction)
+    for event_id, room_id, sender, mxc_uri, mimetype, size, ts, paths in candidates:
+        used = usage()
         if used < policy.pressure:
             break
-        paths = find_media_files(media_root, mxc_uri)
+        rule = policy.rule_for(room_id, sender, mimetype, size)
         if dry_run:
+            paths = find_media_files(media_root, mxc_uri)
+            if rules[rule].action == "archive":
+                print(f"[DRY-RUN] Would archive {event_id} files={len(paths)} used={used:.3f}")
+                archived += 1
+                continue
             print(f"[DRY-RUN] Would redact+delete {event_id} files={len(paths)} used={used:.3f}")
             deleted += 1
             if mimetype.startswith("image/"):
@@ -372,13 +954,14 @@ async def run_pressure(
             continue
         try:
             reason = "emergency" if used >= policy.emergency else "pressure"
-            await session.client.redact(RoomID(room_id), EventID(event_id), reason=f"Catcord cleanup: {reason}")
-            for p in paths:
-                if p.exists():
-                    freed += p.stat().st_size
-                    p.unlink()
-            conn.execute("DELETE FROM uploads WHERE event_id = ?", (event_id,))
-            conn.commit()
+            action, upload_freed = await expire_upload(
+                session, conn, media_root, policy, rule,
+                event_id, room_id, mxc_uri, ts, reason, paths,
+            )
+            freed += upload_freed
+            if action == "archive":
+                archived += 1
+                continue
             deleted += 1
             if mimetype.startswith("image/"):
                 deleted_images += 1
@@ -387,10 +970,13 @@ async def run_pressure(
         except Exception as e:
             print(f"pressure failed {event_id}: {e}")
 
+    if archived:
+        print(f"Archived {archived} uploads to {policy.archive_root}")
+
     if not notifications_room:
         return
 
-    action_happened = deleted > 0
+    action_happened = deleted > 0 or archived > 0
     force_notify = print_effective_config
 
     if not force_notify and not action_happened and not send_zero:
@@ -399,7 +985,7 @@ async def run_pressure(
 
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
-    disk_after = get_disk_usage_ratio(media_root) * 100
+    disk_after = usage() * 100
 
     summary_payload = {
         "run_id": f"{start_time.isoformat()}Z-pressure",
@@ -415,6 +1001,7 @@ async def run_pressure(
         "policy": {"prefer_large_non_images": True},
         "actions": {
             "deleted_count": deleted,
+            "archived_count": archived,
             "freed_gb": round(freed / 1024 / 1024 / 1024, 2),
             "deleted_by_type": {
                 "images": deleted_images,
@@ -428,9 +1015,8 @@ async def run_pressure(
         },
     }
 
-    state_path = "/state/pressure_last.fp"
     fp = payload_fingerprint(summary_payload)
-    if not should_send(state_path, fp, force_notify):
+    if not should_send("pressure", fp, force_notify):
         print(f"Not sending: deduped (unchanged)")
         return
 
@@ -452,9 +1038,7 @@ async def run_pressure(
 
     prefix = "[DRY-RUN] " if dry_run else ""
     message = f"{prefix}{status_msg}"
+    if accounting is not None:
+        message += f"\n\n{accounting.format_summary()}"
 
-    try:
-        await send_text(session, notifications_room, message)
-        print(f"Sent message to {notifications_room}")
-    except Exception as e:
-        print(f"Failed to send message: {e}")
+    await notify(session, notifications_room, message)
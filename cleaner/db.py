@@ -0,0 +1,451 @@
+"""Shared SQLite access layer for ``uploads.db``.
+
+Both the ``cleaner`` cron container and the ``cleaner-event`` daemon open
+the same database file from the ``/state`` bind mount.  Every connection
+goes through :func:`connect`, which applies the locking model below, and
+:func:`migrate`, which brings the schema to :data:`SCHEMA_VERSION`.
+
+Locking model:
+
+- The database runs in WAL mode.  Readers never block the writer and the
+  writer never blocks readers, so a long retention scan in one container
+  does not stall upload logging in the other.
+- There is at most one writer at a time.  A connection that finds the
+  write lock taken waits up to ``busy_timeout`` milliseconds instead of
+  failing with "database is locked".
+- Writers keep transactions short: one logical change per commit.  Never
+  hold a write transaction across a network call (redactions, sends).
+- Migrations run inside ``BEGIN IMMEDIATE`` and re-check ``user_version``
+  after taking the lock, so two containers starting together migrate once.
+- WAL needs shared memory, so both containers must run on the same host
+  as the database file.  Network filesystems are not supported.
+
+Uploads are stored interned: ``upload_records`` keeps integer keys into the
+``rooms``, ``senders``, ``servers`` and ``mimetypes`` dictionary tables and
+only the media ID of the MXC URI.  ``uploads`` is a view that joins the
+strings back, with ``INSTEAD OF`` triggers for inserts and deletes, so
+callers read and write it like the original table.  Hot queries (retention,
+pressure, expiry schedule, eviction) read ``upload_records`` directly: they
+filter and sort on the integer keys and join the strings only for the rows
+they return, using :data:`UPLOAD_COLUMNS_SQL` and :data:`UPLOAD_JOINS_SQL`.
+Triggers on ``upload_records`` keep the ``usage_by_*`` aggregate tables
+current.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import List, Optional, Tuple
+
+BUSY_TIMEOUT_MS = 10000
+
+# Upload columns of an ``upload_records u`` row as strings, in ``uploads`` view order.
+UPLOAD_COLUMNS_SQL = (
+    "u.event_id, r.room_id, s.sender, "
+    "CASE WHEN u.server IS NULL THEN u.media_id ELSE 'mxc://' || v.server || '/' || u.media_id END, "
+    "m.mimetype, u.size, u.timestamp"
+)
+UPLOAD_JOINS_SQL = (
+    "LEFT JOIN rooms r ON r.id = u.room "
+    "LEFT JOIN senders s ON s.id = u.sender "
+    "LEFT JOIN servers v ON v.id = u.server "
+    "LEFT JOIN mimetypes m ON m.id = u.mimetype"
+)
+
+
+def _mxc_server(col: str) -> str:
+    return f"CASE WHEN {col} LIKE 'mxc://%/%' THEN substr({col}, 7, instr(substr({col}, 7), '/') - 1) END"
+
+
+def _mxc_media_id(col: str) -> str:
+    return f"CASE WHEN {col} LIKE 'mxc://%/%' THEN substr({col}, 7 + instr(substr({col}, 7), '/')) ELSE {col} END"
+
+
+# Skip interning for inserts that will be ignored as duplicates.
+_NEW_ROW = "NOT EXISTS (SELECT 1 FROM upload_records WHERE event_id = NEW.event_id)"
+
+
+def _intern(table: str, column: str, value: str) -> str:
+    return f"(SELECT id FROM {table} WHERE {column} = {value})"
+
+
+def _uploads_insert_trigger(is_image: bool) -> str:
+    # Migration 8 inserts positionally; from 11 on ``is_image`` is set from the mimetype.
+    columns = image = ""
+    if is_image:
+        columns = " (event_id, room, sender, server, media_id, mimetype, size, timestamp, is_image)"
+        image = ",\n                COALESCE(NEW.mimetype LIKE 'image/%', 0)"
+    return f"""
+        CREATE TRIGGER uploads_insert INSTEAD OF INSERT ON uploads
+        BEGIN
+            INSERT OR IGNORE INTO rooms (room_id)
+                SELECT NEW.room_id WHERE NEW.room_id IS NOT NULL AND {_NEW_ROW};
+            INSERT OR IGNORE INTO senders (sender)
+                SELECT NEW.sender WHERE NEW.sender IS NOT NULL AND {_NEW_ROW};
+            INSERT OR IGNORE INTO servers (server)
+                SELECT {_mxc_server('NEW.mxc_uri')} WHERE {_mxc_server('NEW.mxc_uri')} IS NOT NULL AND {_NEW_ROW};
+            INSERT OR IGNORE INTO mimetypes (mimetype)
+                SELECT NEW.mimetype WHERE NEW.mimetype IS NOT NULL AND {_NEW_ROW};
+            INSERT INTO upload_records{columns} VALUES (
+                NEW.event_id,
+                {_intern('rooms', 'room_id', 'NEW.room_id')},
+                {_intern('senders', 'sender', 'NEW.sender')},
+                {_intern('servers', 'server', _mxc_server('NEW.mxc_uri'))},
+                {_mxc_media_id('NEW.mxc_uri')},
+                {_intern('mimetypes', 'mimetype', 'NEW.mimetype')},
+                NEW.size,
+                NEW.timestamp{image}
+            );
+        END
+        """
+
+
+# Mimetype classes shared by the stats report and live accounting; every
+# other major type, and a missing mimetype, is reported as MIME_OTHER.
+MIME_CLASSES = ("image", "video", "audio")
+MIME_OTHER = "other"
+
+
+def mime_class(mimetype: Optional[str]) -> str:
+    """Collapse a mimetype into one of :data:`MIME_CLASSES` or :data:`MIME_OTHER`.
+
+    :param mimetype: Mimetype or its major type, e.g. ``image/png`` or ``image``
+    :type mimetype: str | None
+    :return: Mimetype class
+    :rtype: str
+    """
+    major = (mimetype or "").split("/", 1)[0]
+    return major if major in MIME_CLASSES else MIME_OTHER
+
+
+def mime_class_sql(expr: str) -> str:
+    """SQL form of :func:`mime_class` over a major type, e.g. ``usage_by_class.class``.
+
+    :param expr: SQL expression holding the major type
+    :type expr: str
+    :return: SQL ``CASE`` expression
+    :rtype: str
+    """
+    listed = ", ".join(f"'{c}'" for c in MIME_CLASSES)
+    return f"CASE WHEN {expr} IN ({listed}) THEN {expr} ELSE '{MIME_OTHER}' END"
+
+
+def _mime_class(ref: str) -> str:
+    # Stored per major type (or 'unknown'); reports collapse it with mime_class_sql.
+    return (
+        "COALESCE((SELECT NULLIF(CASE WHEN instr(mimetype, '/') > 0 "
+        "THEN substr(mimetype, 1, instr(mimetype, '/') - 1) ELSE mimetype END, '') "
+        f"FROM mimetypes WHERE id = {ref}.mimetype), 'unknown')"
+    )
+
+
+def _month(ref: str) -> str:
+    return f"COALESCE(strftime('%Y-%m', {ref}.timestamp / 1000, 'unixepoch'), 'unknown')"
+
+
+# Aggregate table, key column and key expression over a NEW/OLD row.
+_USAGE_KEYS = [
+    ("usage_by_room", "room", lambda ref: f"COALESCE({ref}.room, 0)"),
+    ("usage_by_sender", "sender", lambda ref: f"COALESCE({ref}.sender, 0)"),
+    ("usage_by_class", "class", _mime_class),
+    ("usage_by_month", "month", _month),
+]
+
+
+def _usage_statements() -> Tuple[str, ...]:
+    statements: List[str] = []
+    for table, key, _ in _USAGE_KEYS:
+        key_type = "INTEGER" if key in ("room", "sender") else "TEXT"
+        statements += [
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"{key} {key_type} PRIMARY KEY, bytes INTEGER NOT NULL, count INTEGER NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_bytes ON {table}(bytes)",
+        ]
+    for table, key, expr in _USAGE_KEYS:
+        statements.append(
+            f"INSERT OR REPLACE INTO {table} ({key}, bytes, count) "
+            f"SELECT {expr('u')}, SUM(COALESCE(u.size, 0)), COUNT(*) FROM upload_records u "
+            f"GROUP BY 1"
+        )
+    inserts = "".join(
+        f"""
+            INSERT INTO {table} ({key}, bytes, count) VALUES ({expr('NEW')}, COALESCE(NEW.size, 0), 1)
+                ON CONFLICT({key}) DO UPDATE SET bytes = bytes + excluded.bytes, count = count + 1;"""
+        for table, key, expr in _USAGE_KEYS
+    )
+    deletes = "".join(
+        f"""
+            UPDATE {table} SET bytes = bytes - COALESCE(OLD.size, 0), count = count - 1
+                WHERE {key} = {expr('OLD')};
+            DELETE FROM {table} WHERE {key} = {expr('OLD')} AND count <= 0;"""
+        for table, key, expr in _USAGE_KEYS
+    )
+    statements += [
+        f"CREATE TRIGGER usage_insert AFTER INSERT ON upload_records BEGIN{inserts}\n        END",
+        f"CREATE TRIGGER usage_delete AFTER DELETE ON upload_records BEGIN{deletes}\n        END",
+    ]
+    return tuple(statements)
+
+
+# Each migration is a tuple of statements.  Entry ``i`` upgrades the
+# schema from version ``i`` to ``i + 1``; never edit a released entry.
+MIGRATIONS: List[Tuple[str, ...]] = [
+    # 1: upload index
+    (
+        """
+        CREATE TABLE IF NOT EXISTS uploads (
+            event_id TEXT PRIMARY KEY,
+            room_id TEXT,
+            sender TEXT,
+            mxc_uri TEXT,
+            mimetype TEXT,
+            size INTEGER,
+            timestamp INTEGER
+        )
+        """,
+    ),
+    # 2: retry queue for undecryptable events
+    (
+        """
+        CREATE TABLE IF NOT EXISTS pending_decryption (
+            event_id TEXT PRIMARY KEY,
+            session_id TEXT,
+            room_id TEXT,
+            event_json TEXT,
+            attempts INTEGER,
+            next_attempt INTEGER,
+            first_seen INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pending_session ON pending_decryption(session_id)",
+    ),
+    # 3: expiry lookups
+    ("CREATE INDEX IF NOT EXISTS idx_uploads_timestamp ON uploads(timestamp)",),
+    # 4: content hashes for deduplication
+    (
+        """
+        CREATE TABLE IF NOT EXISTS media_hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_media_hashes_sha256 ON media_hashes(sha256)",
+    ),
+    # 5: cold-storage archive members
+    (
+        """
+        CREATE TABLE IF NOT EXISTS archived_media (
+            path TEXT PRIMARY KEY,
+            event_id TEXT,
+            room_id TEXT,
+            mxc_uri TEXT,
+            archive TEXT,
+            offset INTEGER,
+            length INTEGER,
+            size INTEGER,
+            compression TEXT,
+            archived_at INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_archived_media_mxc ON archived_media(mxc_uri)",
+    ),
+    # 6: disk usage time series for growth forecasting
+    (
+        """
+        CREATE TABLE IF NOT EXISTS disk_samples (
+            ts INTEGER PRIMARY KEY,
+            used_bytes INTEGER,
+            total_bytes INTEGER,
+            upload_bytes INTEGER
+        )
+        """,
+    ),
+    # 7: durable redaction outbox
+    (
+        """
+        CREATE TABLE IF NOT EXISTS redaction_outbox (
+            event_id TEXT PRIMARY KEY,
+            room_id TEXT,
+            reason TEXT,
+            attempts INTEGER,
+            next_attempt INTEGER,
+            enqueued_at INTEGER,
+            last_error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_redaction_outbox_next ON redaction_outbox(next_attempt)",
+    ),
+    # 8: interned upload index; ``uploads`` becomes a view over ``upload_records``
+    (
+        "CREATE TABLE IF NOT EXISTS rooms (id INTEGER PRIMARY KEY, room_id TEXT NOT NULL UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS senders (id INTEGER PRIMARY KEY, sender TEXT NOT NULL UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS servers (id INTEGER PRIMARY KEY, server TEXT NOT NULL UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS mimetypes (id INTEGER PRIMARY KEY, mimetype TEXT NOT NULL UNIQUE)",
+        """
+        CREATE TABLE IF NOT EXISTS upload_records (
+            event_id TEXT PRIMARY KEY,
+            room INTEGER,
+            sender INTEGER,
+            server INTEGER,
+            media_id TEXT,
+            mimetype INTEGER,
+            size INTEGER,
+            timestamp INTEGER
+        ) WITHOUT ROWID
+        """,
+        "INSERT OR IGNORE INTO rooms (room_id) SELECT DISTINCT room_id FROM uploads WHERE room_id IS NOT NULL",
+        "INSERT OR IGNORE INTO senders (sender) SELECT DISTINCT sender FROM uploads WHERE sender IS NOT NULL",
+        f"INSERT OR IGNORE INTO servers (server) SELECT DISTINCT {_mxc_server('mxc_uri')} FROM uploads "
+        f"WHERE {_mxc_server('mxc_uri')} IS NOT NULL",
+        "INSERT OR IGNORE INTO mimetypes (mimetype) SELECT DISTINCT mimetype FROM uploads WHERE mimetype IS NOT NULL",
+        f"""
+        INSERT OR IGNORE INTO upload_records
+        SELECT u.event_id, r.id, s.id, v.id, {_mxc_media_id('u.mxc_uri')}, m.id, u.size, u.timestamp
+        FROM uploads u
+        LEFT JOIN rooms r ON r.room_id = u.room_id
+        LEFT JOIN senders s ON s.sender = u.sender
+        LEFT JOIN servers v ON v.server = {_mxc_server('u.mxc_uri')}
+        LEFT JOIN mimetypes m ON m.mimetype = u.mimetype
+        """,
+        "DROP INDEX IF EXISTS idx_uploads_timestamp",
+        "DROP TABLE uploads",
+        "CREATE INDEX IF NOT EXISTS idx_upload_records_timestamp ON upload_records(timestamp)",
+        """
+        CREATE VIEW uploads AS
+        SELECT u.event_id AS event_id,
+               r.room_id AS room_id,
+               s.sender AS sender,
+               CASE WHEN u.server IS NULL THEN u.media_id
+                    ELSE 'mxc://' || v.server || '/' || u.media_id END AS mxc_uri,
+               m.mimetype AS mimetype,
+               u.size AS size,
+               u.timestamp AS timestamp
+        FROM upload_records u
+        LEFT JOIN rooms r ON r.id = u.room
+        LEFT JOIN senders s ON s.id = u.sender
+        LEFT JOIN servers v ON v.id = u.server
+        LEFT JOIN mimetypes m ON m.id = u.mimetype
+        """,
+        _uploads_insert_trigger(is_image=False),
+        """
+        CREATE TRIGGER uploads_delete INSTEAD OF DELETE ON uploads
+        BEGIN
+            DELETE FROM upload_records WHERE event_id = OLD.event_id;
+        END
+        """,
+    ),
+    # 9: usage aggregates per room, sender, mimetype class and month, kept by triggers
+    _usage_statements(),
+    # 10: last timeline event handled per room, for gap backfill
+    (
+        """
+        CREATE TABLE IF NOT EXISTS room_cursors (
+            room_id TEXT PRIMARY KEY,
+            event_id TEXT,
+            timestamp INTEGER
+        )
+        """,
+    ),
+    # 11: stored image flag and covering orders for the retention and pressure queries
+    (
+        "ALTER TABLE upload_records ADD COLUMN is_image INTEGER NOT NULL DEFAULT 0",
+        "UPDATE upload_records SET is_image = 1 "
+        "WHERE mimetype IN (SELECT id FROM mimetypes WHERE mimetype LIKE 'image/%')",
+        "DROP TRIGGER uploads_insert",
+        _uploads_insert_trigger(is_image=True),
+        "CREATE INDEX IF NOT EXISTS idx_upload_records_expiry ON upload_records(is_image, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_upload_records_pressure ON upload_records(is_image, size DESC, timestamp)",
+    ),
+    # 12: pending backfill gaps, kept until the backfill reaches the old cursor
+    (
+        """
+        CREATE TABLE IF NOT EXISTS backfill_gaps (
+            id INTEGER PRIMARY KEY,
+            room_id TEXT NOT NULL,
+            from_token TEXT NOT NULL,
+            event_id TEXT,
+            timestamp INTEGER
+        )
+        """,
+    ),
+    # 13: lease owner for redaction outbox rows claimed by a drainer
+    ("ALTER TABLE redaction_outbox ADD COLUMN claimed_by TEXT",),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open a connection with the shared pragmas applied.
+
+    :param db_path: Path to the SQLite database
+    :type db_path: str
+    :return: Open connection
+    :rtype: sqlite3.Connection
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -16000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version stored in the database.
+
+    :param conn: Open connection
+    :type conn: sqlite3.Connection
+    :return: Applied migration count
+    :rtype: int
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations.
+
+    :param conn: Open connection
+    :type conn: sqlite3.Connection
+    :return: Schema version after migrating
+    :rtype: int
+    :raises RuntimeError: When the database is newer than this code
+    """
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"uploads.db schema version {version} is newer than supported {SCHEMA_VERSION}"
+        )
+    if version == SCHEMA_VERSION:
+        return version
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        for i in range(version, SCHEMA_VERSION):
+            for statement in MIGRATIONS[i]:
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return SCHEMA_VERSION
+
+
+def open_db(db_path: str) -> sqlite3.Connection:
+    """Open ``uploads.db`` and bring its schema up to date.
+
+    :param db_path: Path to the SQLite database
+    :type db_path: str
+    :return: Open, migrated connection
+    :rtype: sqlite3.Connection
+    """
+    conn = connect(db_path)
+    migrate(conn)
+    return conn
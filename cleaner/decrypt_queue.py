@@ -0,0 +1,248 @@
+"""Persistent retry queue for encrypted events that could not be decrypted.
+
+Megolm room keys often arrive a few seconds after the first event of a
+session.  Instead of dropping such events, they are stored in the
+``pending_decryption`` table keyed by their megolm session ID and
+re-attempted when the key for that session arrives, or on an exponential
+backoff schedule as a fallback.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from mautrix.types import EncryptedEvent
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class PendingDecryptionQueue:
+    """Queue of undecryptable events, grouped by megolm session ID.
+
+    :param conn: Open uploads database connection
+    :type conn: sqlite3.Connection
+    :param crypto: OlmMachine used for decryption
+    :type crypto: Any
+    :param on_decrypted: Coroutine called with each decrypted event
+    :type on_decrypted: Callable[[Any], Awaitable[None]]
+    :param base_delay: First retry delay in seconds
+    :type base_delay: float
+    :param max_delay: Upper bound for the retry delay in seconds
+    :type max_delay: float
+    :param max_attempts: Attempts before an event is given up on
+    :type max_attempts: int
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        crypto: Any,
+        on_decrypted: Callable[[Any], Awaitable[None]],
+        base_delay: float = 5.0,
+        max_delay: float = 3600.0,
+        max_attempts: int = 12,
+    ) -> None:
+        self.conn = conn
+        self.crypto = crypto
+        self.on_decrypted = on_decrypted
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._waiters: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the backoff loop as a background task."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            self._task.add_done_callback(self._on_run_done)
+
+    def _on_run_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        err = task.exception()
+        if err is not None:
+            print(f"Decryption retry loop crashed ({err!r}), restarting", flush=True)
+            self._task = None
+            self.start()
+
+    async def close(self) -> None:
+        """Cancel and await the backoff loop and all key waiters."""
+        tasks = list(self._waiters.values())
+        if self._task is not None:
+            tasks.append(self._task)
+        self._task = None
+        self._waiters.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, event: EncryptedEvent) -> None:
+        """Persist an undecryptable event and start waiting for its key.
+
+        :param event: Encrypted room event
+        :type event: EncryptedEvent
+        """
+        session_id = str(event.content.session_id)
+        now = _now_ms()
+        self.conn.execute(
+            """
+            INSERT OR IGNORE INTO pending_decryption
+                (event_id, session_id, room_id, event_json, attempts,
+                 next_attempt, first_seen)
+            VALUES (?, ?, ?, ?, 0, ?, ?)
+            """,
+            (
+                str(event.event_id),
+                session_id,
+                str(event.room_id),
+                json.dumps(event.serialize()),
+                now + int(self.base_delay * 1000),
+                now,
+            ),
+        )
+        self.conn.commit()
+        self._watch_session(str(event.room_id), session_id)
+        self._wakeup.set()
+
+    def pending_count(self) -> int:
+        """Return the number of queued events.
+
+        :return: Queued event count
+        :rtype: int
+        """
+        return self.conn.execute("SELECT COUNT(*) FROM pending_decryption").fetchone()[0]
+
+    def _watch_session(self, room_id: str, session_id: str) -> None:
+        task = self._waiters.get(session_id)
+        if task is None or task.done():
+            self._waiters[session_id] = asyncio.create_task(
+                self._wait_for_key(room_id, session_id)
+            )
+
+    def _has_session(self, session_id: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM pending_decryption WHERE session_id = ? LIMIT 1",
+            (session_id,),
+        ).fetchone() is not None
+
+    async def _wait_for_key(self, room_id: str, session_id: str) -> None:
+        try:
+            while self._has_session(session_id):
+                got = await self.crypto.wait_for_session(
+                    room_id, session_id, timeout=self.max_delay
+                )
+                if got:
+                    await self.retry_session(session_id)
+                    return
+        except Exception as e:
+            print(f"wait_for_session failed for {session_id}: {e}", flush=True)
+        finally:
+            self._waiters.pop(session_id, None)
+
+    async def retry_session(self, session_id: str) -> int:
+        """Re-attempt decryption of every queued event of a session.
+
+        :param session_id: Megolm session ID
+        :type session_id: str
+        :return: Number of events decrypted
+        :rtype: int
+        """
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            decrypted = await self._retry_session(session_id)
+        if not lock.locked() and not self._has_session(session_id):
+            self._locks.pop(session_id, None)
+        return decrypted
+
+    async def _retry_session(self, session_id: str) -> int:
+        rows = self.conn.execute(
+            "SELECT event_id, event_json, attempts FROM pending_decryption "
+            "WHERE session_id = ?",
+            (session_id,),
+        ).fetchall()
+        decrypted = 0
+        for event_id, event_json, attempts in rows:
+            try:
+                evt = EncryptedEvent.deserialize(json.loads(event_json))
+                result = await self.crypto.decrypt_megolm_event(evt)
+            except Exception as e:
+                self._reschedule(event_id, attempts + 1, e)
+                continue
+            cur = self.conn.execute(
+                "DELETE FROM pending_decryption WHERE event_id = ?", (event_id,)
+            )
+            self.conn.commit()
+            if cur.rowcount == 0:
+                continue
+            decrypted += 1
+            try:
+                await self.on_decrypted(result)
+            except Exception as e:
+                print(f"Handling decrypted event {event_id} failed: {e}", flush=True)
+        return decrypted
+
+    def _reschedule(self, event_id: str, attempts: int, err: Exception) -> None:
+        if attempts >= self.max_attempts:
+            print(
+                f"Giving up on decrypting {event_id} after {attempts} attempts: {err}",
+                flush=True,
+            )
+            self.conn.execute(
+                "DELETE FROM pending_decryption WHERE event_id = ?", (event_id,)
+            )
+        else:
+            delay = min(self.base_delay * (2 ** attempts), self.max_delay)
+            self.conn.execute(
+                "UPDATE pending_decryption SET attempts = ?, next_attempt = ? "
+                "WHERE event_id = ?",
+                (attempts, _now_ms() + int(delay * 1000), event_id),
+            )
+        self.conn.commit()
+
+    def _due_sessions(self, now: int) -> List[str]:
+        rows = self.conn.execute(
+            "SELECT DISTINCT session_id FROM pending_decryption WHERE next_attempt <= ?",
+            (now,),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def _next_due(self) -> Optional[int]:
+        return self.conn.execute(
+            "SELECT MIN(next_attempt) FROM pending_decryption"
+        ).fetchone()[0]
+
+    async def run(self) -> None:
+        """Retry due sessions on the backoff schedule until cancelled.
+
+        Sessions left over from a previous run get a key waiter on start.
+        """
+        for room_id, session_id in self.conn.execute(
+            "SELECT DISTINCT room_id, session_id FROM pending_decryption"
+        ).fetchall():
+            self._watch_session(room_id, session_id)
+
+        while True:
+            timeout = self.base_delay
+            try:
+                for session_id in self._due_sessions(_now_ms()):
+                    await self.retry_session(session_id)
+
+                next_due = self._next_due()
+                timeout = self.max_delay
+                if next_due is not None:
+                    timeout = max(0.0, min(timeout, (next_due - _now_ms()) / 1000))
+            except Exception as e:
+                print(f"Decryption retry pass failed: {e!r}", flush=True)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,229 @@
+"""Content-addressed deduplication of identical media files.
+
+Files are bucketed by size from a streamed scan, and only files whose
+size collides with another file are hashed.  Hashes are recorded in the
+``media_hashes`` table so unchanged files are not re-read on the next run.
+Duplicates are replaced with hardlinks to one canonical copy, which keeps
+every path Synapse serves intact while storing the bytes once.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from cleaner.scan import DEFAULT_WORKERS, MediaFile, scan_media
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class DedupeResult:
+    """Outcome of a deduplication run."""
+
+    scanned: int = 0
+    hashed: int = 0
+    duplicates: int = 0
+    linked: int = 0
+    reclaimed_bytes: int = 0
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file in fixed-size chunks.
+
+    :param path: File to hash
+    :type path: str
+    :return: SHA256 hexdigest
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cached_hash(conn: sqlite3.Connection, f: MediaFile) -> Optional[str]:
+    row = conn.execute(
+        "SELECT sha256 FROM media_hashes WHERE path = ? AND size = ? AND mtime = ?",
+        (f.path, f.size, f.mtime),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _hash_entry(f: MediaFile) -> Tuple[MediaFile, Optional[str], Optional[os.stat_result]]:
+    try:
+        return f, file_sha256(f.path), os.stat(f.path)
+    except OSError:
+        return f, None, None
+
+
+def remove_media_file(path: str) -> int:
+    """Remove a media file, counting reclaimed bytes.
+
+    Deduplicated files share an inode, so only the last link frees space.
+    Touches only the filesystem, so it can run in an executor thread.
+
+    :param path: File to remove
+    :type path: str
+    :return: Bytes freed on disk
+    :rtype: int
+    """
+    try:
+        st = os.stat(path)
+        os.unlink(path)
+    except FileNotFoundError:
+        return 0
+    return st.st_size if st.st_nlink <= 1 else 0
+
+
+def unlink_media(conn: sqlite3.Connection, path: str) -> int:
+    """Remove a media file and its cached hash, counting reclaimed bytes.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param path: File to remove
+    :type path: str
+    :return: Bytes freed on disk
+    :rtype: int
+    """
+    freed = remove_media_file(path)
+    conn.execute("DELETE FROM media_hashes WHERE path = ?", (path,))
+    return freed
+
+
+def _unchanged(f: MediaFile) -> bool:
+    try:
+        st = os.stat(f.path)
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime) == (f.size, f.mtime)
+
+
+def replace_with_link(canonical: MediaFile, duplicate: MediaFile) -> bool:
+    """Atomically replace ``duplicate`` with a hardlink to ``canonical``.
+
+    Both files are re-stated first, and the duplicate again just before the
+    rename: if either size or mtime no longer matches what was hashed, the
+    file was written since and nothing is replaced.
+
+    :param canonical: File that is kept, as it was hashed
+    :type canonical: MediaFile
+    :param duplicate: File replaced by a link, as it was hashed
+    :type duplicate: MediaFile
+    :return: ``True`` if linked, ``False`` if skipped because a file changed
+    :rtype: bool
+    :raises OSError: When linking fails, e.g. across devices
+    """
+    if not (_unchanged(canonical) and _unchanged(duplicate)):
+        return False
+    tmp = f"{duplicate.path}.dedupe-tmp"
+    os.link(canonical.path, tmp)
+    try:
+        if not _unchanged(duplicate):
+            os.unlink(tmp)
+            return False
+        os.replace(tmp, duplicate.path)
+    except OSError:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def run_dedupe(
+    conn: sqlite3.Connection,
+    media_root: str,
+    dry_run: bool,
+    min_size: int = 4096,
+    workers: int = DEFAULT_WORKERS,
+) -> DedupeResult:
+    """Find identical files and replace duplicates with hardlinks.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param dry_run: Report reclaimable space without linking
+    :type dry_run: bool
+    :param min_size: Ignore files smaller than this many bytes
+    :type min_size: int
+    :param workers: Threads used for scanning and hashing
+    :type workers: int
+    :return: Run statistics
+    :rtype: DedupeResult
+    """
+    result = DedupeResult()
+    by_size: Dict[int, List[MediaFile]] = defaultdict(list)
+    for f in scan_media(media_root, workers):
+        result.scanned += 1
+        if f.size >= min_size:
+            by_size[f.size].append(f)
+
+    colliding = [f for files in by_size.values() if len(files) > 1 for f in files]
+    by_size.clear()
+
+    # (sha256, size) -> {(dev, ino): file as hashed}; one entry per distinct inode
+    groups: Dict[Tuple[str, int], Dict[Tuple[int, int], MediaFile]] = defaultdict(dict)
+    to_hash: List[MediaFile] = []
+    for f in colliding:
+        digest = _cached_hash(conn, f)
+        if digest is None:
+            to_hash.append(f)
+            continue
+        try:
+            st = os.stat(f.path)
+        except OSError:
+            continue
+        groups[(digest, f.size)].setdefault((st.st_dev, st.st_ino), f)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for f, digest, st in pool.map(_hash_entry, to_hash):
+            if digest is None or st is None:
+                continue
+            if (st.st_size, st.st_mtime) != (f.size, f.mtime):
+                # Written while being hashed; the digest may not match either.
+                continue
+            result.hashed += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO media_hashes (path, size, mtime, sha256) "
+                "VALUES (?, ?, ?, ?)",
+                (f.path, f.size, f.mtime, digest),
+            )
+            groups[(digest, f.size)].setdefault((st.st_dev, st.st_ino), f)
+    conn.commit()
+
+    for (_, size), inodes in groups.items():
+        if len(inodes) < 2:
+            continue
+        (canonical_dev, _), canonical = min(inodes.items(), key=lambda kv: kv[1].path)
+        for (dev, _), f in inodes.items():
+            path = f.path
+            if path == canonical.path:
+                continue
+            result.duplicates += 1
+            if dev != canonical_dev:
+                continue
+            if dry_run:
+                print(f"[DRY-RUN] Would link {path} -> {canonical.path}")
+                result.reclaimed_bytes += size
+                continue
+            try:
+                if not replace_with_link(canonical, f):
+                    print(f"dedupe skipped {path}: changed since it was hashed")
+                    continue
+            except OSError as e:
+                print(f"dedupe failed {path}: {e}")
+                continue
+            # The link carries the canonical mtime; keep the cached hash valid.
+            conn.execute(
+                "UPDATE media_hashes SET mtime = ? WHERE path = ?",
+                (os.stat(path).st_mtime, path),
+            )
+            conn.commit()
+            result.linked += 1
+            result.reclaimed_bytes += size
+    return result
@@ -1,4 +1,5 @@
 import asyncio
+import signal
 from datetime import datetime
 from mautrix.types import (
     EventType,
@@ -7,30 +8,71 @@ from mautrix.types import (
     EventFilter,
     RoomFilter,
     RoomEventFilter,
+    StateFilter,
 )
-from catcord_bots.config import load_yaml, FrameworkConfig
+from catcord_bots.config import ConfigWatcher
 from catcord_bots.matrix import create_client, create_client_e2ee, whoami
+from catcord_bots.outbound import open_outbound
 from catcord_bots.invites import join_all_invites
+from catcord_bots.sync import SyncRunner, SyncTiming
 try:
     from .cleaner import (
         init_db,
         log_upload,
+        extract_mxc_and_info,
         get_disk_usage_ratio,
-        Policy,
+        policy_from_config,
         run_pressure,
     )
+    from .decrypt_queue import PendingDecryptionQueue
+    from .incremental import IncrementalRetention
+    from .accounting import MediaAccounting, inotify_available
+    from .forecast import GrowthForecaster
+    from .eviction import EvictionQueue
+    from .outbox import RedactionOutbox
+    from .backfill import GapBackfill
 except ImportError:
     from cleaner import (
         init_db,
         log_upload,
+        extract_mxc_and_info,
         get_disk_usage_ratio,
-        Policy,
+        policy_from_config,
         run_pressure,
     )
+    from decrypt_queue import PendingDecryptionQueue
+    from incremental import IncrementalRetention
+    from accounting import MediaAccounting, inotify_available
+    from forecast import GrowthForecaster
+    from eviction import EvictionQueue
+    from outbox import RedactionOutbox
+    from backfill import GapBackfill
 
 
 
 conn = None
+pending = None
+retention = None
+accounting = None
+forecaster = None
+eviction = None
+outbox = None
+backfill = None
+runner = None
+sync_e2ee = False
+live_cfg = None
+live_policy = None
+
+# Settings read only at startup; changing them logs a restart hint on reload.
+RESTART_SECTIONS = ("homeserver_url", "bot", "e2ee", "http", "outbound", "sync", "accounting", "backfill")
+RESTART_POLICY_SECTIONS = ("redaction_outbox", "eviction", "incremental", "forecast")
+
+
+def disk_usage() -> float:
+    """Return media disk usage from live counters, or ``statvfs`` without them."""
+    if accounting is not None:
+        return accounting.usage_ratio()
+    return get_disk_usage_ratio("/srv/media")
 
 
 async def on_message(event: MessageEvent, session, cfg, policy):
@@ -53,13 +95,18 @@ async def on_message(event: MessageEvent, session, cfg, policy):
             event_type = str(getattr(event, "type", ""))
             is_encrypted = False
         except Exception as e:
-            used = get_disk_usage_ratio("/srv/media")
+            used = disk_usage()
             print(
                 f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
                 f"Encrypted event could not be decrypted ({type(e).__name__}: {e}). "
-                f"Checking emergency pressure only. Current disk usage: {used:.1%}",
+                f"Queued for retry. Current disk usage: {used:.1%}",
                 flush=True,
             )
+            if pending is not None:
+                try:
+                    pending.add(event)
+                except Exception as qe:
+                    print(f"Failed to queue {event.event_id} for retry: {qe}", flush=True)
 
             if used >= policy.emergency:
                 print(f"Emergency pressure detected: {used:.1%} >= {policy.emergency:.1%}", flush=True)
@@ -72,6 +119,8 @@ async def on_message(event: MessageEvent, session, cfg, policy):
                     send_zero=False,
                     dry_run=False,
                     print_effective_config=False,
+                    accounting=accounting,
+                    eviction=eviction,
                 )
             return
 
@@ -79,7 +128,7 @@ async def on_message(event: MessageEvent, session, cfg, policy):
 
     # Still encrypted / unknown: do not log fake uploads.
     if is_encrypted:
-        used = get_disk_usage_ratio("/srv/media")
+        used = disk_usage()
         print(
             f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
             f"Encrypted event seen. Checking emergency pressure only. "
@@ -98,6 +147,8 @@ async def on_message(event: MessageEvent, session, cfg, policy):
                 send_zero=False,
                 dry_run=False,
                 print_effective_config=False,
+                accounting=accounting,
+                eviction=eviction,
             )
         return
 
@@ -105,7 +156,7 @@ async def on_message(event: MessageEvent, session, cfg, policy):
     if str(msgtype) not in ("m.image", "m.video", "m.file", "m.audio"):
         return
 
-    used = get_disk_usage_ratio("/srv/media")
+    used = disk_usage()
     print(
         f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
         f"Media event seen, logging upload. msgtype={msgtype}. "
@@ -114,6 +165,20 @@ async def on_message(event: MessageEvent, session, cfg, policy):
     )
 
     await log_upload(conn, event)
+    mxc, mimetype, size = extract_mxc_and_info(event)
+    if retention is not None:
+        retention.note_upload(
+            str(event.room_id), str(event.sender), mimetype, size, int(event.timestamp)
+        )
+    if accounting is not None and mxc:
+        accounting.note_upload(mxc, str(event.room_id), mimetype)
+    if forecaster is not None:
+        forecaster.note_upload(size)
+    if eviction is not None and mxc:
+        eviction.note_upload(
+            str(event.event_id), str(event.room_id), str(event.sender),
+            mxc, mimetype, size, int(event.timestamp),
+        )
 
     if used >= policy.emergency:
         print(f"Emergency pressure detected: {used:.1%} >= {policy.emergency:.1%}", flush=True)
@@ -126,13 +191,93 @@ async def on_message(event: MessageEvent, session, cfg, policy):
             send_zero=False,
             dry_run=False,
             print_effective_config=False,
+            accounting=accounting,
+            eviction=eviction,
+        )
+
+
+def print_sync_timing(t: SyncTiming) -> None:
+    """Print one sync iteration's timings."""
+    print(
+        f"[debug] sync #{t.iteration}: request {t.request_seconds:.2f}s, "
+        f"dispatch {t.dispatch_seconds * 1000:.0f}ms, backpressure {t.backpressure_seconds:.2f}s, "
+        f"{t.events} events, {t.pending} handlers pending",
+        flush=True,
+    )
+
+
+def build_sync_filter(rooms_allowlist: list[str], e2ee: bool) -> Filter:
+    """Build the server-side sync filter for the event daemon.
+
+    Presence, ephemeral events and all account data are dropped, members
+    are lazy-loaded and timelines are limited to the allowlisted rooms.
+    Without E2EE the timeline only carries messages with a ``url`` key;
+    encrypted events keep their URL inside the ciphertext, so
+    ``contains_url`` cannot be used when E2EE is enabled.
+
+    :param rooms_allowlist: Room IDs to sync, empty for all joined rooms
+    :type rooms_allowlist: list[str]
+    :param e2ee: Whether encrypted timeline events must be delivered
+    :type e2ee: bool
+    :return: Sync filter
+    :rtype: Filter
+    """
+    if e2ee:
+        timeline = RoomEventFilter(
+            types=[EventType.ROOM_MESSAGE, EventType.ROOM_ENCRYPTED],
         )
+    else:
+        timeline = RoomEventFilter(types=[EventType.ROOM_MESSAGE], contains_url=True)
+    return Filter(
+        presence=EventFilter(not_types=["*"]),
+        account_data=EventFilter(not_types=["*"]),
+        room=RoomFilter(
+            rooms=list(rooms_allowlist) or None,
+            account_data=RoomEventFilter(not_types=["*"]),
+            ephemeral=RoomEventFilter(not_types=["*"]),
+            state=StateFilter(lazy_load_members=True),
+            timeline=timeline,
+        ),
+    )
+
+
+def apply_config(old: dict, raw: dict, cfg) -> None:
+    """Swap in a reloaded config without touching the sync connection.
+
+    Thresholds, rules, notifications and the room allowlist take effect
+    immediately; the allowlist change uploads a new sync filter on the next
+    request.  Sections only read at startup are reported instead.
+    """
+    global live_cfg, live_policy
+    old_allowlist = live_cfg.rooms_allowlist if live_cfg is not None else None
+    policy = policy_from_config(raw)
+    live_cfg, live_policy = cfg, policy
+    if retention is not None:
+        retention.set_policy(policy)
+    if forecaster is not None:
+        forecaster.policy = policy
+    if runner is not None and cfg.rooms_allowlist != old_allowlist:
+        sync_filter = build_sync_filter(cfg.rooms_allowlist, e2ee=sync_e2ee)
+        runner.set_filter(sync_filter)
+        if backfill is not None:
+            backfill.timeline_filter = sync_filter.room.timeline
+        print(f"Sync filter updated for {len(cfg.rooms_allowlist)} allowlisted rooms", flush=True)
+
+    old_pol, new_pol = old.get("policy") or {}, raw.get("policy") or {}
+    restart = [k for k in RESTART_SECTIONS if old.get(k) != raw.get(k)]
+    restart += [f"policy.{k}" for k in RESTART_POLICY_SECTIONS if old_pol.get(k) != new_pol.get(k)]
+    if restart:
+        print(f"Config changes need a restart to apply: {restart}", flush=True)
 
 
 async def main_async(config_path: str):
-    global conn
-    raw = load_yaml(config_path)
-    cfg = FrameworkConfig.from_dict(raw)
+    global conn, pending, retention, accounting, forecaster, eviction, outbox, backfill
+    global runner, sync_e2ee, live_cfg, live_policy
+    retention_task = None
+    forecast_task = None
+    media_watcher = None
+    config_watcher = ConfigWatcher(config_path, validate=policy_from_config)
+    raw, cfg = config_watcher.snapshot
     e2ee_cfg = raw.get("e2ee") or {}
     if e2ee_cfg.get("enabled"):
         session = await create_client_e2ee(
@@ -140,74 +285,185 @@ async def main_async(config_path: str):
             cfg.homeserver.url,
             cfg.bot.access_token,
             e2ee_cfg,
+            cfg.http,
         )
         print("E2EE enabled for cleaner client", flush=True)
     else:
-        session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token)
+        session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token, cfg.http)
 
     try:
+        open_outbound(session, cfg.outbound)
         me = await whoami(session)
         print(f"Event-driven cleaner: {me}")
 
         allow = cfg.rooms_allowlist[:] if cfg.rooms_allowlist else (
             [cfg.notifications.log_room_id] if cfg.notifications.log_room_id else []
         )
-        joined = await join_all_invites(session, allowlist=[r for r in allow if r])
+        joined = await join_all_invites(
+            session, allowlist=[r for r in allow if r], state_path="/state/cleaner_event_invites.json"
+        )
         if joined:
             print(f"Joined: {joined}")
 
         conn = init_db("/state/uploads.db")
 
-        pol = raw.get("policy", {})
-        rd = pol.get("retention_days", {})
-        thr = pol.get("disk_thresholds", {})
-        policy = Policy(
-            image_days=int(rd.get("image", 90)),
-            non_image_days=int(rd.get("non_image", 30)),
-            pressure=float(thr.get("pressure", 0.85)),
-            emergency=float(thr.get("emergency", 0.92)),
-        )
+        pol = raw.get("policy") or {}
+        policy = policy_from_config(raw)
+        live_cfg, live_policy = cfg, policy
 
-        session.client.add_event_handler(
-            EventType.ROOM_MESSAGE,
-            lambda evt: on_message(evt, session, cfg, policy),
-            wait_sync=True,
-        )
-        session.client.add_event_handler(
-            EventType.ROOM_ENCRYPTED,
-            lambda evt: on_message(evt, session, cfg, policy),
-            wait_sync=True,
-        )
+        def handle(evt):
+            # Read the live config per event so reloads apply without a restart.
+            return on_message(evt, session, live_cfg, live_policy)
 
-        sync_filter = Filter(
-            account_data=EventFilter(not_types=["*"]),
-            room=RoomFilter(
-                account_data=RoomEventFilter(not_types=["*"]),
-                timeline=RoomEventFilter(types=[EventType.ROOM_MESSAGE, EventType.ROOM_ENCRYPTED]),
-            ),
-        )
+        if getattr(session, "crypto", None) is not None:
+            pending = PendingDecryptionQueue(
+                conn,
+                session.crypto,
+                handle,
+            )
+            pending.start()
 
-        filter_id = await session.client.create_filter(sync_filter)
+        acc_cfg = raw.get("accounting") or {}
+        if acc_cfg.get("inotify"):
+            if inotify_available():
+                media_watcher = MediaAccounting(
+                    "/srv/media",
+                    resync_interval=float(acc_cfg.get("resync_seconds", 300)),
+                )
+                try:
+                    await media_watcher.start(conn)
+                    accounting = media_watcher
+                    print(
+                        f"Live media accounting: {len(media_watcher.files)} files, "
+                        f"{media_watcher.disk_bytes / 1024 ** 3:.2f} GB",
+                        flush=True,
+                    )
+                except OSError as e:
+                    print(f"inotify accounting disabled, using statvfs: {e}", flush=True)
+            else:
+                print("inotify not available, using statvfs", flush=True)
 
-        print("Listening for media uploads...")
-        since = None
-        while True:
-            data = await session.client.sync(
-                since=since,
-                timeout=30000,
-                filter_id=filter_id,
-                full_state=False,
+        if policy.redaction_outbox:
+            ob = pol.get("redaction_outbox") or {}
+            outbox = RedactionOutbox(
+                session,
+                conn,
+                min_interval=1.0 / float(ob.get("rate_per_second", 5)),
+                mass_batch=int(ob.get("mass_batch", 100)),
+            )
+            outbox.start()
+
+        ev = pol.get("eviction") or {}
+        if ev.get("enabled", True):
+            eviction = EvictionQueue(conn, "/srv/media", capacity=int(ev.get("capacity", 256)))
+            eviction.start()
+
+        inc = pol.get("incremental") or {}
+        if inc.get("enabled", True):
+            retention = IncrementalRetention(
+                session,
+                conn,
+                "/srv/media",
+                policy,
+                batch_size=int(inc.get("batch_size", 20)),
+                batch_interval=float(inc.get("batch_interval_seconds", 5)),
             )
+            retention_task = asyncio.create_task(retention.run())
 
-            data.pop("account_data", None)
-            rooms = data.get("rooms") or {}
-            for section in ("join", "invite", "leave"):
-                for room in (rooms.get(section) or {}).values():
-                    room.pop("account_data", None)
+        fc = pol.get("forecast") or {}
+        if fc.get("enabled"):
+            forecaster = GrowthForecaster(
+                session,
+                conn,
+                "/srv/media",
+                policy,
+                disk_usage,
+                horizon=float(fc.get("horizon_hours", 6)) * 3600,
+                sample_interval=float(fc.get("sample_seconds", 60)),
+                window=float(fc.get("window_minutes", 60)) * 60,
+                batch_size=int(fc.get("batch_size", 10)),
+                batch_interval=float(fc.get("batch_interval_seconds", 10)),
+                cooldown=float(fc.get("cooldown_minutes", 15)) * 60,
+            )
+            forecast_task = asyncio.create_task(forecaster.run())
+
+        sync_e2ee = getattr(session, "crypto", None) is not None
+        sync_filter = build_sync_filter(cfg.rooms_allowlist, e2ee=sync_e2ee)
+
+        sc = raw.get("sync") or {}
+        runner = SyncRunner(
+            session,
+            sync_filter=sync_filter,
+            state_path="/state/cleaner_sync.json" if sc.get("persist_token", True) else None,
+            max_concurrency=int(sc.get("max_concurrency", 8)),
+            max_pending=int(sc.get("max_pending", 64)),
+        )
+        runner.add_handler(EventType.ROOM_MESSAGE, handle)
+        runner.add_handler(EventType.ROOM_ENCRYPTED, handle)
+        if sc.get("debug_timing"):
+            runner.add_timing_hook(print_sync_timing)
+
+        bf = raw.get("backfill") or {}
+        if bf.get("enabled", True):
+            backfill = GapBackfill(
+                session,
+                conn,
+                handle,
+                timeline_filter=sync_filter.room.timeline,
+                concurrency=int(bf.get("concurrency", 4)),
+                max_pages=int(bf.get("max_pages", 50)),
+            )
+            runner.add_sync_hook(backfill.note_sync)
+            backfill.resume()
 
-            session.client.handle_sync(data)
-            since = data.get("next_batch")
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, runner.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        rc = raw.get("config_reload") or {}
+        if rc.get("enabled", True):
+            config_watcher.poll_interval = float(rc.get("poll_seconds", 5))
+            config_watcher.add_callback(apply_config)
+            config_watcher.start()
+
+        print("Listening for media uploads...")
+        await runner.run()
     finally:
+        try:
+            await config_watcher.close()
+        except Exception as e:
+            print(f"Config watcher close failed: {e!r}", flush=True)
+        runner = None
+        if forecast_task is not None:
+            forecast_task.cancel()
+            await asyncio.gather(forecast_task, return_exceptions=True)
+            forecaster = None
+        if retention_task is not None:
+            retention_task.cancel()
+            await asyncio.gather(retention_task, return_exceptions=True)
+            retention = None
+        if pending is not None:
+            await pending.close()
+            pending = None
+        if media_watcher is not None:
+            # Also closes a watcher whose start failed part-way.
+            try:
+                media_watcher.close()
+            except Exception as e:
+                print(f"Media accounting close failed: {e!r}", flush=True)
+            accounting = None
+        if eviction is not None:
+            await eviction.close()
+            eviction = None
+        if outbox is not None:
+            await outbox.close()
+            outbox = None
+        if backfill is not None:
+            await backfill.close()
+            backfill = None
         if conn:
             conn.close()
         await session.close()
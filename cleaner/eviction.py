@@ -0,0 +1,225 @@
+"""Warm eviction queue for the event daemon.
+
+Emergency cleanup used to start with a sorted query over the whole uploads
+index and a media store scan per candidate.  :class:`EvictionQueue` keeps
+the next-best candidates in pressure order (non-images first, largest
+first, oldest first) with their files already resolved, so
+:func:`cleaner.cleaner.run_pressure` can start unlinking immediately.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import sqlite3
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from cleaner.cleaner import pressure_query, resolve_media_paths
+from cleaner.db import connect
+
+
+class Candidate(NamedTuple):
+    """One upload waiting in the eviction queue."""
+
+    key: Tuple[int, int, int]
+    event_id: str
+    room_id: str
+    sender: str
+    mxc_uri: str
+    mimetype: str
+    size: int
+    timestamp: int
+    paths: Optional[List[Path]]
+
+
+def eviction_key(mimetype: Optional[str], size: Optional[int], timestamp: Optional[int]) -> Tuple[int, int, int]:
+    """Sort key matching the pressure query order.
+
+    :param mimetype: Upload mimetype
+    :type mimetype: Optional[str]
+    :param size: Upload size in bytes
+    :type size: Optional[int]
+    :param timestamp: Upload timestamp in milliseconds
+    :type timestamp: Optional[int]
+    :return: Key where smaller evicts first
+    :rtype: Tuple[int, int, int]
+    """
+    is_image = int((mimetype or "").lower().startswith("image/"))
+    return is_image, -(size or 0), timestamp or 0
+
+
+class EvictionQueue:
+    """Bounded, sorted list of the next uploads pressure cleanup would take.
+
+    The queue is filled from the index, topped up as uploads are logged
+    and refilled in the background when it runs low.  Popped candidates are
+    checked against the index, so uploads deleted elsewhere are skipped.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param capacity: Maximum queued candidates
+    :type capacity: int
+    :param low_water: Refill when fewer candidates remain
+    :type low_water: Optional[int]
+    :param resolve_delay: Seconds to collect new uploads before resolving their files in one scan
+    :type resolve_delay: float
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        media_root: str,
+        capacity: int = 256,
+        low_water: Optional[int] = None,
+        resolve_delay: float = 0.5,
+    ) -> None:
+        self.conn = conn
+        # Refills read through their own connection in the executor thread.
+        self.db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+        self.media_root = media_root
+        self.resolve_delay = resolve_delay
+        self.capacity = capacity
+        self.low_water = capacity // 4 if low_water is None else low_water
+        self.entries: List[Candidate] = []
+        self._refill_task: Optional[asyncio.Task] = None
+        self._resolve_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def start(self) -> None:
+        """Fill the queue in the background."""
+        self._schedule_refill()
+
+    async def close(self) -> None:
+        """Cancel background refills."""
+        tasks = [t for t in (self._refill_task, self._resolve_task) if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refill_task = self._resolve_task = None
+
+    def _insert(self, candidate: Candidate) -> bool:
+        if len(self.entries) >= self.capacity and candidate.key >= self.entries[-1].key:
+            return False
+        bisect.insort(self.entries, candidate, key=lambda c: c.key)
+        del self.entries[self.capacity:]
+        return True
+
+    def _load(self) -> Tuple[List[tuple], dict]:
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(*pressure_query(self.capacity)).fetchall()
+        finally:
+            conn.close()
+        return rows, resolve_media_paths(self.media_root, [r[3] for r in rows])
+
+    async def refill(self) -> None:
+        """Reload the best candidates from the index and resolve their files.
+
+        The query and the media store scan both run in an executor thread.
+        """
+        loop = asyncio.get_running_loop()
+        if self.db_path:
+            rows, resolved = await loop.run_in_executor(None, self._load)
+        else:
+            rows = self.conn.execute(*pressure_query(self.capacity)).fetchall()
+            resolved = await loop.run_in_executor(
+                None, resolve_media_paths, self.media_root, [r[3] for r in rows]
+            )
+        fresh = [
+            Candidate(eviction_key(mime, size, ts), eid, room, sender, mxc, mime or "",
+                      size or 0, ts or 0, resolved.get(mxc))
+            for eid, room, sender, mxc, mime, size, ts in rows
+        ]
+        ids: Set[str] = {c.event_id for c in fresh}
+        # Keep uploads logged while the refill was running.
+        kept = [c for c in self.entries if c.event_id not in ids]
+        self.entries = []
+        for c in fresh + kept:
+            self._insert(c)
+
+    async def _resolve_pending(self) -> None:
+        # Let a burst of uploads share one media store scan.
+        await asyncio.sleep(self.resolve_delay)
+        while True:
+            pending = {c.mxc_uri for c in self.entries if c.paths is None}
+            if not pending:
+                return
+            resolved = await asyncio.get_running_loop().run_in_executor(
+                None, resolve_media_paths, self.media_root, pending
+            )
+            self.entries = [
+                c._replace(paths=resolved[c.mxc_uri]) if c.paths is None and c.mxc_uri in resolved else c
+                for c in self.entries
+            ]
+
+    def _schedule_refill(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._guard(self.refill, "refill"))
+
+    def _schedule_resolve(self) -> None:
+        if self._resolve_task is None or self._resolve_task.done():
+            self._resolve_task = asyncio.ensure_future(self._guard(self._resolve_pending, "resolve"))
+
+    @staticmethod
+    async def _guard(fn, what: str) -> None:
+        try:
+            await fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Eviction queue {what} failed: {e!r}", flush=True)
+
+    def note_upload(
+        self,
+        event_id: str,
+        room_id: str,
+        sender: str,
+        mxc_uri: str,
+        mimetype: str,
+        size: int,
+        timestamp: int,
+    ) -> None:
+        """Queue a newly logged upload if it ranks among the best candidates.
+
+        :param event_id: Upload event ID
+        :type event_id: str
+        :param room_id: Upload room
+        :type room_id: str
+        :param sender: Upload sender
+        :type sender: str
+        :param mxc_uri: MXC URI of the upload
+        :type mxc_uri: str
+        :param mimetype: Upload mimetype
+        :type mimetype: str
+        :param size: Upload size in bytes
+        :type size: int
+        :param timestamp: Upload timestamp in milliseconds
+        :type timestamp: int
+        """
+        candidate = Candidate(
+            eviction_key(mimetype, size, timestamp), event_id, room_id, sender,
+            mxc_uri, mimetype or "", size or 0, timestamp or 0, None,
+        )
+        if self._insert(candidate):
+            self._schedule_resolve()
+
+    def pop(self) -> Optional[Candidate]:
+        """Take the best candidate that is still indexed.
+
+        :return: Candidate, ``None`` when the queue is empty
+        :rtype: Optional[Candidate]
+        """
+        while self.entries:
+            c = self.entries.pop(0)
+            if len(self.entries) < self.low_water:
+                self._schedule_refill()
+            if self.conn.execute(
+                "SELECT 1 FROM upload_records WHERE event_id = ?", (c.event_id,)
+            ).fetchone():
+                return c
+        self._schedule_refill()
+        return None
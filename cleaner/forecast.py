@@ -0,0 +1,283 @@
+"""Disk growth forecasting and pre-emptive cleanup.
+
+The event daemon samples disk usage and upload bytes into the
+``disk_samples`` table and fits a rolling linear growth rate.  When the
+projected time until ``policy.emergency`` drops below the configured
+horizon, it frees just enough space, in small rate-limited batches, to push
+the projection back past the horizon.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Callable, List, Optional, Tuple
+
+from catcord_bots.matrix import MatrixSession
+from cleaner.cleaner import Policy, age_candidates, expire_upload
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def record_sample(
+    conn: sqlite3.Connection,
+    ts_ms: int,
+    used_bytes: int,
+    total_bytes: int,
+    upload_bytes: int,
+    keep_ms: int = 7 * 86400 * 1000,
+) -> None:
+    """Store one usage sample and drop samples older than ``keep_ms``.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param ts_ms: Sample time in milliseconds
+    :type ts_ms: int
+    :param used_bytes: Used bytes on the media filesystem
+    :type used_bytes: int
+    :param total_bytes: Size of the media filesystem
+    :type total_bytes: int
+    :param upload_bytes: Bytes uploaded since the previous sample
+    :type upload_bytes: int
+    :param keep_ms: Sample history to keep
+    :type keep_ms: int
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO disk_samples (ts, used_bytes, total_bytes, upload_bytes) "
+        "VALUES (?, ?, ?, ?)",
+        (ts_ms, used_bytes, total_bytes, upload_bytes),
+    )
+    conn.execute("DELETE FROM disk_samples WHERE ts < ?", (ts_ms - keep_ms,))
+    conn.commit()
+
+
+def _slope(points: List[Tuple[float, float]]) -> Optional[float]:
+    n = len(points)
+    if n < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def growth_rate(conn: sqlite3.Connection, window_ms: int, now_ms: Optional[int] = None) -> Optional[float]:
+    """Fit the disk growth rate over the recent window.
+
+    The rate is the least-squares slope of used bytes, but never below the
+    upload inflow rate, so cleanups inside the window do not hide a burst.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param window_ms: Window length in milliseconds
+    :type window_ms: int
+    :param now_ms: Current time in milliseconds, defaults to now
+    :type now_ms: Optional[int]
+    :return: Growth in bytes per second, ``None`` with fewer than two samples
+    :rtype: Optional[float]
+    """
+    now_ms = _now_ms() if now_ms is None else now_ms
+    rows = conn.execute(
+        "SELECT ts, used_bytes, upload_bytes FROM disk_samples WHERE ts >= ? ORDER BY ts",
+        (now_ms - window_ms,),
+    ).fetchall()
+    slope = _slope([(ts / 1000, used) for ts, used, _ in rows])
+    if slope is None:
+        return None
+    span = (rows[-1][0] - rows[0][0]) / 1000
+    inflow = sum(up for _, _, up in rows[1:]) / span
+    return max(slope, inflow)
+
+
+def seconds_until(used_bytes: int, total_bytes: int, threshold: float, rate: Optional[float]) -> Optional[float]:
+    """Project when usage crosses ``threshold``.
+
+    :param used_bytes: Used bytes now
+    :type used_bytes: int
+    :param total_bytes: Filesystem size
+    :type total_bytes: int
+    :param threshold: Usage ratio to reach
+    :type threshold: float
+    :param rate: Growth in bytes per second
+    :type rate: Optional[float]
+    :return: Seconds until crossing, 0 if already over, ``None`` if not growing
+    :rtype: Optional[float]
+    """
+    headroom = threshold * total_bytes - used_bytes
+    if headroom <= 0:
+        return 0.0
+    if not rate or rate <= 0:
+        return None
+    return headroom / rate
+
+
+async def preemptive_cleanup(
+    session: MatrixSession,
+    conn: sqlite3.Connection,
+    media_root: str,
+    policy: Policy,
+    target_bytes: int,
+    batch_size: int = 10,
+    batch_interval: float = 10.0,
+) -> Tuple[int, int]:
+    """Free about ``target_bytes`` in rate-limited batches.
+
+    Disk usage is still below the pressure threshold here, so candidates
+    are taken oldest first, like an early retention run, rather than in the
+    size-ranked pressure order reserved for real pressure.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param target_bytes: Bytes to free
+    :type target_bytes: int
+    :param batch_size: Uploads per batch
+    :type batch_size: int
+    :param batch_interval: Pause between batches in seconds
+    :type batch_interval: float
+    :return: Expired upload count and freed bytes
+    :rtype: Tuple[int, int]
+    """
+    expired = 0
+    freed = 0
+    in_batch = 0
+    for event_id, room_id, sender, mxc_uri, mimetype, size, ts, paths in age_candidates(conn):
+        if freed >= target_bytes:
+            break
+        if in_batch >= batch_size:
+            in_batch = 0
+            await asyncio.sleep(batch_interval)
+        in_batch += 1
+        rule = policy.rule_for(room_id, sender, mimetype, size)
+        try:
+            _, upload_freed = await expire_upload(
+                session, conn, media_root, policy, rule,
+                event_id, room_id, mxc_uri, ts, "forecast", paths,
+            )
+            freed += upload_freed
+            expired += 1
+        except Exception as e:
+            print(f"pre-emptive cleanup failed {event_id}: {e}", flush=True)
+    return expired, freed
+
+
+class GrowthForecaster:
+    """Background sampler that cleans up before emergency is reached.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param usage: Returns the current disk usage ratio
+    :type usage: Callable[[], float]
+    :param horizon: Clean up when emergency is projected within this many seconds
+    :type horizon: float
+    :param sample_interval: Seconds between samples
+    :type sample_interval: float
+    :param window: Seconds of samples used for the fit
+    :type window: float
+    :param batch_size: Uploads per cleanup batch
+    :type batch_size: int
+    :param batch_interval: Pause between cleanup batches in seconds
+    :type batch_interval: float
+    :param cooldown: Minimum seconds between cleanups
+    :type cooldown: float
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        conn: sqlite3.Connection,
+        media_root: str,
+        policy: Policy,
+        usage: Callable[[], float],
+        horizon: float = 6 * 3600.0,
+        sample_interval: float = 60.0,
+        window: float = 3600.0,
+        batch_size: int = 10,
+        batch_interval: float = 10.0,
+        cooldown: float = 900.0,
+    ) -> None:
+        self.session = session
+        self.conn = conn
+        self.media_root = media_root
+        self.policy = policy
+        self.usage = usage
+        self.horizon = horizon
+        self.sample_interval = sample_interval
+        self.window = window
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.cooldown = cooldown
+        self.upload_bytes = 0
+        self._last_cleanup = 0.0
+
+    def note_upload(self, size: int) -> None:
+        """Add an upload to the inflow of the current sample.
+
+        :param size: Upload size in bytes
+        :type size: int
+        """
+        self.upload_bytes += max(0, size or 0)
+
+    async def check(self, now_ms: Optional[int] = None) -> Optional[float]:
+        """Take a sample and clean up if emergency is projected too soon.
+
+        :param now_ms: Sample time in milliseconds, defaults to now
+        :type now_ms: Optional[int]
+        :return: Projected seconds until emergency, ``None`` if not growing
+        :rtype: Optional[float]
+        """
+        now_ms = _now_ms() if now_ms is None else now_ms
+        st = os.statvfs(self.media_root)
+        total = st.f_blocks * st.f_frsize
+        used = int(self.usage() * total)
+        uploaded, self.upload_bytes = self.upload_bytes, 0
+        record_sample(self.conn, now_ms, used, total, uploaded)
+
+        rate = growth_rate(self.conn, int(self.window * 1000), now_ms)
+        eta = seconds_until(used, total, self.policy.emergency, rate)
+        if eta is None or eta >= self.horizon or eta == 0:
+            # Already at emergency is handled by the reactive pressure path.
+            return eta
+        if time.monotonic() - self._last_cleanup < self.cooldown:
+            return eta
+        self._last_cleanup = time.monotonic()
+        target = int(used + rate * self.horizon - self.policy.emergency * total)
+        print(
+            f"Forecast: emergency in {eta / 60:.0f} min at {rate / 1024 / 1024:.2f} MiB/s; "
+            f"freeing {target / 1024 / 1024:.0f} MiB",
+            flush=True,
+        )
+        expired, freed = await preemptive_cleanup(
+            self.session, self.conn, self.media_root, self.policy, target,
+            self.batch_size, self.batch_interval,
+        )
+        print(
+            f"Forecast cleanup: expired {expired} uploads, freed {freed / 1024 / 1024:.1f} MiB",
+            flush=True,
+        )
+        return eta
+
+    async def run(self) -> None:
+        """Sample and check until cancelled."""
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Forecast check failed: {e!r}", flush=True)
+            await asyncio.sleep(self.sample_interval)
@@ -0,0 +1,221 @@
+"""Incremental retention for the event-driven cleaner.
+
+Keeps a time-ordered expiry schedule with the next expiry per retention
+rule (the image/non-image defaults plus any configured rules), taken from
+the uploads index, and expires uploads in small, rate-limited batches as
+they cross their cutoffs.  The nightly retention run then only has
+stragglers left.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from catcord_bots.matrix import MatrixSession
+from cleaner.cleaner import (
+    DAY_MS, Policy, compile_retention_query, expire_upload, resolve_media_paths, rule_case_sql,
+)
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def next_expiry(conn: sqlite3.Connection, policy: Policy) -> Dict[int, Optional[int]]:
+    """Compute when the oldest upload under each retention rule expires.
+
+    One query per rule with a maximum age walks
+    ``idx_upload_records_timestamp`` from the oldest upload and stops at the
+    first one the rule matches, instead of grouping the whole table.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :return: Expiry timestamp (ms) per rule index with indexed uploads
+    :rtype: Dict[int, Optional[int]]
+    """
+    case_sql, params = rule_case_sql(policy)
+    sql = (
+        f"SELECT u.timestamp FROM upload_records u INDEXED BY idx_upload_records_timestamp "
+        f"WHERE ({case_sql}) = ? AND u.timestamp IS NOT NULL ORDER BY u.timestamp LIMIT 1"
+    )
+    schedule: Dict[int, Optional[int]] = {}
+    for idx, rule in enumerate(policy.effective_rules()):
+        if rule.max_age_days is None:
+            continue
+        row = conn.execute(sql, params + [idx]).fetchone()
+        if row is not None:
+            schedule[idx] = row[0] + rule.max_age_days * DAY_MS
+    return schedule
+
+
+def expired_batch(
+    conn: sqlite3.Connection, policy: Policy, limit: int, now_ms: Optional[int] = None
+) -> List[Tuple[str, str, str, str, int, int, int]]:
+    """Return up to ``limit`` expired uploads.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param policy: Cleanup policy
+    :type policy: Policy
+    :param limit: Maximum rows to return
+    :type limit: int
+    :param now_ms: Current time in milliseconds, defaults to now
+    :type now_ms: Optional[int]
+    :return: ``(event_id, room_id, mxc_uri, mimetype, size, timestamp, rule)`` rows
+    :rtype: List[Tuple[str, str, str, str, int, int, int]]
+    """
+    now_ms = _now_ms() if now_ms is None else now_ms
+    sql, params = compile_retention_query(policy, now_ms, limit=limit)
+    return conn.execute(sql, params).fetchall()
+
+
+class IncrementalRetention:
+    """Background task that expires uploads continuously.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param media_root: Media store root
+    :type media_root: str
+    :param policy: Retention policy
+    :type policy: Policy
+    :param batch_size: Uploads expired per batch
+    :type batch_size: int
+    :param batch_interval: Pause between batches in seconds
+    :type batch_interval: float
+    :param max_sleep: Longest idle sleep before re-reading the schedule
+    :type max_sleep: float
+    :param retry_interval: Delay before retrying uploads that failed to expire
+    :type retry_interval: float
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        conn: sqlite3.Connection,
+        media_root: str,
+        policy: Policy,
+        batch_size: int = 20,
+        batch_interval: float = 5.0,
+        max_sleep: float = 3600.0,
+        retry_interval: float = 300.0,
+    ) -> None:
+        self.session = session
+        self.conn = conn
+        self.media_root = media_root
+        self.policy = policy
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_sleep = max_sleep
+        self.retry_interval = retry_interval
+        self.schedule: Dict[int, Optional[int]] = {}
+        self._wakeup = asyncio.Event()
+
+    def set_policy(self, policy: Policy) -> None:
+        """Switch to a new policy and rebuild the schedule.
+
+        :param policy: Cleanup policy
+        :type policy: Policy
+        """
+        self.policy = policy
+        self._wakeup.set()
+
+    def note_upload(
+        self, room_id: str, sender: str, mimetype: str, size: int, timestamp: int
+    ) -> None:
+        """Move the schedule forward if a new upload expires first.
+
+        :param room_id: Upload room
+        :type room_id: str
+        :param sender: Upload sender
+        :type sender: str
+        :param mimetype: Upload mimetype
+        :type mimetype: str
+        :param size: Upload size in bytes
+        :type size: int
+        :param timestamp: Upload timestamp in milliseconds
+        :type timestamp: int
+        """
+        idx = self.policy.rule_for(room_id, sender, mimetype, size)
+        age = self.policy.effective_rules()[idx].max_age_days
+        if age is None:
+            return
+        due = timestamp + age * DAY_MS
+        current = self.schedule.get(idx)
+        if current is None or due < current:
+            self.schedule[idx] = due
+            self._wakeup.set()
+
+    def next_due(self) -> Optional[int]:
+        """Return the earliest scheduled expiry.
+
+        :return: Timestamp in milliseconds, ``None`` if nothing is indexed
+        :rtype: Optional[int]
+        """
+        due = [t for t in self.schedule.values() if t is not None]
+        return min(due) if due else None
+
+    async def expire_due(self) -> Tuple[int, int]:
+        """Expire all due uploads in rate-limited batches.
+
+        :return: Expired (deleted or archived) upload count and freed bytes
+        :rtype: Tuple[int, int]
+        """
+        deleted = 0
+        freed = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = expired_batch(self.conn, self.policy, self.batch_size)
+            # One media store scan per batch, off the event loop.
+            resolved = await loop.run_in_executor(
+                None, resolve_media_paths, self.media_root, [row[2] for row in batch]
+            )
+            batch_deleted = 0
+            for event_id, room_id, mxc_uri, _, _, ts, rule in batch:
+                try:
+                    _, upload_freed = await expire_upload(
+                        self.session, self.conn, self.media_root, self.policy, rule,
+                        event_id, room_id, mxc_uri, ts, "retention", resolved[mxc_uri],
+                    )
+                    freed += upload_freed
+                    batch_deleted += 1
+                except Exception as e:
+                    print(f"incremental retention failed {event_id}: {e}", flush=True)
+            deleted += batch_deleted
+            if len(batch) < self.batch_size or batch_deleted == 0:
+                return deleted, freed
+            await asyncio.sleep(self.batch_interval)
+
+    async def run(self) -> None:
+        """Sleep until the next expiry, expire, repeat until cancelled."""
+        while True:
+            try:
+                self.schedule = next_expiry(self.conn, self.policy)
+                due = self.next_due()
+                if due is not None and due <= _now_ms():
+                    deleted, freed = await self.expire_due()
+                    if deleted:
+                        print(
+                            f"Incremental retention: deleted {deleted} uploads, "
+                            f"freed {freed / 1024 / 1024:.1f} MiB",
+                            flush=True,
+                        )
+                    self.schedule = next_expiry(self.conn, self.policy)
+                    due = self.next_due()
+                timeout = self.max_sleep
+                if due is not None:
+                    # Uploads still due after a pass failed to delete; retry later.
+                    floor = self.batch_interval if due > _now_ms() else self.retry_interval
+                    timeout = min(timeout, max(floor, (due - _now_ms()) / 1000))
+            except Exception as e:
+                print(f"Incremental retention pass failed: {e!r}", flush=True)
+                timeout = self.max_sleep
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,35 +1,53 @@
 import argparse
 import asyncio
 import os
+import time
 from catcord_bots.config import load_yaml, FrameworkConfig
 from catcord_bots.matrix import create_client, whoami
+from catcord_bots.outbound import open_outbound
 from catcord_bots.invites import join_all_invites
-from .cleaner import init_db, sync_uploads, Policy, run_retention, run_pressure
+from .cleaner import init_db, sync_uploads, policy_from_config, run_retention, run_pressure
+from .dedupe import run_dedupe
+from .archive import archived_paths, restore_file
+from .outbox import RedactionOutbox
+from .stats import run_stats
+
+
+def restore(args) -> None:
+    conn = init_db("/state/uploads.db")
+    try:
+        if args.file:
+            paths = [args.file]
+        else:
+            paths = archived_paths(conn, args.mxc)
+            if not paths:
+                print(f"No archived files for {args.mxc}")
+        for path in paths:
+            dest = args.output or path
+            n = restore_file(conn, path, dest)
+            print(f"Restored {path} -> {dest} ({n} bytes)")
+    finally:
+        conn.close()
 
 
 async def main_async(args):
     raw = load_yaml(args.config)
     cfg = FrameworkConfig.from_dict(raw)
-    session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token)
+    session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token, cfg.http)
     try:
+        open_outbound(session, cfg.outbound)
         me = await whoami(session)
         print("Authenticated as:", me)
         allow = cfg.rooms_allowlist[:] if cfg.rooms_allowlist else ([cfg.notifications.log_room_id] if cfg.notifications.log_room_id else [])
-        joined = await join_all_invites(session, allowlist=[r for r in allow if r])
+        joined = await join_all_invites(
+            session, allowlist=[r for r in allow if r], state_path="/state/cleaner_invites.json"
+        )
         if joined:
             print("Auto-joined invites:", joined)
         conn = init_db("/state/uploads.db")
         try:
             await sync_uploads(session, conn, cfg.rooms_allowlist)
-            pol = raw.get("policy") or {}
-            rd = (pol.get("retention_days") or {})
-            thr = (pol.get("disk_thresholds") or {})
-            policy = Policy(
-                image_days=int(rd.get("image", 90)),
-                non_image_days=int(rd.get("non_image", 30)),
-                pressure=float(thr.get("pressure", 0.85)),
-                emergency=float(thr.get("emergency", 0.92)),
-            )
+            policy = policy_from_config(raw)
 
             if args.mode == "retention":
                 await run_retention(
@@ -42,6 +60,22 @@ async def main_async(args):
                     dry_run=args.dry_run,
                     print_effective_config=args.print_effective_config,
                 )
+            elif args.mode == "stats":
+                await run_stats(
+                    session,
+                    conn,
+                    cfg.notifications.log_room_id,
+                    top=args.top,
+                    dry_run=args.dry_run,
+                )
+            elif args.mode == "dedupe":
+                result = run_dedupe(conn, "/srv/media", dry_run=args.dry_run)
+                prefix = "[DRY-RUN] " if args.dry_run else ""
+                print(
+                    f"{prefix}Dedupe: scanned {result.scanned} files, hashed {result.hashed}, "
+                    f"{result.duplicates} duplicates, linked {result.linked}, "
+                    f"reclaimed {result.reclaimed_bytes / 1024 / 1024:.1f} MiB"
+                )
             else:
                 await run_pressure(
                     session=session,
@@ -53,6 +87,20 @@ async def main_async(args):
                     dry_run=args.dry_run,
                     print_effective_config=args.print_effective_config,
                 )
+
+            if policy.redaction_outbox and not args.dry_run:
+                ob = (raw.get("policy") or {}).get("redaction_outbox") or {}
+                outbox = RedactionOutbox(
+                    session,
+                    conn,
+                    min_interval=1.0 / float(ob.get("rate_per_second", 5)),
+                    mass_batch=int(ob.get("mass_batch", 100)),
+                )
+                left = await outbox.drain(
+                    deadline=time.monotonic() + float(ob.get("drain_seconds", 300))
+                )
+                if left:
+                    print(f"{left} redactions left in the outbox for the next run")
         finally:
             conn.close()
     finally:
@@ -62,10 +110,19 @@ async def main_async(args):
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--config", default="/config/config.yaml")
-    p.add_argument("--mode", choices=["retention", "pressure"], required=True)
+    p.add_argument("--mode", choices=["retention", "pressure", "dedupe", "restore", "stats"], required=True)
     p.add_argument("--dry-run", action="store_true")
     p.add_argument("--print-effective-config", action="store_true", help="Force send notification for nightly summaries")
+    p.add_argument("--file", help="restore: original media path of one archived file")
+    p.add_argument("--mxc", help="restore: restore every archived file of an MXC URI")
+    p.add_argument("--output", help="restore: write to this path instead of the original")
+    p.add_argument("--top", type=int, default=10, help="stats: rooms and senders to list")
     args = p.parse_args()
+    if args.mode == "restore":
+        if not (args.file or args.mxc):
+            p.error("--mode restore needs --file or --mxc")
+        restore(args)
+        return
     asyncio.run(main_async(args))
 
 
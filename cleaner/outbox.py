@@ -0,0 +1,294 @@
+"""Durable redaction outbox.
+
+In outbox mode cleanup unlinks files first and queues the redaction in the
+``redaction_outbox`` table in the same transaction that drops the upload
+from the index, so freeing space never waits on the homeserver.
+:class:`RedactionOutbox` drains the table at a bounded rate and retries
+failures with exponential backoff.
+
+When the homeserver advertises MSC2244 mass redactions, due entries of one
+room are redacted together by a single ``m.room.redaction`` event whose
+``redacts`` is a list of event IDs.  Otherwise each event gets its own
+``/redact`` request.
+
+The cron cleaner and the event daemon may drain the same table.  A drainer
+claims rows before sending by setting ``claimed_by`` and pushing
+``next_attempt`` to the end of a lease in one ``UPDATE``, so no row is sent
+by both.  A drainer that dies mid-send simply lets its lease run out.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from mautrix.api import Method
+from mautrix.errors import MForbidden, MLimitExceeded, MNotFound, MatrixRequestError
+from mautrix.types import EventID, EventType, RoomID
+
+from catcord_bots.matrix import MatrixSession
+
+
+MASS_REDACTION_FEATURE = "org.matrix.msc2244"
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+async def supports_mass_redaction(session: MatrixSession) -> bool:
+    """Check whether the homeserver advertises MSC2244 mass redactions.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :return: True if ``unstable_features`` enables the MSC
+    :rtype: bool
+    """
+    try:
+        resp = await session.api.request(Method.GET, "/_matrix/client/versions")
+    except Exception as e:
+        print(f"Could not read /versions, assuming no mass redaction: {e}", flush=True)
+        return False
+    return bool((resp.get("unstable_features") or {}).get(MASS_REDACTION_FEATURE))
+
+
+def enqueue_redaction(conn: sqlite3.Connection, event_id: str, room_id: str, reason: str) -> None:
+    """Queue a redaction without committing.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param event_id: Event to redact
+    :type event_id: str
+    :param room_id: Room of the event
+    :type room_id: str
+    :param reason: Redaction reason
+    :type reason: str
+    """
+    now = _now_ms()
+    conn.execute(
+        "INSERT OR IGNORE INTO redaction_outbox "
+        "(event_id, room_id, reason, attempts, next_attempt, enqueued_at) "
+        "VALUES (?, ?, ?, 0, ?, ?)",
+        (event_id, room_id, reason, now, now),
+    )
+
+
+def outbox_size(conn: sqlite3.Connection) -> int:
+    """Return the number of queued redactions.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :return: Queued redaction count
+    :rtype: int
+    """
+    return conn.execute("SELECT COUNT(*) FROM redaction_outbox").fetchone()[0]
+
+
+class RedactionOutbox:
+    """Rate-limited drainer for the redaction outbox.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param min_interval: Minimum seconds between redaction requests
+    :type min_interval: float
+    :param base_delay: First retry delay in seconds
+    :type base_delay: float
+    :param max_delay: Upper bound for the retry delay in seconds
+    :type max_delay: float
+    :param poll_interval: Idle seconds between checks for new entries
+    :type poll_interval: float
+    :param mass_batch: Most events per mass redaction, 0 to always redact singly
+    :type mass_batch: int
+    :param lease: Seconds claimed rows stay reserved for this drainer
+    :type lease: float
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        conn: sqlite3.Connection,
+        min_interval: float = 0.2,
+        base_delay: float = 5.0,
+        max_delay: float = 3600.0,
+        poll_interval: float = 5.0,
+        mass_batch: int = 100,
+        lease: float = 300.0,
+    ) -> None:
+        self.session = session
+        self.conn = conn
+        self.min_interval = min_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.mass_batch = mass_batch
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self._claims = 0
+        self.mass_redaction: Optional[bool] = None if mass_batch > 0 else False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start draining in the background."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        """Cancel and await the drainer."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self) -> None:
+        """Drain now instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _claim(self, limit: int, room_id: Optional[str] = None,
+               reason: Optional[str] = None) -> List[Tuple[str, str, str, int]]:
+        now = _now_ms()
+        until = now + int(self.lease * 1000)
+        self._claims += 1
+        token = f"{self.owner}:{self._claims}"
+        where, params = "next_attempt <= ?", [now]
+        if room_id is not None:
+            where += " AND room_id = ? AND reason = ?"
+            params += [room_id, reason]
+        # One statement, so a concurrent drainer sees the rows as not due.
+        self.conn.execute(
+            "UPDATE redaction_outbox SET claimed_by = ?, next_attempt = ? WHERE event_id IN "
+            f"(SELECT event_id FROM redaction_outbox WHERE {where} ORDER BY next_attempt LIMIT ?)",
+            [token, until, *params, limit],
+        )
+        rows = self.conn.execute(
+            "SELECT event_id, room_id, reason, attempts FROM redaction_outbox "
+            "WHERE claimed_by = ?",
+            (token,),
+        ).fetchall()
+        self.conn.commit()
+        return rows
+
+    def _release(self, event_ids: List[str]) -> None:
+        self.conn.executemany(
+            "UPDATE redaction_outbox SET claimed_by = NULL, next_attempt = ? "
+            "WHERE event_id = ? AND claimed_by LIKE ?",
+            [(_now_ms(), e, f"{self.owner}:%") for e in event_ids],
+        )
+        self.conn.commit()
+
+    def _done(self, event_ids: List[str]) -> None:
+        self.conn.executemany(
+            "DELETE FROM redaction_outbox WHERE event_id = ?", [(e,) for e in event_ids]
+        )
+        self.conn.commit()
+
+    def _failed(self, rows: List[Tuple[str, int]], err: Exception) -> float:
+        retry_after = getattr(err, "retry_after_ms", None)
+        delay = self.base_delay
+        for event_id, attempts in rows:
+            if isinstance(err, MLimitExceeded) and retry_after:
+                delay = retry_after / 1000
+            else:
+                delay = min(self.base_delay * (2 ** attempts), self.max_delay)
+            self.conn.execute(
+                "UPDATE redaction_outbox SET attempts = ?, next_attempt = ?, last_error = ?, "
+                "claimed_by = NULL WHERE event_id = ?",
+                (attempts + 1, _now_ms() + int(delay * 1000), str(err), event_id),
+            )
+        self.conn.commit()
+        print(f"Redaction of {len(rows)} events failed, retrying in {delay:.0f}s: {err}", flush=True)
+        # Back off the whole outbox when the homeserver is rate limiting.
+        return delay if isinstance(err, MLimitExceeded) else self.min_interval
+
+    async def _send_mass(self, room_id: str, reason: str, rows: List[Tuple[str, int]]) -> float:
+        event_ids = [r[0] for r in rows]
+        try:
+            await self.session.client.send_message_event(
+                RoomID(room_id), EventType.ROOM_REDACTION,
+                {"redacts": event_ids, "reason": reason},
+            )
+        except (MNotFound, MForbidden) as e:
+            # One bad event fails the batch; retry these singly.
+            print(f"Mass redaction in {room_id} rejected ({e}), retrying singly", flush=True)
+            for event_id, attempts in rows:
+                await self._send_single(event_id, room_id, reason, attempts)
+                await asyncio.sleep(self.min_interval)
+            return self.min_interval
+        except MatrixRequestError as e:
+            if e.http_status in (400, 404) or e.errcode in ("M_UNRECOGNIZED", "M_BAD_JSON"):
+                print(f"Mass redaction not accepted ({e}), falling back to single redactions", flush=True)
+                self.mass_redaction = False
+                self._release(event_ids)
+                return 0.0
+            return self._failed(rows, e)
+        except Exception as e:
+            return self._failed(rows, e)
+        self._done(event_ids)
+        return self.min_interval
+
+    async def _send_single(self, event_id: str, room_id: str, reason: str, attempts: int) -> float:
+        try:
+            await self.session.client.redact(RoomID(room_id), EventID(event_id), reason=reason)
+        except (MNotFound, MForbidden) as e:
+            print(f"Dropping redaction of {event_id}: {e}", flush=True)
+        except Exception as e:
+            return self._failed([(event_id, attempts)], e)
+        self._done([event_id])
+        return self.min_interval
+
+    async def send_one(self) -> Optional[float]:
+        """Send the oldest due redaction, batched with its room when supported.
+
+        :return: Seconds to pause before the next send, ``None`` if nothing is due
+        :rtype: Optional[float]
+        """
+        if self.mass_redaction is None and self._claimable():
+            self.mass_redaction = await supports_mass_redaction(self.session)
+        claimed = self._claim(1)
+        if not claimed:
+            return None
+        event_id, room_id, reason, attempts = claimed[0]
+        if self.mass_redaction:
+            rows = [(event_id, attempts)]
+            rows += [(e, a) for e, _, _, a in self._claim(self.mass_batch - 1, room_id, reason)]
+            return await self._send_mass(room_id, reason, rows)
+        return await self._send_single(event_id, room_id, reason, attempts)
+
+    def _claimable(self) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM redaction_outbox WHERE next_attempt <= ? LIMIT 1", (_now_ms(),)
+        ).fetchone() is not None
+
+    async def drain(self, deadline: Optional[float] = None) -> int:
+        """Send due redactions until none are due or the deadline passes.
+
+        :param deadline: ``time.monotonic()`` value to stop at
+        :type deadline: Optional[float]
+        :return: Redactions still queued
+        :rtype: int
+        """
+        while deadline is None or time.monotonic() < deadline:
+            pause = await self.send_one()
+            if pause is None:
+                break
+            if deadline is not None:
+                pause = min(pause, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(pause)
+        return outbox_size(self.conn)
+
+    async def run(self) -> None:
+        """Drain continuously until cancelled."""
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"Redaction outbox pass failed: {e!r}", flush=True)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
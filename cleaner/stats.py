@@ -0,0 +1,133 @@
+"""Storage usage report from the materialized usage aggregates.
+
+``usage_by_room``, ``usage_by_sender``, ``usage_by_class`` and
+``usage_by_month`` are kept up to date by triggers on ``upload_records``
+(see :mod:`cleaner.db`), so the report reads a handful of indexed rows
+instead of scanning the upload index.
+"""
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from catcord_bots.matrix import MatrixSession, notify
+from cleaner.db import mime_class_sql
+
+# (label, bytes, count)
+UsageRow = Tuple[str, int, int]
+
+
+@dataclass
+class UsageReport:
+    """Top-N usage per dimension plus totals."""
+
+    total_bytes: int = 0
+    total_count: int = 0
+    rooms: List[UsageRow] = field(default_factory=list)
+    senders: List[UsageRow] = field(default_factory=list)
+    classes: List[UsageRow] = field(default_factory=list)
+    months: List[UsageRow] = field(default_factory=list)
+
+
+def usage_report(conn: sqlite3.Connection, top: int = 10, months: int = 6) -> UsageReport:
+    """Read the top consumers from the usage aggregates.
+
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param top: Rooms and senders to list
+    :type top: int
+    :param months: Most recent months to list
+    :type months: int
+    :return: Usage report
+    :rtype: UsageReport
+    """
+    # Same classes as the live accounting summary (cleaner.db.mime_class).
+    classes = conn.execute(
+        f"SELECT {mime_class_sql('class')} AS c, SUM(bytes), SUM(count) FROM usage_by_class "
+        "GROUP BY c ORDER BY 2 DESC"
+    ).fetchall()
+    return UsageReport(
+        total_bytes=sum(b for _, b, _ in classes),
+        total_count=sum(c for _, _, c in classes),
+        rooms=conn.execute(
+            "SELECT COALESCE(r.room_id, 'unknown'), a.bytes, a.count FROM usage_by_room a "
+            "LEFT JOIN rooms r ON r.id = a.room ORDER BY a.bytes DESC LIMIT ?",
+            (top,),
+        ).fetchall(),
+        senders=conn.execute(
+            "SELECT COALESCE(s.sender, 'unknown'), a.bytes, a.count FROM usage_by_sender a "
+            "LEFT JOIN senders s ON s.id = a.sender ORDER BY a.bytes DESC LIMIT ?",
+            (top,),
+        ).fetchall(),
+        classes=classes,
+        months=conn.execute(
+            "SELECT month, bytes, count FROM usage_by_month ORDER BY month DESC LIMIT ?",
+            (months,),
+        ).fetchall(),
+    )
+
+
+def _size(n: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+def format_usage_report(report: UsageReport) -> str:
+    """Render the report as a multi-line block.
+
+    :param report: Usage report
+    :type report: UsageReport
+    :return: Formatted report
+    :rtype: str
+    """
+    lines = [
+        "mode: stats",
+        f"uploads: {report.total_count}",
+        f"total: {_size(report.total_bytes)}",
+    ]
+    for title, rows in (
+        ("top rooms", report.rooms),
+        ("top senders", report.senders),
+        ("by type", report.classes),
+        ("by month", report.months),
+    ):
+        lines.append(f"{title}:")
+        if not rows:
+            lines.append("  (none)")
+        for label, size, count in rows:
+            lines.append(f"  {label}: {_size(size)} ({count} files)")
+    return "\n".join(lines)
+
+
+async def run_stats(
+    session: MatrixSession,
+    conn: sqlite3.Connection,
+    notifications_room: Optional[str],
+    top: int = 10,
+    dry_run: bool = False,
+) -> str:
+    """Print the usage report and send it to the notifications room.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param conn: Uploads database connection
+    :type conn: sqlite3.Connection
+    :param notifications_room: Room to send the report to
+    :type notifications_room: Optional[str]
+    :param top: Rooms and senders to list
+    :type top: int
+    :param dry_run: Print only
+    :type dry_run: bool
+    :return: Rendered report
+    :rtype: str
+    """
+    message = format_usage_report(usage_report(conn, top))
+    print(message)
+    if dry_run or not notifications_room:
+        return message
+    await notify(session, notifications_room, message)
+    return message
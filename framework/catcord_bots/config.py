@@ -1,7 +1,10 @@
 from __future__ import annotations
-from dataclasses import dataclass
+import asyncio
+import os
+import signal
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import yaml
 
 
@@ -62,6 +65,98 @@ class Notifications:
     send_zero_deletion_summaries: bool = False
 
 
+@dataclass
+class RequestPolicy:
+    """Retry, rate limit and connection pool settings for Matrix API calls.
+
+    :param max_retries: Retries after a 429, 5xx or connection error
+    :type max_retries: int
+    :param backoff_base: First retry delay in seconds when no ``retry_after_ms`` is given
+    :type backoff_base: float
+    :param backoff_max: Upper bound for a retry delay in seconds
+    :type backoff_max: float
+    :param rate: Requests per second allowed per homeserver
+    :type rate: float
+    :param burst: Requests allowed back to back before ``rate`` applies
+    :type burst: int
+    :param pool_limit: Open connections in total
+    :type pool_limit: int
+    :param pool_limit_per_host: Open connections per host
+    :type pool_limit_per_host: int
+    :param keepalive_timeout: Seconds an idle connection is kept for reuse
+    :type keepalive_timeout: float
+    """
+    max_retries: int = 5
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    rate: float = 20.0
+    burst: int = 20
+    pool_limit: int = 100
+    pool_limit_per_host: int = 32
+    keepalive_timeout: float = 60.0
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "RequestPolicy":
+        """Create RequestPolicy from the ``http`` config section.
+
+        :param d: ``http`` section
+        :type d: Dict[str, Any]
+        :return: Request policy
+        :rtype: RequestPolicy
+        """
+        default = RequestPolicy()
+        return RequestPolicy(
+            max_retries=int(d.get("max_retries", default.max_retries)),
+            backoff_base=float(d.get("backoff_base", default.backoff_base)),
+            backoff_max=float(d.get("backoff_max", default.backoff_max)),
+            rate=float(d.get("rate", default.rate)),
+            burst=int(d.get("burst", default.burst)),
+            pool_limit=int(d.get("pool_limit", default.pool_limit)),
+            pool_limit_per_host=int(d.get("pool_limit_per_host", default.pool_limit_per_host)),
+            keepalive_timeout=float(d.get("keepalive_timeout", default.keepalive_timeout)),
+        )
+
+
+@dataclass
+class OutboundConfig:
+    """Outbound message queue configuration.
+
+    :param enabled: Route ``send_text`` through the queue
+    :type enabled: bool
+    :param window: Seconds to collect messages for a room before sending
+    :type window: float
+    :param min_interval: Minimum seconds between messages to the same room
+    :type min_interval: float
+    :param max_chars: Longest coalesced message body
+    :type max_chars: int
+    :param separator: Text placed between coalesced messages
+    :type separator: str
+    """
+    enabled: bool = True
+    window: float = 2.0
+    min_interval: float = 1.0
+    max_chars: int = 16000
+    separator: str = "\n\n"
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "OutboundConfig":
+        """Create OutboundConfig from the ``outbound`` config section.
+
+        :param d: ``outbound`` section
+        :type d: Dict[str, Any]
+        :return: Outbound queue configuration
+        :rtype: OutboundConfig
+        """
+        default = OutboundConfig()
+        return OutboundConfig(
+            enabled=bool(d.get("enabled", default.enabled)),
+            window=float(d.get("window", default.window)),
+            min_interval=float(d.get("min_interval", default.min_interval)),
+            max_chars=int(d.get("max_chars", default.max_chars)),
+            separator=str(d.get("separator", default.separator)),
+        )
+
+
 @dataclass
 class FrameworkConfig:
     """Framework configuration.
@@ -74,11 +169,17 @@ class FrameworkConfig:
     :type notifications: Notifications
     :param rooms_allowlist: List of allowed room IDs
     :type rooms_allowlist: list[str]
+    :param http: Matrix API request policy
+    :type http: RequestPolicy
+    :param outbound: Outbound message queue configuration
+    :type outbound: OutboundConfig
     """
     homeserver: Homeserver
     bot: BotCreds
     notifications: Notifications
     rooms_allowlist: list[str]
+    http: RequestPolicy = field(default_factory=RequestPolicy)
+    outbound: OutboundConfig = field(default_factory=OutboundConfig)
 
     @staticmethod
     def from_dict(d: Dict[str, Any]) -> "FrameworkConfig":
@@ -103,4 +204,119 @@ class FrameworkConfig:
             bot=bot,
             notifications=notif,
             rooms_allowlist=list(d.get("rooms_allowlist") or []),
+            http=RequestPolicy.from_dict(d.get("http") or {}),
+            outbound=OutboundConfig.from_dict(d.get("outbound") or {}),
         )
+
+
+class ConfigWatcher:
+    """Reload a YAML config on SIGHUP or when the file changes.
+
+    A reload parses and validates the new file first; a broken file is
+    reported and the running config is kept.  Accepted configs replace
+    :attr:`snapshot` in one assignment, so readers always see a consistent
+    ``(raw, config)`` pair, and callbacks run afterwards.
+
+    :param path: Path to the YAML file
+    :type path: str | Path
+    :param validate: Extra check on the raw dict, raising on invalid configs
+    :type validate: Optional[Callable[[Dict[str, Any]], None]]
+    :param poll_interval: Seconds between mtime checks, 0 for SIGHUP only
+    :type poll_interval: float
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        validate: Optional[Callable[[Dict[str, Any]], None]] = None,
+        poll_interval: float = 5.0,
+    ) -> None:
+        self.path = Path(path)
+        self.validate = validate
+        self.poll_interval = poll_interval
+        self._callbacks: List[Callable[[Dict[str, Any], Dict[str, Any], FrameworkConfig], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._signal = False
+        self._mtime = self._stat()
+        raw = load_yaml(self.path)
+        self.snapshot: Tuple[Dict[str, Any], FrameworkConfig] = (raw, self._parse(raw))
+
+    @property
+    def raw(self) -> Dict[str, Any]:
+        """Current raw config."""
+        return self.snapshot[0]
+
+    @property
+    def config(self) -> FrameworkConfig:
+        """Current parsed config."""
+        return self.snapshot[1]
+
+    def add_callback(self, callback: Callable[[Dict[str, Any], Dict[str, Any], FrameworkConfig], None]) -> None:
+        """Call ``callback(old_raw, new_raw, config)`` after each accepted reload."""
+        self._callbacks.append(callback)
+
+    def _stat(self) -> Optional[Tuple[float, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def _parse(self, raw: Dict[str, Any]) -> FrameworkConfig:
+        config = FrameworkConfig.from_dict(raw)
+        if self.validate is not None:
+            self.validate(raw)
+        return config
+
+    def reload(self) -> bool:
+        """Load, validate and swap in the config file.
+
+        :return: True if a changed, valid config was applied
+        :rtype: bool
+        """
+        self._mtime = self._stat()
+        try:
+            raw = load_yaml(self.path)
+            config = self._parse(raw)
+        except Exception as e:
+            print(f"Config reload rejected, keeping current config: {e!r}", flush=True)
+            return False
+        old = self.raw
+        if raw == old:
+            return False
+        self.snapshot = (raw, config)
+        changed = sorted(k for k in set(old) | set(raw) if old.get(k) != raw.get(k))
+        print(f"Config reloaded, changed sections: {changed}", flush=True)
+        for callback in self._callbacks:
+            try:
+                callback(old, raw, config)
+            except Exception as e:
+                print(f"Config reload callback failed: {e!r}", flush=True)
+        return True
+
+    def start(self) -> None:
+        """Install the SIGHUP handler and start mtime polling."""
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+            self._signal = True
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._poll())
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self._stat() != self._mtime:
+                self.reload()
+
+    async def close(self) -> None:
+        """Stop polling and remove the SIGHUP handler."""
+        if self._signal:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._signal = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,233 @@
+"""Rate-limit-aware request layer for the Matrix client-server API.
+
+:class:`RetryingHTTPAPI` is a drop-in :class:`mautrix.api.HTTPAPI` that
+retries 429s, transient 5xx responses and connection errors.  A 429 waits
+for the server's ``retry_after_ms`` (or ``Retry-After``), otherwise retries
+back off exponentially with jitter.  Every attempt first takes a slot from
+a :class:`TokenBucket` shared by all clients of the same homeserver in the
+process.  The bucket halves its rate on a 429 and creeps back towards the
+configured rate on success, so bulk work settles at the rate the server
+sustains instead of hammering it.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from json import JSONDecodeError
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import ClientConnectionError, ClientResponse, ClientSession, ContentTypeError, TCPConnector
+from mautrix.api import HTTPAPI, Method
+from mautrix.errors import MatrixRequestError, make_request_error
+from yarl import URL
+
+from .config import RequestPolicy
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Request pacing shared by every caller of one homeserver.
+
+    Slots are handed out in call order at ``rate`` per second after an
+    initial ``burst``.  :meth:`penalize` pauses everyone and lowers the
+    rate; :meth:`reward` raises it again up to ``max_rate``.
+
+    :param rate: Requests per second
+    :type rate: float
+    :param burst: Requests allowed back to back
+    :type burst: int
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.max_rate = max(rate, 0.01)
+        self.min_rate = min(1.0, self.max_rate)
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self._tat = 0.0
+        self._blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Take the next slot.
+
+        :return: Seconds to wait before using it
+        :rtype: float
+        """
+        now = time.monotonic()
+        interval = 1.0 / self.rate
+        tat = max(self._tat, now, self._blocked_until)
+        self._tat = tat + interval
+        return max(0.0, tat - (self.burst - 1) * interval - now, self._blocked_until - now)
+
+    async def acquire(self) -> None:
+        """Wait for the next slot."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def penalize(self, delay: float) -> None:
+        """Pause all callers for ``delay`` seconds and halve the rate.
+
+        :param delay: Seconds the server asked to wait
+        :type delay: float
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self) -> None:
+        """Move the rate back towards ``max_rate`` after a success."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_buckets: Dict[Tuple[str, Optional[int]], TokenBucket] = {}
+
+
+def bucket_for(base_url: URL | str, policy: RequestPolicy) -> TokenBucket:
+    """Process-wide bucket for a homeserver.
+
+    The first caller's policy sets the rate.
+
+    :param base_url: Homeserver URL
+    :type base_url: URL | str
+    :param policy: Request policy
+    :type policy: RequestPolicy
+    :return: Shared bucket
+    :rtype: TokenBucket
+    """
+    url = URL(str(base_url))
+    key = (url.host or str(url), url.port)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = TokenBucket(policy.rate, policy.burst)
+    return bucket
+
+
+def make_client_session(policy: RequestPolicy) -> Optional[ClientSession]:
+    """aiohttp session with the policy's pool limits and keep-alive.
+
+    :param policy: Request policy
+    :type policy: RequestPolicy
+    :return: Session, or ``None`` outside a running event loop
+    :rtype: Optional[ClientSession]
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    connector = TCPConnector(
+        limit=policy.pool_limit,
+        limit_per_host=policy.pool_limit_per_host,
+        keepalive_timeout=policy.keepalive_timeout,
+        ttl_dns_cache=300,
+    )
+    return ClientSession(connector=connector, headers={"User-Agent": HTTPAPI.default_ua})
+
+
+def _retry_after(data: Any, response: ClientResponse) -> Optional[float]:
+    if isinstance(data, dict) and isinstance(data.get("retry_after_ms"), (int, float)):
+        return data["retry_after_ms"] / 1000
+    header = response.headers.get("Retry-After")
+    try:
+        return float(header) if header is not None else None
+    except ValueError:
+        return None
+
+
+class RetryingHTTPAPI(HTTPAPI):
+    """:class:`HTTPAPI` with retries, shared pacing and tuned pooling.
+
+    Errors that exhaust the retries are raised as usual; a 429 error carries
+    the server's delay as ``retry_after_ms``.
+
+    :param base_url: Homeserver URL
+    :type base_url: URL | str
+    :param token: Access token
+    :type token: str
+    :param policy: Request policy, defaults to :class:`RequestPolicy`
+    :type policy: Optional[RequestPolicy]
+    """
+
+    def __init__(self, base_url: URL | str, token: str = "", policy: Optional[RequestPolicy] = None, **kwargs: Any) -> None:
+        self.policy = policy or RequestPolicy()
+        kwargs.setdefault("client_session", make_client_session(self.policy))
+        # Retries happen per attempt in _send; mautrix's own loop would double them.
+        kwargs.setdefault("default_retry_count", 0)
+        super().__init__(base_url, token, **kwargs)
+        self.bucket = bucket_for(self.base_url, self.policy)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.policy.backoff_base * (2 ** attempt), self.policy.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send_once(
+        self,
+        method: Method,
+        url: URL,
+        content: Any,
+        query_params: Dict[str, str],
+        headers: Dict[str, str],
+    ) -> Tuple[Any, ClientResponse]:
+        request = self.session.request(str(method), url, data=content, params=query_params, headers=headers)
+        async with request as response:
+            if 200 <= response.status < 300:
+                return await response.json(), response
+            data = errcode = message = unstable_errcode = None
+            try:
+                data = await response.json()
+                errcode = data["errcode"]
+                message = data["error"]
+                unstable_errcode = data.get("org.matrix.msc3848.unstable.errcode")
+            except (JSONDecodeError, ContentTypeError, KeyError, TypeError):
+                pass
+            err = make_request_error(
+                http_status=response.status,
+                text=await response.text(),
+                errcode=errcode,
+                message=message,
+                unstable_errcode=unstable_errcode,
+            )
+            retry_after = _retry_after(data, response)
+            if retry_after is not None:
+                err.retry_after_ms = int(retry_after * 1000)
+            raise err
+
+    async def _send(
+        self,
+        method: Method,
+        url: URL,
+        content: Any,
+        query_params: Dict[str, str],
+        headers: Dict[str, str],
+    ) -> Tuple[Any, ClientResponse]:
+        # Streamed bodies cannot be sent twice.
+        replayable = content is None or isinstance(content, (bytes, bytearray, str))
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                result = await self._send_once(method, url, content, query_params, headers)
+                self.bucket.reward()
+                return result
+            except MatrixRequestError as e:
+                limited = e.http_status == 429 or getattr(e, "errcode", None) == "M_LIMIT_EXCEEDED"
+                if not limited and e.http_status not in RETRY_STATUSES:
+                    raise
+                if not replayable or attempt >= self.policy.max_retries:
+                    raise
+                retry_after = getattr(e, "retry_after_ms", None)
+                if limited:
+                    delay = retry_after / 1000 if retry_after else self._backoff(attempt)
+                    self.bucket.penalize(delay)
+                else:
+                    delay = self._backoff(attempt)
+                reason = f"HTTP {e.http_status}"
+            except (ClientConnectionError, asyncio.TimeoutError) as e:
+                if not replayable or attempt >= self.policy.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                reason = repr(e)
+            attempt += 1
+            print(f"{method} {url.path} failed ({reason}), retry {attempt} in {delay:.1f}s", flush=True)
+            await asyncio.sleep(delay)
@@ -1,23 +1,58 @@
 from __future__ import annotations
-from typing import Dict, List
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
 from .matrix import MatrixSession
+from .state import load_json_state, save_json_state
 
+# Sync filter that keeps only rooms.invite: no timelines, room state,
+# ephemeral events, presence or account data.
+INVITE_FILTER: Dict[str, Any] = {
+    "presence": {"not_types": ["*"]},
+    "account_data": {"not_types": ["*"]},
+    "room": {
+        "timeline": {"limit": 0, "not_types": ["*"]},
+        "state": {"not_types": ["*"]},
+        "ephemeral": {"not_types": ["*"]},
+        "account_data": {"not_types": ["*"]},
+    },
+}
 
-async def list_invites(session: MatrixSession) -> List[str]:
+
+async def list_invites(session: MatrixSession, state_path: Optional[str] = None) -> List[str]:
     """List all pending room invites.
 
+    With ``state_path`` the since token and the known invites are persisted,
+    so later calls only fetch what changed since the previous one.  Rooms
+    that were joined or left in the meantime are dropped from the set.
+
     :param session: Matrix session
     :type session: MatrixSession
+    :param state_path: JSON file for the since token and pending invites, ``None`` for a full sync
+    :type state_path: Optional[str]
     :return: List of room IDs with pending invites
     :rtype: List[str]
     """
+    state = load_json_state(state_path)
+    since = state.get("since")
+    query = {"timeout": "0", "filter": json.dumps(INVITE_FILTER, separators=(",", ":"))}
+    if since:
+        query["since"] = since
     sync = await session.client.api.request(
         method="GET",
         path="/_matrix/client/v3/sync",
-        query_params={"timeout": "0"},
+        query_params=query,
     )
-    invites: Dict[str, object] = ((sync.get("rooms") or {}).get("invite") or {})
-    return list(invites.keys())
+    rooms = sync.get("rooms") or {}
+    invites: Dict[str, None] = dict.fromkeys(state.get("invites") or []) if since else {}
+    for rid in (rooms.get("join") or {}):
+        invites.pop(rid, None)
+    for rid in (rooms.get("leave") or {}):
+        invites.pop(rid, None)
+    invites.update(dict.fromkeys(rooms.get("invite") or {}))
+    if state_path:
+        save_json_state(state_path, {"since": sync.get("next_batch") or since, "invites": list(invites)})
+    return list(invites)
 
 
 async def join_room(session: MatrixSession, room_id: str) -> None:
@@ -37,24 +72,47 @@ async def join_room(session: MatrixSession, room_id: str) -> None:
     )
 
 
-async def join_all_invites(session: MatrixSession, allowlist: list[str] | None = None) -> List[str]:
+async def join_all_invites(
+    session: MatrixSession,
+    allowlist: list[str] | None = None,
+    state_path: Optional[str] = None,
+    concurrency: int = 4,
+) -> List[str]:
     """Join all pending room invites, optionally filtered by allowlist.
 
+    Joins run concurrently, at most ``concurrency`` at a time.  Failed joins
+    stay in the persisted invite set and are retried on the next call.
+
     :param session: Matrix session
     :type session: MatrixSession
     :param allowlist: Optional list of allowed room IDs
     :type allowlist: list[str] | None
-    :return: List of successfully joined room IDs
+    :param state_path: JSON file passed to :func:`list_invites`
+    :type state_path: Optional[str]
+    :param concurrency: Joins in flight at once
+    :type concurrency: int
+    :return: List of successfully joined room IDs, in invite order
     :rtype: List[str]
     """
-    invites = await list_invites(session)
-    joined: List[str] = []
-    for rid in invites:
-        if allowlist and rid not in allowlist:
-            continue
-        try:
-            await join_room(session, rid)
-            joined.append(rid)
-        except Exception:
-            continue
+    invites = await list_invites(session, state_path)
+    wanted = [rid for rid in invites if not allowlist or rid in allowlist]
+    if not wanted:
+        return []
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def join(rid: str) -> bool:
+        async with slots:
+            try:
+                await join_room(session, rid)
+                return True
+            except Exception:
+                return False
+
+    results = await asyncio.gather(*(join(rid) for rid in wanted))
+    joined = [rid for rid, ok in zip(wanted, results) if ok]
+    if state_path and joined:
+        state = load_json_state(state_path)
+        done = set(joined)
+        state["invites"] = [rid for rid in state.get("invites") or [] if rid not in done]
+        save_json_state(state_path, state)
     return joined
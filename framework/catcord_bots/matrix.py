@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import hashlib
+import time
 from dataclasses import dataclass
 from typing import Any
 from urllib.parse import quote
@@ -8,23 +10,46 @@ from mautrix.api import HTTPAPI
 from mautrix.client import Client
 from mautrix.types import RoomID, DeviceID
 
+from .config import RequestPolicy
+from .http import RetryingHTTPAPI
+from .state import load_json_state, save_json_state
+
+# Owner recorded in the crypto database; the postgres state store shares it.
+CRYPTO_DB_OWNER = "catcord-cleaner-crypto"
+
 
 @dataclass
 class MatrixSession:
-    """Matrix session container."""
+    """Matrix session container.
+
+    ``user_id`` and ``device_id`` are set when startup already resolved them
+    (E2EE sessions), so callers can skip another ``/account/whoami``.
+    """
 
     api: HTTPAPI
     client: Client
     crypto: Any | None = None
     crypto_db: Any | None = None
+    state_db: Any | None = None
+    outbound: Any | None = None
+    user_id: str | None = None
+    device_id: str | None = None
 
     async def close(self) -> None:
-        """Close Matrix resources."""
-        try:
-            if self.crypto_db is not None:
-                await self.crypto_db.stop()
-        except Exception:
-            pass
+        """Close Matrix resources, sending queued outbound messages first."""
+        if self.outbound is not None:
+            try:
+                await self.outbound.close()
+            except Exception as e:
+                print(f"Outbound flush failed: {e!r}", flush=True)
+            self.outbound = None
+
+        for db in (self.state_db, self.crypto_db):
+            try:
+                if db is not None:
+                    await db.stop()
+            except Exception:
+                pass
 
         try:
             await self.api.session.close()
@@ -32,24 +57,121 @@ class MatrixSession:
             pass
 
 
-def create_client(mxid: str, base_url: str, token: str) -> MatrixSession:
-    """Create a Matrix client session without E2EE."""
-    api = HTTPAPI(base_url=base_url, token=token)
+def create_client(mxid: str, base_url: str, token: str, policy: RequestPolicy | None = None) -> MatrixSession:
+    """Create a Matrix client session without E2EE.
+
+    Requests go through :class:`~catcord_bots.http.RetryingHTTPAPI` with ``policy``.
+    """
+    api = RetryingHTTPAPI(base_url=base_url, token=token, policy=policy)
     client = Client(mxid=mxid, api=api)
     return MatrixSession(api=api, client=client)
 
 
+async def open_state_store(
+    e2ee_cfg: dict[str, Any], pg_url: str, upgrade: bool = True
+) -> tuple[Any, Any | None]:
+    """Open the room state store configured under ``e2ee.state_store``.
+
+    ``postgres`` (default) keeps members, encryption state and shared rooms
+    in the crypto database, ``sqlite`` in a local file, ``memory`` keeps
+    nothing across restarts.
+
+    :param e2ee_cfg: ``e2ee`` config section
+    :type e2ee_cfg: dict[str, Any]
+    :param pg_url: URL of the crypto store database
+    :type pg_url: str
+    :param upgrade: Run schema upgrade checks
+    :type upgrade: bool
+    :return: State store and its database, ``None`` for the memory store
+    :rtype: tuple[Any, Any | None]
+    """
+    ss_cfg = e2ee_cfg.get("state_store") or {}
+    kind = str(ss_cfg.get("type", "postgres")).lower()
+
+    if kind == "memory":
+        try:
+            from mautrix.client.state_store import MemoryStateStore
+        except ImportError:
+            from mautrix.client.state_store.memory import MemoryStateStore
+
+        state_store = MemoryStateStore()
+
+        # mautrix crypto expects this on state stores when requesting room keys.
+        # MemoryStateStore in this version does not provide it.
+        if not hasattr(state_store, "find_shared_rooms"):
+            async def find_shared_rooms(user_id):
+                return []
+            state_store.find_shared_rooms = find_shared_rooms
+        return state_store, None
+
+    from mautrix.client.state_store.asyncpg import PgStateStore
+    from mautrix.util.async_db import Database
+
+    if kind == "sqlite":
+        url = f"sqlite:///{ss_cfg.get('path', '/state/matrix_state.db')}"
+        owner = "catcord-state"
+    elif kind == "postgres":
+        url, owner = pg_url, CRYPTO_DB_OWNER
+    else:
+        raise ValueError(f"Unknown e2ee.state_store.type: {kind}")
+
+    state_db = Database.create(
+        url, upgrade_table=PgStateStore.upgrade_table if upgrade else None, owner_name=owner
+    )
+    await state_db.start()
+    state_store = PgStateStore(state_db)
+    warm = await state_db.fetchval(
+        "SELECT COUNT(*) FROM mx_room_state WHERE has_full_member_list = true"
+    )
+    print(f"State store ({kind}): {warm} rooms with cached member lists", flush=True)
+    return state_store, state_db
+
+
+def _fingerprint(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class StartupTimer:
+    """Collects per-step durations and prints them when enabled."""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.steps: list[tuple[str, float]] = []
+        self._start = self._last = time.monotonic()
+
+    def mark(self, step: str) -> None:
+        """Record the time since the previous mark under ``step``."""
+        now = time.monotonic()
+        self.steps.append((step, now - self._last))
+        self._last = now
+
+    def report(self, label: str) -> None:
+        """Print the breakdown if enabled."""
+        if not self.enabled:
+            return
+        parts = ", ".join(f"{step} {secs * 1000:.0f}ms" for step, secs in self.steps)
+        total = (self._last - self._start) * 1000
+        print(f"[debug] {label} startup {total:.0f}ms: {parts}", flush=True)
+
+
 async def create_client_e2ee(
     mxid: str,
     base_url: str,
     token: str,
     e2ee_cfg: dict[str, Any],
+    policy: RequestPolicy | None = None,
 ) -> MatrixSession:
-    """Create a Matrix client session with experimental E2EE support."""
-    from mautrix.crypto import OlmMachine
-    from mautrix.crypto.store import PgCryptoStore
-    from mautrix.util.async_db import Database
+    """Create a Matrix client session with experimental E2EE support.
 
+    Startup work is cached in ``e2ee.startup_cache`` (default
+    ``/state/e2ee_startup.json``) per database, account and access token:
+    the device ID, so ``/whoami`` is skipped, and the schema versions of the
+    crypto and state stores, so upgrade checks are skipped while they match.
+    Keys are only uploaded at startup for a new account; later one-time key
+    uploads are driven by the counts in sync responses.  If a cached start
+    fails, startup is retried without the cache.  ``e2ee.debug_timing``
+    prints a per-step timing breakdown.
+    """
     pg = e2ee_cfg["postgres"]
     username = quote(str(pg["username"]), safe="")
     password = quote(str(pg["password"]), safe="")
@@ -59,61 +181,163 @@ async def create_client_e2ee(
 
     db_url = f"postgres://{username}:{password}@{host}:{port}/{database}"
 
-    crypto_db = Database.create(
-        db_url,
-        upgrade_table=PgCryptoStore.upgrade_table,
-        owner_name="catcord-cleaner-crypto",
-    )
-    await crypto_db.start()
-
     account_id = e2ee_cfg.get("account_id") or mxid
-    pickle_key = e2ee_cfg["pickle_key"]
+    cache_path = e2ee_cfg.get("startup_cache", "/state/e2ee_startup.json")
+    cache_key = _fingerprint(db_url, account_id, mxid, token)
+    cache = load_json_state(cache_path)
+    if cache.get("key") != cache_key:
+        cache = {}
+
+    timer = StartupTimer(bool(e2ee_cfg.get("debug_timing")))
+    try:
+        session, fresh = await _start_e2ee(mxid, base_url, token, e2ee_cfg, db_url, cache, timer, policy)
+    except Exception as e:
+        if not cache:
+            raise
+        print(f"Cached E2EE startup failed ({e!r}), retrying without cache", flush=True)
+        timer = StartupTimer(timer.enabled)
+        session, fresh = await _start_e2ee(mxid, base_url, token, e2ee_cfg, db_url, {}, timer, policy)
+    save_json_state(cache_path, {"key": cache_key, **fresh})
+    timer.report("E2EE")
+    return session
 
-    crypto_store = PgCryptoStore(account_id, pickle_key, crypto_db)
 
+async def _start_e2ee(
+    mxid: str,
+    base_url: str,
+    token: str,
+    e2ee_cfg: dict[str, Any],
+    db_url: str,
+    cache: dict[str, Any],
+    timer: StartupTimer,
+    policy: RequestPolicy | None = None,
+) -> tuple[MatrixSession, dict[str, Any]]:
+    from mautrix.client.state_store.asyncpg import PgStateStore
+    from mautrix.crypto import OlmMachine
+    from mautrix.crypto.store import PgCryptoStore
+    from mautrix.util.async_db import Database
+
+    crypto_schema = len(PgCryptoStore.upgrade_table.upgrades)
+    state_schema = len(PgStateStore.upgrade_table.upgrades)
+
+    crypto_db = Database.create(
+        db_url,
+        upgrade_table=None if cache.get("crypto_schema") == crypto_schema else PgCryptoStore.upgrade_table,
+        owner_name=CRYPTO_DB_OWNER,
+    )
+    state_db = None
+    api = None
     try:
-        from mautrix.client.state_store import MemoryStateStore
-    except ImportError:
-        from mautrix.client.state_store.memory import MemoryStateStore
+        await crypto_db.start()
+        timer.mark("crypto db")
+
+        account_id = e2ee_cfg.get("account_id") or mxid
+        pickle_key = e2ee_cfg["pickle_key"]
 
-    state_store = MemoryStateStore()
+        crypto_store = PgCryptoStore(account_id, pickle_key, crypto_db)
 
-    # mautrix crypto expects this on state stores when requesting room keys.
-    # MemoryStateStore in this version does not provide it.
-    if not hasattr(state_store, "find_shared_rooms"):
-        async def find_shared_rooms(user_id):
-            return []
-        state_store.find_shared_rooms = find_shared_rooms
+        state_store, state_db = await open_state_store(
+            e2ee_cfg, db_url, upgrade=cache.get("state_schema") != state_schema
+        )
+        timer.mark("state store")
 
-    api = HTTPAPI(base_url=base_url, token=token)
-    client = Client(mxid=mxid, api=api, sync_store=crypto_store, state_store=state_store)
+        api = RetryingHTTPAPI(base_url=base_url, token=token, policy=policy)
+        client = Client(mxid=mxid, api=api, sync_store=crypto_store, state_store=state_store)
 
-    await crypto_store.open()
+        await crypto_store.open()
+        timer.mark("crypto store")
 
-    me = await client.whoami()
-    device_id = getattr(me, "device_id", None)
-    if not device_id:
-        raise RuntimeError("E2EE enabled but /account/whoami returned no device_id")
+        user_id = mxid
+        device_id = cache.get("device_id")
+        if not device_id:
+            me = await client.whoami()
+            user_id = str(getattr(me, "user_id", None) or mxid)
+            device_id = getattr(me, "device_id", None)
+            if not device_id:
+                raise RuntimeError("E2EE enabled but /account/whoami returned no device_id")
+            await crypto_store.put_device_id(DeviceID(device_id))
+            timer.mark("whoami")
 
-    device_id = DeviceID(device_id)
-    client.device_id = device_id
-    await crypto_store.put_device_id(device_id)
+        device_id = DeviceID(device_id)
+        client.device_id = device_id
 
-    print(f"E2EE using device_id={device_id}", flush=True)
+        print(f"E2EE using device_id={device_id}", flush=True)
 
-    crypto = OlmMachine(client, crypto_store, state_store)
-    await crypto.load()
-    await crypto.share_keys()
+        crypto = OlmMachine(client, crypto_store, state_store)
+        await crypto.load()
+        timer.mark("olm load")
+        if not crypto.account.shared:
+            await crypto.share_keys()
+            timer.mark("share keys")
+    except Exception:
+        for db in (state_db, crypto_db):
+            try:
+                if db is not None:
+                    await db.stop()
+            except Exception:
+                pass
+        if api is not None:
+            try:
+                await api.session.close()
+            except Exception:
+                pass
+        raise
 
-    return MatrixSession(api=api, client=client, crypto=crypto, crypto_db=crypto_db)
+    session = MatrixSession(
+        api=api, client=client, crypto=crypto, crypto_db=crypto_db, state_db=state_db,
+        user_id=user_id, device_id=str(device_id),
+    )
+    fresh = {"device_id": str(device_id), "crypto_schema": crypto_schema, "state_schema": state_schema}
+    return session, fresh
 
 
 async def whoami(session: MatrixSession) -> str:
-    """Get the current user ID."""
+    """Get the current user ID.
+
+    Returns ``session.user_id`` when startup already resolved it, otherwise
+    asks the homeserver.
+    """
+    if isinstance(session, MatrixSession) and session.user_id:
+        return session.user_id
     me = await session.client.whoami()
     return str(me.user_id)
 
 
-async def send_text(session: MatrixSession, room_id: str, body: str) -> None:
-    """Send a text message to a room."""
+async def send_text(session: MatrixSession, room_id: str, body: str) -> bool:
+    """Send a text message to a room.
+
+    With an outbound queue attached (see :func:`catcord_bots.outbound.open_outbound`)
+    the message is queued and coalesced with others for the same room; send
+    failures are then retried and reported by the queue, not raised here.
+
+    :return: ``True`` if the message was queued, ``False`` if it was sent
+    :rtype: bool
+    """
+    if isinstance(session, MatrixSession) and session.outbound is not None:
+        session.outbound.enqueue(room_id, body)
+        return True
     await session.client.send_text(RoomID(room_id), body)
+    return False
+
+
+async def notify(session: MatrixSession, room_id: str, body: str, what: str = "message") -> bool:
+    """:func:`send_text` for notifications, logging the outcome instead of raising.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param room_id: Target room
+    :type room_id: str
+    :param body: Message text
+    :type body: str
+    :param what: Noun used in the log line
+    :type what: str
+    :return: ``True`` if the message was queued or sent
+    :rtype: bool
+    """
+    try:
+        queued = await send_text(session, room_id, body)
+    except Exception as e:
+        print(f"Failed to send {what} to {room_id}: {e}", flush=True)
+        return False
+    print(f"{'Queued' if queued else 'Sent'} {what} {'for' if queued else 'to'} {room_id}", flush=True)
+    return True
@@ -0,0 +1,274 @@
+"""Outbound message queue with per-room coalescing.
+
+Messages handed to :meth:`OutboundQueue.enqueue` are written to the shared
+state store first, then sent after a short window.  Everything queued for a
+room within the window goes out as one event, joined with the configured
+separator and split only when it would exceed ``max_chars``.  Sends to the
+same room are spaced by ``min_interval``.  Unsent messages survive a
+restart and are picked up by :meth:`OutboundQueue.start`.
+
+Processes sharing the store claim a room's rows with a lease before
+sending, so two bots on the same ``/state`` volume never send the same row
+twice; a crashed sender's lease simply expires.
+
+Callers only learn that a message was queued.  Delivery failures are
+logged here, counted in :attr:`OutboundQueue.failed` with the latest error
+in :attr:`OutboundQueue.last_error`, and reported to the optional
+``on_failure`` callback; messages still unsent at :meth:`OutboundQueue.close`
+are logged as left for the next run.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mautrix.types import RoomID
+
+from .config import OutboundConfig
+from .matrix import MatrixSession
+from .state import StateStore, get_state_store
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS outbound (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        room_id TEXT NOT NULL,
+        body TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        owner TEXT,
+        claimed_until REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_outbound_room ON outbound (room_id, id)",
+)
+
+
+class OutboundQueue:
+    """Coalescing, persistent queue in front of ``send_text``.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param cfg: Queue configuration
+    :type cfg: Optional[OutboundConfig]
+    :param store: State store holding unsent messages, defaults to :func:`get_state_store`
+    :type store: Optional[StateStore]
+    :param lease: Seconds a claimed room stays reserved for this process
+    :type lease: float
+    :param retry_delay: First retry delay in seconds after a failed send
+    :type retry_delay: float
+    :param max_retry_delay: Upper bound for the retry delay in seconds
+    :type max_retry_delay: float
+    :param on_failure: Called with the room, the error and the unsent message count after a failed send
+    :type on_failure: Optional[Callable[[str, Exception, int], None]]
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        cfg: Optional[OutboundConfig] = None,
+        store: Optional[StateStore] = None,
+        lease: float = 60.0,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+        on_failure: Optional[Callable[[str, Exception, int], None]] = None,
+    ) -> None:
+        self.session = session
+        self.cfg = cfg or OutboundConfig()
+        self.store = store or get_state_store()
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.on_failure = on_failure
+        self.owner = uuid.uuid4().hex
+        self.sent = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self._closing = False
+        with self.store.transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def enqueue(self, room_id: str, body: str) -> None:
+        """Persist a message and schedule its room.
+
+        :param room_id: Target room
+        :type room_id: str
+        :param body: Message text
+        :type body: str
+        """
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO outbound (room_id, body, enqueued_at) VALUES (?, ?, ?)",
+                (room_id, body, time.time()),
+            )
+        self._schedule(room_id, self.cfg.window)
+
+    def pending(self, room_id: Optional[str] = None) -> int:
+        """Unsent messages, optionally for one room.
+
+        :param room_id: Room to count, ``None`` for all rooms
+        :type room_id: Optional[str]
+        :return: Queued message count
+        :rtype: int
+        """
+        if room_id is None:
+            return self.store.query("SELECT COUNT(*) FROM outbound")[0][0]
+        return self.store.query("SELECT COUNT(*) FROM outbound WHERE room_id = ?", (room_id,))[0][0]
+
+    def start(self) -> int:
+        """Schedule rooms with messages left over from an earlier run.
+
+        :return: Rooms scheduled
+        :rtype: int
+        """
+        rooms = [r for (r,) in self.store.query("SELECT DISTINCT room_id FROM outbound")]
+        for room_id in rooms:
+            self._schedule(room_id, self.cfg.window)
+        if rooms:
+            print(f"Outbound queue resuming {len(rooms)} rooms", flush=True)
+        return len(rooms)
+
+    async def close(self, flush: bool = True) -> None:
+        """Stop the timers, optionally sending everything queued first.
+
+        :param flush: Send queued messages now instead of leaving them for the next run
+        :type flush: bool
+        """
+        self._closing = True
+        timers = list(self._timers.items())
+        self._timers.clear()
+        for _, task in timers:
+            task.cancel()
+        await asyncio.gather(*(t for _, t in timers), return_exceptions=True)
+        if flush:
+            for (room_id,) in self.store.query("SELECT DISTINCT room_id FROM outbound"):
+                await self.flush(room_id)
+        left = self.store.query("SELECT room_id, COUNT(*) FROM outbound GROUP BY room_id")
+        for room_id, count in left:
+            print(f"Outbound queue: {count} messages to {room_id} not delivered, left for the next run", flush=True)
+
+    def _schedule(self, room_id: str, delay: float) -> None:
+        if self._closing:
+            return
+        task = self._timers.get(room_id)
+        if task is not None and not task.done():
+            return
+        # Respect the per-room spacing even when the window is shorter.
+        since = time.monotonic() - self._last_sent.get(room_id, float("-inf"))
+        delay = max(delay, self.cfg.min_interval - since)
+        self._timers[room_id] = asyncio.create_task(self._flush_later(room_id, delay))
+
+    async def _flush_later(self, room_id: str, delay: float) -> None:
+        await asyncio.sleep(max(0.0, delay))
+        # New messages from here on arm a fresh timer.
+        self._timers.pop(room_id, None)
+        await self.flush(room_id)
+
+    def _claim(self, room_id: str) -> List[Tuple[int, str]]:
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute(
+                "UPDATE outbound SET owner = ?, claimed_until = ? "
+                "WHERE room_id = ? AND (claimed_until IS NULL OR claimed_until < ? OR owner = ?)",
+                (self.owner, now + self.lease, room_id, now, self.owner),
+            )
+            return conn.execute(
+                "SELECT id, body FROM outbound WHERE room_id = ? AND owner = ? ORDER BY id",
+                (room_id, self.owner),
+            ).fetchall()
+
+    def _release(self, ids: List[int]) -> None:
+        with self.store.transaction() as conn:
+            conn.executemany("UPDATE outbound SET owner = NULL, claimed_until = NULL WHERE id = ?", [(i,) for i in ids])
+
+    def _delete(self, ids: List[int]) -> None:
+        with self.store.transaction() as conn:
+            conn.executemany("DELETE FROM outbound WHERE id = ?", [(i,) for i in ids])
+
+    def _chunks(self, rows: List[Tuple[int, str]]) -> List[Tuple[List[int], str]]:
+        chunks: List[Tuple[List[int], str]] = []
+        ids: List[int] = []
+        parts: List[str] = []
+        size = 0
+        sep = len(self.cfg.separator)
+        for row_id, body in rows:
+            if parts and size + sep + len(body) > self.cfg.max_chars:
+                chunks.append((ids, self.cfg.separator.join(parts)))
+                ids, parts, size = [], [], 0
+            size += (sep if parts else 0) + len(body)
+            ids.append(row_id)
+            parts.append(body)
+        if parts:
+            chunks.append((ids, self.cfg.separator.join(parts)))
+        return chunks
+
+    async def flush(self, room_id: str) -> int:
+        """Send everything queued for a room now.
+
+        :param room_id: Room to flush
+        :type room_id: str
+        :return: Events sent
+        :rtype: int
+        """
+        rows = self._claim(room_id)
+        if not rows:
+            return 0
+        sent = 0
+        chunks = self._chunks(rows)
+        for i, (ids, body) in enumerate(chunks):
+            try:
+                await self.session.client.send_text(RoomID(room_id), body)
+            except Exception as e:
+                unsent = [row_id for chunk_ids, _ in chunks[i:] for row_id in chunk_ids]
+                self._release(unsent)
+                failures = self._failures.get(room_id, 0)
+                self._failures[room_id] = failures + 1
+                self.failed += 1
+                self.last_error = f"{room_id}: {e}"
+                retry_after = getattr(e, "retry_after_ms", None)
+                delay = retry_after / 1000 if retry_after else min(
+                    self.retry_delay * (2 ** failures), self.max_retry_delay
+                )
+                print(
+                    f"Outbound send of {len(unsent)} messages to {room_id} failed "
+                    f"(attempt {failures + 1}), retrying in {delay:.0f}s: {e}",
+                    flush=True,
+                )
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(room_id, e, len(unsent))
+                    except Exception as cb_err:
+                        print(f"Outbound failure callback raised: {cb_err!r}", flush=True)
+                self._schedule(room_id, delay)
+                return sent
+            self._delete(ids)
+            self._last_sent[room_id] = time.monotonic()
+            self._failures.pop(room_id, None)
+            sent += 1
+            self.sent += 1
+        if len(rows) > sent:
+            print(f"Coalesced {len(rows)} messages to {room_id} into {sent}", flush=True)
+        return sent
+
+
+def open_outbound(session: MatrixSession, cfg: OutboundConfig) -> Optional[OutboundQueue]:
+    """Attach a started :class:`OutboundQueue` to ``session`` when enabled.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param cfg: Queue configuration
+    :type cfg: OutboundConfig
+    :return: The queue, or ``None`` when disabled
+    :rtype: Optional[OutboundQueue]
+    """
+    if not cfg.enabled:
+        return None
+    queue = OutboundQueue(session, cfg)
+    queue.start()
+    session.outbound = queue
+    return queue
@@ -1,8 +1,14 @@
 """State management for deduplication."""
+from __future__ import annotations
+
 import hashlib
 import json
 import os
-from typing import Dict, Any
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 
 def _normalize_payload_for_fingerprint(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -56,30 +62,341 @@ def payload_fingerprint(payload: Dict[str, Any]) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 
-def should_send(state_path: str, fp: str, print_effective_config: bool) -> bool:
+DEFAULT_STATE_DB = "/state/bot_state.db"
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        channel TEXT NOT NULL,
+        fp TEXT NOT NULL,
+        ts REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fingerprints_channel_ts ON fingerprints (channel, ts)",
+)
+
+
+class StateStore:
+    """Small SQLite key/value store shared by bots and overlapping containers.
+
+    Every write runs in a ``BEGIN IMMEDIATE`` transaction, so concurrent
+    processes on the same file serialise instead of overwriting each other.
+    Values may carry a TTL after which they read as missing.  Reads are
+    served from an in-process cache for ``cache_ttl`` seconds; writes and
+    :meth:`compare_and_set` always go to the database.
+
+    :param path: SQLite file path
+    :type path: str
+    :param cache_ttl: Seconds a read value is served from memory
+    :type cache_ttl: float
+    :param history: Fingerprints kept per channel
+    :type history: int
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_DB, cache_ttl: float = 5.0, history: int = 20) -> None:
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.history_size = history
+        self._cache: Dict[str, Tuple[Optional[str], Optional[float], float]] = {}
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self.conn.execute(statement)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """``BEGIN IMMEDIATE`` transaction on the store's connection.
+
+        :return: Connection to run statements on
+        :rtype: Iterator[sqlite3.Connection]
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                self._cache.clear()
+                raise
+            self.conn.execute("COMMIT")
+
+    def query(self, sql: str, params: Tuple[Any, ...] = ()) -> List[Tuple[Any, ...]]:
+        """Run a read-only statement.
+
+        :param sql: SQL statement
+        :type sql: str
+        :param params: Statement parameters
+        :type params: Tuple[Any, ...]
+        :return: Result rows
+        :rtype: List[Tuple[Any, ...]]
+        """
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _read(self, conn: sqlite3.Connection, key: str, now: float) -> Optional[str]:
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return row[0]
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: Optional[str], ttl: Optional[float], now: float) -> None:
+        expires_at = now + ttl if ttl else None
+        if value is None:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+        self._cache[key] = (value, expires_at, now)
+
+    def get(self, key: str) -> Optional[str]:
+        """Read a value, ``None`` when missing or expired.
+
+        :param key: Key
+        :type key: str
+        :return: Stored value
+        :rtype: Optional[str]
+        """
+        now = time.time()
+        cached = self._cache.get(key)
+        if cached is not None and now - cached[2] < self.cache_ttl:
+            value, expires_at, _ = cached
+            return None if expires_at is not None and expires_at <= now else value
+        with self._lock:
+            row = self.conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        value, expires_at = row if row else (None, None)
+        self._cache[key] = (value, expires_at, now)
+        return None if expires_at is not None and expires_at <= now else value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Store a value.
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: str
+        :param ttl: Seconds until the value expires, ``None`` to keep it
+        :type ttl: Optional[float]
+        """
+        with self.transaction() as conn:
+            self._write(conn, key, value, ttl, time.time())
+
+    def delete(self, key: str) -> None:
+        """Remove a value.
+
+        :param key: Key
+        :type key: str
+        """
+        with self.transaction() as conn:
+            self._write(conn, key, None, None, time.time())
+
+    def compare_and_set(self, key: str, expected: Optional[str], value: Optional[str], ttl: Optional[float] = None) -> bool:
+        """Replace a value only if it currently equals ``expected``.
+
+        :param key: Key
+        :type key: str
+        :param expected: Value required for the swap, ``None`` for missing or expired
+        :type expected: Optional[str]
+        :param value: New value, ``None`` to delete
+        :type value: Optional[str]
+        :param ttl: Seconds until the new value expires
+        :type ttl: Optional[float]
+        :return: True if the value was replaced
+        :rtype: bool
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            if self._read(conn, key, now) != expected:
+                self._cache.pop(key, None)
+                return False
+            self._write(conn, key, value, ttl, now)
+        return True
+
+    def record_fingerprint(self, channel: str, fp: str, ttl: Optional[float] = None) -> bool:
+        """Atomically store ``fp`` as the channel's latest fingerprint if it changed.
+
+        A changed fingerprint is also appended to the channel history, which
+        is pruned to the newest ``history`` entries.
+
+        :param channel: Notification channel, e.g. ``retention``
+        :type channel: str
+        :param fp: Payload fingerprint
+        :type fp: str
+        :param ttl: Seconds after which the fingerprint no longer dedupes
+        :type ttl: Optional[float]
+        :return: True if the fingerprint differs from the stored one
+        :rtype: bool
+        """
+        key = f"fingerprint:{channel}"
+        now = time.time()
+        with self.transaction() as conn:
+            if self._read(conn, key, now) == fp:
+                return False
+            self._write(conn, key, fp, ttl, now)
+            conn.execute("INSERT INTO fingerprints (channel, fp, ts) VALUES (?, ?, ?)", (channel, fp, now))
+            conn.execute(
+                """
+                DELETE FROM fingerprints WHERE channel = ? AND rowid NOT IN (
+                    SELECT rowid FROM fingerprints WHERE channel = ? ORDER BY ts DESC, rowid DESC LIMIT ?
+                )
+                """,
+                (channel, channel, self.history_size),
+            )
+        return True
+
+    def fingerprint_history(self, channel: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Recent fingerprints of a channel, newest first.
+
+        :param channel: Notification channel
+        :type channel: str
+        :param limit: Maximum entries, defaults to the whole kept history
+        :type limit: Optional[int]
+        :return: ``(fingerprint, unix timestamp)`` pairs
+        :rtype: List[Tuple[str, float]]
+        """
+        with self._lock:
+            return [
+                (fp, ts)
+                for fp, ts in self.conn.execute(
+                    "SELECT fp, ts FROM fingerprints WHERE channel = ? ORDER BY ts DESC, rowid DESC LIMIT ?",
+                    (channel, limit or self.history_size),
+                )
+            ]
+
+    def import_legacy_fingerprints(self, state_dir: str) -> List[str]:
+        """Import ``{channel}_last.fp`` files written by older releases.
+
+        A file is only imported when its channel has no fingerprint yet, and
+        is renamed to ``.fp.migrated`` afterwards.
+
+        :param state_dir: Directory holding the ``.fp`` files
+        :type state_dir: str
+        :return: Imported channels
+        :rtype: List[str]
+        """
+        imported: List[str] = []
+        try:
+            names = sorted(os.listdir(state_dir))
+        except OSError:
+            return imported
+        for name in names:
+            if not name.endswith("_last.fp"):
+                continue
+            path = os.path.join(state_dir, name)
+            channel = name[: -len("_last.fp")]
+            try:
+                with open(path, "r") as f:
+                    fp = f.read().strip()
+                if fp and self.compare_and_set(f"fingerprint:{channel}", None, fp):
+                    imported.append(channel)
+                os.replace(path, f"{path}.migrated")
+            except OSError as e:
+                print(f"Could not import {path}: {e}", flush=True)
+        return imported
+
+
+_stores: Dict[str, StateStore] = {}
+
+
+def get_state_store(path: str = DEFAULT_STATE_DB) -> StateStore:
+    """Process-wide :class:`StateStore` for ``path``.
+
+    The first call for a path also imports legacy ``.fp`` files next to it.
+
+    :param path: SQLite file path
+    :type path: str
+    :return: Shared store
+    :rtype: StateStore
+    """
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = StateStore(path)
+        imported = store.import_legacy_fingerprints(os.path.dirname(path) or ".")
+        if imported:
+            print(f"Imported legacy fingerprints: {imported}", flush=True)
+    return store
+
+
+def should_send(
+    channel: str,
+    fp: str,
+    force: bool,
+    store: Optional[StateStore] = None,
+    ttl: Optional[float] = None,
+) -> bool:
     """Check if message should be sent based on dedupe state.
 
-    :param state_path: Path to state file
-    :type state_path: str
+    The check and the update are one atomic step, so two processes racing
+    with the same payload send it once.
+
+    :param channel: Notification channel, e.g. ``retention`` or ``pressure``
+    :type channel: str
     :param fp: Fingerprint of current payload
     :type fp: str
-    :param print_effective_config: Override dedupe and force send
-    :type print_effective_config: bool
+    :param force: Override dedupe and force send
+    :type force: bool
+    :param store: State store, defaults to :func:`get_state_store`
+    :type store: Optional[StateStore]
+    :param ttl: Seconds after which an unchanged payload is sent again
+    :type ttl: Optional[float]
     :return: True if should send
     :rtype: bool
     """
-    if print_effective_config:
+    if force:
         return True
+    return (store or get_state_store()).record_fingerprint(channel, fp, ttl)
 
-    prev = None
-    if os.path.exists(state_path):
-        with open(state_path, "r") as f:
-            prev = f.read().strip() or None
 
-    if prev == fp:
-        return False
+def load_json_state(path: str | None) -> Dict[str, Any]:
+    """Read a JSON state file.
 
-    os.makedirs(os.path.dirname(state_path), exist_ok=True)
-    with open(state_path, "w") as f:
-        f.write(fp)
-    return True
+    :param path: Path to the state file, ``None`` for no persistence
+    :type path: str | None
+    :return: Stored object, empty when missing or unreadable
+    :rtype: Dict[str, Any]
+    """
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_json_state(path: str | None, data: Dict[str, Any]) -> None:
+    """Atomically replace a JSON state file.
+
+    :param path: Path to the state file, ``None`` for no persistence
+    :type path: str | None
+    :param data: Object to store
+    :type data: Dict[str, Any]
+    """
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not write state file {path}: {e}", flush=True)
@@ -0,0 +1,260 @@
+"""Reusable long-poll sync loop for event-driven bots."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from mautrix.types import EventType, Filter
+
+from .matrix import MatrixSession
+from .state import load_json_state, save_json_state
+
+
+@dataclass
+class SyncTiming:
+    """Timings of one sync iteration, passed to timing hooks."""
+
+    iteration: int
+    request_seconds: float
+    dispatch_seconds: float
+    backpressure_seconds: float
+    events: int
+    pending: int
+
+
+def _count_events(data: Dict[str, Any]) -> int:
+    rooms = data.get("rooms") or {}
+    return sum(
+        len((room.get("timeline") or {}).get("events") or [])
+        for section in ("join", "leave")
+        for room in (rooms.get(section) or {}).values()
+    )
+
+
+def _prune_account_data(data: Dict[str, Any]) -> None:
+    data.pop("account_data", None)
+    rooms = data.get("rooms") or {}
+    for section in ("join", "invite", "leave"):
+        for room in (rooms.get(section) or {}).values():
+            room.pop("account_data", None)
+
+
+class SyncRunner:
+    """Long-poll ``/sync`` loop with persistence, backoff and backpressure.
+
+    Handlers registered through :meth:`add_handler` run at most
+    ``max_concurrency`` at a time.  When more than ``max_pending`` handler
+    tasks are outstanding the next ``/sync`` waits, so a slow handler slows
+    the loop instead of piling up tasks.  The since token is persisted only
+    once every handler of its batch and all earlier batches has finished,
+    so a crash replays events rather than dropping them.
+
+    :param session: Matrix session
+    :type session: MatrixSession
+    :param sync_filter: Server-side filter, uploaded once and reused by ID
+    :type sync_filter: Optional[Filter]
+    :param state_path: JSON file for the since token and filter ID, ``None`` to keep them in memory
+    :type state_path: Optional[str]
+    :param timeout_ms: Long-poll timeout
+    :type timeout_ms: int
+    :param max_concurrency: Handlers running at once
+    :type max_concurrency: int
+    :param max_pending: Outstanding handler tasks before the loop waits
+    :type max_pending: int
+    :param backoff_base: First retry delay in seconds after a failed sync
+    :type backoff_base: float
+    :param backoff_max: Upper bound for the retry delay in seconds
+    :type backoff_max: float
+    :param shutdown_timeout: Seconds to wait for running handlers on stop
+    :type shutdown_timeout: float
+    """
+
+    def __init__(
+        self,
+        session: MatrixSession,
+        sync_filter: Optional[Filter] = None,
+        state_path: Optional[str] = None,
+        timeout_ms: int = 30000,
+        max_concurrency: int = 8,
+        max_pending: int = 64,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        shutdown_timeout: float = 30.0,
+    ) -> None:
+        self.session = session
+        self.sync_filter = sync_filter
+        self.state_path = state_path
+        self.timeout_ms = timeout_ms
+        self.max_pending = max_pending
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.shutdown_timeout = shutdown_timeout
+        self.since: Optional[str] = None
+        self.filter_id: Optional[str] = None
+        self.iteration = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._pending: Set[asyncio.Task] = set()
+        self._batches: Deque[Tuple[List[asyncio.Task], Optional[str]]] = deque()
+        self._sync_hooks: List[Callable[[Dict[str, Any]], None]] = []
+        self._timing_hooks: List[Callable[[SyncTiming], None]] = []
+        self._stopping = asyncio.Event()
+        self._request: Optional[asyncio.Task] = None
+        self._load_state()
+
+    def add_handler(self, event_type: EventType, handler: Callable[[Any], Awaitable[None]]) -> None:
+        """Register an event handler that counts against the concurrency bound.
+
+        :param event_type: Event type to handle
+        :type event_type: EventType
+        :param handler: Coroutine function called with each event
+        :type handler: Callable[[Any], Awaitable[None]]
+        """
+        async def bounded(evt: Any) -> None:
+            async with self._slots:
+                await handler(evt)
+
+        self.session.client.add_event_handler(event_type, bounded, wait_sync=True)
+
+    def add_sync_hook(self, hook: Callable[[Dict[str, Any]], None]) -> None:
+        """Call ``hook`` with each raw sync response before it is dispatched."""
+        self._sync_hooks.append(hook)
+
+    def add_timing_hook(self, hook: Callable[[SyncTiming], None]) -> None:
+        """Call ``hook`` with a :class:`SyncTiming` after each iteration."""
+        self._timing_hooks.append(hook)
+
+    @property
+    def pending(self) -> int:
+        """Outstanding handler tasks."""
+        return len(self._pending)
+
+    def stop(self) -> None:
+        """Stop after the current request; running handlers get ``shutdown_timeout``."""
+        self._stopping.set()
+        if self._request is not None:
+            self._request.cancel()
+
+    def set_filter(self, sync_filter: Optional[Filter]) -> None:
+        """Use a new filter from the next ``/sync`` on, keeping the since token.
+
+        :param sync_filter: Replacement filter
+        :type sync_filter: Optional[Filter]
+        """
+        self.sync_filter = sync_filter
+        self.filter_id = None
+
+    def _filter_hash(self) -> Optional[str]:
+        if self.sync_filter is None:
+            return None
+        return hashlib.sha256(json.dumps(self.sync_filter.serialize(), sort_keys=True).encode()).hexdigest()
+
+    def _load_state(self) -> None:
+        state = load_json_state(self.state_path)
+        self.since = state.get("since")
+        if state and state.get("filter") == self._filter_hash():
+            self.filter_id = state.get("filter_id")
+
+    def _save_state(self) -> None:
+        save_json_state(
+            self.state_path,
+            {"since": self.since, "filter": self._filter_hash(), "filter_id": self.filter_id},
+        )
+
+    def _commit(self) -> None:
+        token = None
+        while self._batches and all(t.done() for t in self._batches[0][0]):
+            token = self._batches.popleft()[1]
+        if token is not None and token != self.since:
+            self.since = token
+            self._save_state()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _sync_once(self) -> Optional[Dict[str, Any]]:
+        self._request = asyncio.ensure_future(self.session.client.sync(
+            since=self._latest_token(),
+            timeout=self.timeout_ms,
+            filter_id=self.filter_id,
+            full_state=False,
+        ))
+        try:
+            return await self._request
+        except asyncio.CancelledError:
+            if self._stopping.is_set():
+                return None
+            raise
+        finally:
+            self._request = None
+
+    def _latest_token(self) -> Optional[str]:
+        # Dispatched batches may not be committed yet; continue after the newest.
+        return self._batches[-1][1] if self._batches else self.since
+
+    async def run(self) -> None:
+        """Sync until :meth:`stop` is called or the task is cancelled."""
+        failures = 0
+        try:
+            while not self._stopping.is_set():
+                start = time.monotonic()
+                try:
+                    if self.sync_filter is not None and self.filter_id is None:
+                        self.filter_id = await self.session.client.create_filter(self.sync_filter)
+                        self._save_state()
+                    data = await self._sync_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    delay = min(self.backoff_base * (2 ** failures), self.backoff_max)
+                    failures += 1
+                    print(f"Sync failed ({e!r}), retrying in {delay:.1f}s", flush=True)
+                    await self._sleep(delay)
+                    continue
+                if data is None:
+                    break
+                failures = 0
+                requested = time.monotonic()
+
+                _prune_account_data(data)
+                for hook in self._sync_hooks:
+                    try:
+                        hook(data)
+                    except Exception as e:
+                        print(f"Sync hook failed: {e!r}", flush=True)
+                tasks = list(self.session.client.handle_sync(data))
+                for t in tasks:
+                    self._pending.add(t)
+                    t.add_done_callback(self._pending.discard)
+                self._batches.append((tasks, data.get("next_batch")))
+                dispatched = time.monotonic()
+
+                while len(self._pending) > self.max_pending and not self._stopping.is_set():
+                    await asyncio.wait(set(self._pending), return_when=asyncio.FIRST_COMPLETED)
+                self._commit()
+                self.iteration += 1
+
+                timing = SyncTiming(
+                    iteration=self.iteration,
+                    request_seconds=requested - start,
+                    dispatch_seconds=dispatched - requested,
+                    backpressure_seconds=time.monotonic() - dispatched,
+                    events=_count_events(data),
+                    pending=len(self._pending),
+                )
+                for hook in self._timing_hooks:
+                    try:
+                        hook(timing)
+                    except Exception as e:
+                        print(f"Timing hook failed: {e!r}", flush=True)
+        finally:
+            if self._pending:
+                await asyncio.wait(set(self._pending), timeout=self.shutdown_timeout)
+            self._commit()
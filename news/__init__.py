@@ -4,9 +4,10 @@ from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional
 import httpx
-from catcord_bots.matrix import MatrixSession, send_text
+from catcord_bots.matrix import MatrixSession, notify
 from catcord_bots.personality import PersonalityRenderer
-from news.state import payload_fingerprint, should_send
+from catcord_bots.state import should_send
+from news.state import payload_fingerprint
 from news.format import format_digest
 
 
@@ -169,10 +170,9 @@ async def run_digest(
         print("No notifications_room configured")
         return
 
-    state_path = "/state/digest_last.fp"
     fp = payload_fingerprint(payload)
 
-    if not should_send(state_path, fp, force_notify):
+    if not should_send("digest", fp, force_notify):
         print("Digest unchanged, skipping send (use --force-notify to override)")
         return
 
@@ -211,8 +211,4 @@ async def run_digest(
         print(f"{prefix}Would send:")
         print(message)
     else:
-        try:
-            await send_text(session, notifications_room, message)
-            print(f"Sent digest to {notifications_room}")
-        except Exception as e:
-            print(f"Failed to send message: {e}")
+        await notify(session, notifications_room, message, what="digest")
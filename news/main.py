@@ -4,6 +4,7 @@ import asyncio
 import os
 from catcord_bots.config import load_yaml, FrameworkConfig
 from catcord_bots.matrix import create_client, whoami
+from catcord_bots.outbound import open_outbound
 from catcord_bots.invites import join_all_invites
 from news import run_digest, PersonalityConfig, FetchConfig, ServicesConfig
 
@@ -18,16 +19,19 @@ async def main_async(args):
     """
     raw = load_yaml(args.config)
     cfg = FrameworkConfig.from_dict(raw)
-    session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token)
+    session = create_client(cfg.bot.mxid, cfg.homeserver.url, cfg.bot.access_token, cfg.http)
 
     try:
+        open_outbound(session, cfg.outbound)
         me = await whoami(session)
         print("Authenticated as:", me)
 
         allow = cfg.rooms_allowlist[:] if cfg.rooms_allowlist else (
             [cfg.notifications.log_room_id] if cfg.notifications.log_room_id else []
         )
-        joined = await join_all_invites(session, allowlist=[r for r in allow if r])
+        joined = await join_all_invites(
+            session, allowlist=[r for r in allow if r], state_path="/state/news_invites.json"
+        )
         if joined:
             print("Auto-joined invites:", joined)
 
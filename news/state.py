@@ -1,7 +1,6 @@
 """State management for news bot deduplication."""
 import hashlib
 import json
-import os
 from typing import Dict, Any
 
 
@@ -32,32 +31,3 @@ def payload_fingerprint(payload: Dict[str, Any]) -> str:
 
     s = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
-
-
-def should_send(state_path: str, fp: str, force: bool) -> bool:
-    """Check if message should be sent based on dedupe state.
-
-    :param state_path: Path to state file
-    :type state_path: str
-    :param fp: Fingerprint of current payload
-    :type fp: str
-    :param force: Override dedupe and force send
-    :type force: bool
-    :return: True if should send
-    :rtype: bool
-    """
-    if force:
-        return True
-
-    prev = None
-    if os.path.exists(state_path):
-        with open(state_path, "r") as f:
-            prev = f.read().strip() or None
-
-    if prev == fp:
-        return False
-
-    os.makedirs(os.path.dirname(state_path), exist_ok=True)
-    with open(state_path, "w") as f:
-        f.write(fp)
-    return True
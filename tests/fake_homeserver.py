@@ -0,0 +1,703 @@
+"""In-process stand-in for a Matrix homeserver, for integration tests and benchmarks.
+
+:class:`FakeHomeserver` is a plain ASGI application implementing the
+client-server endpoints the bots use: ``/versions``, ``/account/whoami``,
+``/joined_rooms``, filter upload, ``/sync`` (inline or uploaded filters,
+long-polling, limited timelines, invites), ``/rooms/{id}/messages``,
+``/redact``, ``/send`` (including MSC2244 mass redactions) and ``/join``.
+
+Rooms live in memory as ordered event lists.  Every event gets a stream
+position; sync and pagination tokens are positions (``s<n>``), so
+``/messages`` from a ``prev_batch`` continues exactly where a limited sync
+stopped.  :meth:`FakeHomeserver.generate_room` builds large synthetic rooms
+from a seed, so runs are reproducible.
+
+Faults are injected with ``latency`` (seconds, or a callable of method and
+path), :meth:`FakeHomeserver.inject` (queued error responses) and
+``rate_limit`` (requests per second before 429 ``M_LIMIT_EXCEEDED`` with
+``retry_after_ms``; ``/sync`` is exempt, as on real servers).
+
+No ASGI server is needed: :meth:`FakeHomeserver.serve` runs the app behind
+an aiohttp bridge on a local port, so mautrix clients talk to it over real
+HTTP.  Any ASGI server (e.g. ``uvicorn tests.fake_homeserver:app``) works too.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import fnmatch
+import json
+import math
+import random
+import re
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, unquote
+
+from aiohttp import web
+
+MASS_REDACTION_FEATURE = "org.matrix.msc2244"
+PREFIX = "/_matrix/client"
+DEFAULT_TIMELINE_LIMIT = 10
+MEDIA_TYPES = (
+    ("m.image", "image/png"),
+    ("m.image", "image/jpeg"),
+    ("m.video", "video/mp4"),
+    ("m.audio", "audio/ogg"),
+    ("m.file", "application/pdf"),
+)
+
+Json = Dict[str, Any]
+
+
+class HTTPError(Exception):
+    """Matrix error response."""
+
+    def __init__(self, status: int, errcode: str, error: str, **extra: Any) -> None:
+        super().__init__(error)
+        self.status = status
+        self.body = {"errcode": errcode, "error": error, **extra}
+
+
+@dataclass
+class Fault:
+    """Queued error response for matching requests."""
+
+    status: int
+    count: int
+    path: Optional[str] = None
+    errcode: Optional[str] = None
+    retry_after_ms: Optional[int] = None
+
+
+@dataclass
+class Room:
+    """Room timeline, ordered by stream position."""
+
+    room_id: str
+    events: List[Json] = field(default_factory=list)
+    positions: List[int] = field(default_factory=list)
+    by_id: Dict[str, Json] = field(default_factory=dict)
+
+
+def _type_matches(event_type: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatchcase(event_type, p) for p in patterns)
+
+
+def event_matches(event: Json, flt: Json) -> bool:
+    """Apply a ``RoomEventFilter`` to an event.
+
+    :param event: Client-format event
+    :type event: Json
+    :param flt: Filter definition
+    :type flt: Json
+    :return: True if the event passes
+    :rtype: bool
+    """
+    if "types" in flt and flt["types"] is not None and not _type_matches(event["type"], flt["types"]):
+        return False
+    if _type_matches(event["type"], flt.get("not_types") or []):
+        return False
+    if "senders" in flt and flt["senders"] is not None and event["sender"] not in flt["senders"]:
+        return False
+    if event["sender"] in (flt.get("not_senders") or []):
+        return False
+    if flt.get("contains_url") is not None:
+        if flt["contains_url"] != ("url" in (event.get("content") or {})):
+            return False
+    return True
+
+
+def _token(pos: int) -> str:
+    return f"s{pos}"
+
+
+def _parse_token(token: Optional[str]) -> Optional[int]:
+    if not token:
+        return None
+    try:
+        return int(token.lstrip("st"))
+    except ValueError:
+        raise HTTPError(400, "M_INVALID_PARAM", f"Bad token {token!r}")
+
+
+class FakeHomeserver:
+    """ASGI fake homeserver holding rooms in memory.
+
+    :param user_id: Account the access token belongs to
+    :type user_id: str
+    :param access_token: Accepted bearer token, ``None`` to accept any
+    :type access_token: Optional[str]
+    :param device_id: Device returned by ``/whoami``
+    :type device_id: str
+    :param latency: Delay before every response, or ``f(method, path) -> seconds``
+    :type latency: Union[float, Callable[[str, str], float]]
+    :param rate_limit: Non-sync requests per second before 429s, ``None`` for no limit
+    :type rate_limit: Optional[float]
+    :param rate_burst: Requests allowed back to back under ``rate_limit``
+    :type rate_burst: int
+    :param mass_redaction: Advertise MSC2244 in ``/versions``
+    :type mass_redaction: bool
+    """
+
+    def __init__(
+        self,
+        user_id: str = "@bot:fake.server",
+        access_token: Optional[str] = "token",
+        device_id: str = "FAKEDEVICE",
+        latency: Union[float, Callable[[str, str], float]] = 0.0,
+        rate_limit: Optional[float] = None,
+        rate_burst: int = 10,
+        mass_redaction: bool = False,
+    ) -> None:
+        self.user_id = user_id
+        self.server_name = user_id.split(":", 1)[1]
+        self.access_token = access_token
+        self.device_id = device_id
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.mass_redaction = mass_redaction
+        self.rooms: Dict[str, Room] = {}
+        self.joined: set = set()
+        self.invites: Dict[str, Tuple[str, int]] = {}
+        self.filters: Dict[str, Json] = {}
+        self.faults: List[Fault] = []
+        self.counts: Counter = Counter()
+        self.next_pos = 1
+        self._txns: Dict[Tuple[str, str], str] = {}
+        self._waiters: List[asyncio.Future] = []
+        self._tokens = float(rate_burst)
+        self._refilled = time.monotonic()
+        self._routes = self._build_routes()
+
+    # -- state helpers -------------------------------------------------------
+
+    def _notify(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def create_room(self, room_id: Optional[str] = None, joined: bool = True) -> str:
+        """Create an empty room.
+
+        :param room_id: Room ID, generated when omitted
+        :type room_id: Optional[str]
+        :param joined: Whether the bot is a member
+        :type joined: bool
+        :return: Room ID
+        :rtype: str
+        """
+        room_id = room_id or f"!room{len(self.rooms)}:{self.server_name}"
+        self.rooms.setdefault(room_id, Room(room_id))
+        if joined:
+            self.joined.add(room_id)
+        return room_id
+
+    def add_event(
+        self,
+        room_id: str,
+        event_type: str,
+        content: Json,
+        sender: Optional[str] = None,
+        ts: Optional[int] = None,
+        state_key: Optional[str] = None,
+    ) -> Json:
+        """Append an event to a room's timeline.
+
+        :param room_id: Room, created if missing
+        :type room_id: str
+        :param event_type: Event type
+        :type event_type: str
+        :param content: Event content
+        :type content: Json
+        :param sender: Sender, defaults to the bot
+        :type sender: Optional[str]
+        :param ts: ``origin_server_ts`` in milliseconds, defaults to now
+        :type ts: Optional[int]
+        :param state_key: State key for state events
+        :type state_key: Optional[str]
+        :return: The stored event
+        :rtype: Json
+        """
+        room = self.rooms.get(room_id) or self.rooms.setdefault(room_id, Room(room_id))
+        pos = self.next_pos
+        self.next_pos += 1
+        event = {
+            "event_id": f"$ev{pos}",
+            "room_id": room_id,
+            "type": event_type,
+            "sender": sender or self.user_id,
+            "origin_server_ts": int(ts if ts is not None else time.time() * 1000),
+            "content": content,
+            "unsigned": {},
+        }
+        if state_key is not None:
+            event["state_key"] = state_key
+        room.events.append(event)
+        room.positions.append(pos)
+        room.by_id[event["event_id"]] = event
+        self._notify()
+        return event
+
+    def invite(self, room_id: str, inviter: str = "@admin:fake.server") -> None:
+        """Invite the bot to a room, creating it if missing.
+
+        :param room_id: Room ID
+        :type room_id: str
+        :param inviter: Inviting user
+        :type inviter: str
+        """
+        self.create_room(room_id, joined=False)
+        self.invites[room_id] = (inviter, self.next_pos)
+        self.next_pos += 1
+        self._notify()
+
+    def generate_room(
+        self,
+        events: int,
+        room_id: Optional[str] = None,
+        media_fraction: float = 0.3,
+        senders: int = 20,
+        start_ts: Optional[int] = None,
+        interval_ms: int = 60_000,
+        max_size: int = 20 * 1024 * 1024,
+        seed: int = 0,
+    ) -> str:
+        """Fill a joined room with a reproducible mix of text and media messages.
+
+        :param events: Messages to create
+        :type events: int
+        :param room_id: Room ID, generated when omitted
+        :type room_id: Optional[str]
+        :param media_fraction: Share of messages that are uploads
+        :type media_fraction: float
+        :param senders: Distinct senders
+        :type senders: int
+        :param start_ts: Timestamp of the first message, defaults to ``events * interval_ms`` ago
+        :type start_ts: Optional[int]
+        :param interval_ms: Milliseconds between messages
+        :type interval_ms: int
+        :param max_size: Largest upload size in bytes
+        :type max_size: int
+        :param seed: Random seed
+        :type seed: int
+        :return: Room ID
+        :rtype: str
+        """
+        rnd = random.Random(seed)
+        room_id = self.create_room(room_id)
+        now = int(time.time() * 1000)
+        ts = start_ts if start_ts is not None else now - events * interval_ms
+        for i in range(events):
+            sender = f"@user{rnd.randrange(senders)}:{self.server_name}"
+            if rnd.random() < media_fraction:
+                msgtype, mimetype = rnd.choice(MEDIA_TYPES)
+                content = {
+                    "msgtype": msgtype,
+                    "body": f"upload{i}",
+                    "url": f"mxc://{self.server_name}/{rnd.getrandbits(96):024x}",
+                    "info": {"mimetype": mimetype, "size": rnd.randrange(1, max_size)},
+                }
+            else:
+                content = {"msgtype": "m.text", "body": f"message {i}"}
+            self.add_event(room_id, "m.room.message", content, sender=sender, ts=ts + i * interval_ms)
+        return room_id
+
+    def inject(
+        self,
+        status: int = 429,
+        count: int = 1,
+        path: Optional[str] = None,
+        errcode: Optional[str] = None,
+        retry_after_ms: Optional[int] = 100,
+    ) -> None:
+        """Answer the next ``count`` matching requests with an error.
+
+        :param status: HTTP status
+        :type status: int
+        :param count: Requests affected
+        :type count: int
+        :param path: Regex searched in the request path, ``None`` for any
+        :type path: Optional[str]
+        :param errcode: Matrix errcode, derived from the status when omitted
+        :type errcode: Optional[str]
+        :param retry_after_ms: ``retry_after_ms`` for 429 responses
+        :type retry_after_ms: Optional[int]
+        """
+        self.faults.append(Fault(status, count, path, errcode, retry_after_ms))
+
+    def messages(self, room_id: str, event_type: Optional[str] = None) -> List[Json]:
+        """Events in a room, oldest first.
+
+        :param room_id: Room ID
+        :type room_id: str
+        :param event_type: Only events of this type
+        :type event_type: Optional[str]
+        :return: Events
+        :rtype: List[Json]
+        """
+        events = self.rooms[room_id].events
+        return [e for e in events if event_type is None or e["type"] == event_type]
+
+    def redacted(self, room_id: str) -> List[str]:
+        """IDs of redacted events in a room.
+
+        :param room_id: Room ID
+        :type room_id: str
+        :return: Event IDs
+        :rtype: List[str]
+        """
+        return [e["event_id"] for e in self.rooms[room_id].events if "redacted_because" in e["unsigned"]]
+
+    # -- ASGI ------------------------------------------------------------------
+
+    def _build_routes(self) -> List[Tuple[str, re.Pattern, Callable]]:
+        r = r"(?P<%s>[^/]+)"
+        routes = [
+            ("GET", r"/versions", self.versions, False),
+            ("GET", r"/v3/account/whoami", self.whoami, True),
+            ("GET", r"/v3/joined_rooms", self.joined_rooms, True),
+            ("POST", r"/v3/user/%s/filter" % (r % "user"), self.upload_filter, True),
+            ("GET", r"/v3/user/%s/filter/%s" % (r % "user", r % "filter_id"), self.get_filter, True),
+            ("GET", r"/v3/sync", self.sync, True),
+            ("GET", r"/v3/rooms/%s/messages" % (r % "room"), self.get_messages, True),
+            ("PUT", r"/v3/rooms/%s/redact/%s/%s" % (r % "room", r % "event", r % "txn"), self.redact, True),
+            ("PUT", r"/v3/rooms/%s/send/%s/%s" % (r % "room", r % "type", r % "txn"), self.send, True),
+            ("POST", r"/v3/rooms/%s/join" % (r % "room"), self.join, True),
+            ("POST", r"/v3/join/%s" % (r % "room"), self.join, True),
+        ]
+        return [(m, re.compile(PREFIX + p + "$"), h, auth) for m, p, h, auth in routes]
+
+    async def __call__(self, scope: Json, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] in ("lifespan.startup", "lifespan.shutdown"):
+                    await send({"type": message["type"] + ".complete"})
+                    if message["type"] == "lifespan.shutdown":
+                        return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        status, payload, headers = await self.handle(
+            scope["method"],
+            scope["path"],
+            scope.get("query_string", b"").decode(),
+            {k.decode().lower(): v.decode() for k, v in scope.get("headers", [])},
+            body,
+        )
+        data = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    def _take_fault(self, path: str) -> Optional[Fault]:
+        for fault in self.faults:
+            if fault.path is None or re.search(fault.path, path):
+                fault.count -= 1
+                if fault.count <= 0:
+                    self.faults.remove(fault)
+                return fault
+        return None
+
+    def _rate_limited(self) -> Optional[float]:
+        if self.rate_limit is None:
+            return None
+        now = time.monotonic()
+        self._tokens = min(float(self.rate_burst), self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / self.rate_limit
+
+    async def handle(
+        self, method: str, path: str, query: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Json, List[Tuple[bytes, bytes]]]:
+        """Route one request.
+
+        :return: Status, JSON body and extra headers
+        :rtype: Tuple[int, Json, List[Tuple[bytes, bytes]]]
+        """
+        delay = self.latency(method, path) if callable(self.latency) else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        params = {k: v[-1] for k, v in parse_qs(query, keep_blank_values=True).items()}
+        for route_method, pattern, handler, auth in self._routes:
+            match = pattern.match(path)
+            if not match or route_method != method:
+                continue
+            self.counts[handler.__name__] += 1
+            try:
+                if auth and self.access_token is not None:
+                    token = headers.get("authorization", "").removeprefix("Bearer ") or params.get("access_token")
+                    if token != self.access_token:
+                        raise HTTPError(401, "M_UNKNOWN_TOKEN", "Unrecognised access token")
+                fault = self._take_fault(path)
+                if fault is not None:
+                    extra = {}
+                    if fault.status == 429 and fault.retry_after_ms is not None:
+                        extra["retry_after_ms"] = fault.retry_after_ms
+                    errcode = fault.errcode or ("M_LIMIT_EXCEEDED" if fault.status == 429 else "M_UNKNOWN")
+                    raise HTTPError(fault.status, errcode, "Injected fault", **extra)
+                if handler != self.sync:
+                    wait = self._rate_limited()
+                    if wait is not None:
+                        raise HTTPError(429, "M_LIMIT_EXCEEDED", "Too many requests", retry_after_ms=math.ceil(wait * 1000))
+                content = json.loads(body) if body else {}
+                args = {k: unquote(v) for k, v in match.groupdict().items()}
+                return 200, await handler(params=params, content=content, **args), []
+            except HTTPError as e:
+                return e.status, e.body, []
+        return 404, {"errcode": "M_UNRECOGNIZED", "error": "Unrecognized request"}, []
+
+    # -- endpoints -----------------------------------------------------------
+
+    async def versions(self, **_: Any) -> Json:
+        return {
+            "versions": ["v1.1", "v1.11"],
+            "unstable_features": {MASS_REDACTION_FEATURE: self.mass_redaction},
+        }
+
+    async def whoami(self, **_: Any) -> Json:
+        return {"user_id": self.user_id, "device_id": self.device_id}
+
+    async def joined_rooms(self, **_: Any) -> Json:
+        return {"joined_rooms": sorted(self.joined)}
+
+    async def upload_filter(self, content: Json, **_: Any) -> Json:
+        filter_id = str(len(self.filters))
+        self.filters[filter_id] = content
+        return {"filter_id": filter_id}
+
+    async def get_filter(self, filter_id: str, **_: Any) -> Json:
+        if filter_id not in self.filters:
+            raise HTTPError(404, "M_NOT_FOUND", "No such filter")
+        return self.filters[filter_id]
+
+    def _load_filter(self, value: Optional[str]) -> Json:
+        if not value:
+            return {}
+        if value.startswith("{"):
+            return json.loads(value)
+        if value not in self.filters:
+            raise HTTPError(400, "M_INVALID_PARAM", "No such filter")
+        return self.filters[value]
+
+    def _room_sync(self, room: Room, since: Optional[int], flt: Json) -> Optional[Json]:
+        timeline_filter = flt.get("timeline") or {}
+        limit = int(timeline_filter.get("limit", DEFAULT_TIMELINE_LIMIT))
+        start = 0 if since is None else bisect.bisect_left(room.positions, since)
+        if since is not None and start == len(room.events):
+            return None
+        matching: List[int] = []
+        # Walk newest first so large rooms only touch what is returned.
+        for i in range(len(room.events) - 1, start - 1, -1):
+            if event_matches(room.events[i], timeline_filter):
+                matching.append(i)
+                if len(matching) > limit:
+                    break
+        limited = len(matching) > limit
+        matching = sorted(matching[:limit])
+        if since is not None and not matching and not limited:
+            return None
+        first = matching[0] if matching else len(room.events)
+        prev = room.positions[first] if first < len(room.positions) else self.next_pos
+        return {
+            "timeline": {
+                "events": [room.events[i] for i in matching],
+                "limited": limited,
+                "prev_batch": _token(prev),
+            },
+            "state": {"events": []},
+            "ephemeral": {"events": []},
+            "account_data": {"events": []},
+            "unread_notifications": {},
+        }
+
+    def _build_sync(self, since: Optional[int], flt: Json) -> Json:
+        room_filter = flt.get("room") or {}
+        allowed = room_filter.get("rooms")
+        excluded = set(room_filter.get("not_rooms") or [])
+        join: Json = {}
+        for room_id in sorted(self.joined):
+            if (allowed is not None and room_id not in allowed) or room_id in excluded:
+                continue
+            data = self._room_sync(self.rooms[room_id], since, room_filter)
+            if data is not None:
+                join[room_id] = data
+        invite: Json = {}
+        for room_id, (inviter, pos) in self.invites.items():
+            if since is None or pos >= since:
+                invite[room_id] = {"invite_state": {"events": [{
+                    "type": "m.room.member",
+                    "state_key": self.user_id,
+                    "sender": inviter,
+                    "content": {"membership": "invite"},
+                }]}}
+        return {
+            "next_batch": _token(self.next_pos),
+            "rooms": {"join": join, "invite": invite, "leave": {}},
+            "account_data": {"events": []},
+            "presence": {"events": []},
+            "to_device": {"events": []},
+            "device_one_time_keys_count": {},
+        }
+
+    async def sync(self, params: Dict[str, str], **_: Any) -> Json:
+        since = _parse_token(params.get("since"))
+        flt = self._load_filter(params.get("filter"))
+        timeout = int(params.get("timeout") or 0) / 1000
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self._build_sync(since, flt)
+            rooms = response["rooms"]
+            remaining = deadline - time.monotonic()
+            if since is None or rooms["join"] or rooms["invite"] or remaining <= 0:
+                return response
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def get_messages(self, room: str, params: Dict[str, str], **_: Any) -> Json:
+        if room not in self.joined:
+            raise HTTPError(403, "M_FORBIDDEN", "Not a member")
+        timeline = self.rooms[room]
+        direction = params.get("dir", "b")
+        limit = int(params.get("limit") or 10)
+        flt = self._load_filter(params.get("filter"))
+        start_pos = _parse_token(params.get("from"))
+        end_pos = _parse_token(params.get("to"))
+        chunk: List[Json] = []
+        if direction == "b":
+            i = bisect.bisect_left(timeline.positions, start_pos if start_pos is not None else self.next_pos) - 1
+            last = None
+            while i >= 0 and len(chunk) < limit:
+                if end_pos is not None and timeline.positions[i] < end_pos:
+                    break
+                last = timeline.positions[i]
+                if event_matches(timeline.events[i], flt):
+                    chunk.append(timeline.events[i])
+                i -= 1
+            end = _token(last) if i >= 0 and last is not None else None
+        else:
+            i = bisect.bisect_left(timeline.positions, start_pos or 0)
+            while i < len(timeline.events) and len(chunk) < limit:
+                if end_pos is not None and timeline.positions[i] >= end_pos:
+                    break
+                if event_matches(timeline.events[i], flt):
+                    chunk.append(timeline.events[i])
+                i += 1
+            end = _token(timeline.positions[i]) if i < len(timeline.events) else None
+        response = {"start": params.get("from") or _token(self.next_pos), "chunk": chunk}
+        if end is not None:
+            response["end"] = end
+        return response
+
+    def _apply_redaction(self, room_id: str, redacts: Union[str, List[str]], reason: Optional[str]) -> Json:
+        timeline = self.rooms[room_id]
+        targets = [redacts] if isinstance(redacts, str) else list(redacts)
+        content: Json = {"redacts": redacts}
+        if reason:
+            content["reason"] = reason
+        redaction = self.add_event(room_id, "m.room.redaction", content)
+        redaction["redacts"] = redacts
+        for event_id in targets:
+            target = timeline.by_id.get(event_id)
+            if target is not None:
+                target["content"] = {}
+                target["unsigned"]["redacted_because"] = dict(redaction)
+        return redaction
+
+    def _idempotent(self, room: str, txn: str, make: Callable[[], Json]) -> Json:
+        key = (room, txn)
+        if key not in self._txns:
+            self._txns[key] = make()["event_id"]
+        return {"event_id": self._txns[key]}
+
+    async def redact(self, room: str, event: str, txn: str, content: Json, **_: Any) -> Json:
+        if room not in self.joined:
+            raise HTTPError(403, "M_FORBIDDEN", "Not a member")
+        if event not in self.rooms[room].by_id:
+            raise HTTPError(404, "M_NOT_FOUND", "Event not found")
+        return self._idempotent(room, txn, lambda: self._apply_redaction(room, event, content.get("reason")))
+
+    async def send(self, room: str, type: str, txn: str, content: Json, **_: Any) -> Json:
+        if room not in self.joined:
+            raise HTTPError(403, "M_FORBIDDEN", "Not a member")
+        if type == "m.room.redaction":
+            redacts = content.get("redacts")
+            if isinstance(redacts, list) and not self.mass_redaction:
+                raise HTTPError(400, "M_BAD_JSON", "redacts must be a string")
+            return self._idempotent(room, txn, lambda: self._apply_redaction(room, redacts, content.get("reason")))
+        return self._idempotent(room, txn, lambda: self.add_event(room, type, content))
+
+    async def join(self, room: str, **_: Any) -> Json:
+        if room not in self.rooms:
+            raise HTTPError(404, "M_NOT_FOUND", "No such room")
+        if room not in self.joined:
+            self.invites.pop(room, None)
+            self.joined.add(room)
+            self.add_event(room, "m.room.member", {"membership": "join"}, state_key=self.user_id)
+        return {"room_id": room}
+
+    # -- serving ---------------------------------------------------------------
+
+    def aiohttp_app(self) -> web.Application:
+        """Wrap the ASGI app in an aiohttp application.
+
+        :return: Application forwarding every request to :meth:`handle`
+        :rtype: web.Application
+        """
+        async def bridge(request: web.Request) -> web.Response:
+            status, payload, _ = await self.handle(
+                request.method,
+                request.path,
+                request.query_string,
+                {k.lower(): v for k, v in request.headers.items()},
+                await request.read(),
+            )
+            return web.json_response(payload, status=status)
+
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", bridge)
+        return app
+
+    @asynccontextmanager
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> AsyncIterator[str]:
+        """Serve on a local port for the duration of the block.
+
+        :param host: Bind address
+        :type host: str
+        :param port: Port, 0 for any free port
+        :type port: int
+        :return: Base URL
+        :rtype: AsyncIterator[str]
+        """
+        runner = web.AppRunner(self.aiohttp_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        bound = site._server.sockets[0].getsockname()[1]
+        try:
+            yield f"http://{host}:{bound}"
+        finally:
+            self._notify()
+            await runner.cleanup()
+
+
+app = FakeHomeserver()
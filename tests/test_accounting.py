@@ -0,0 +1,95 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+import pytest
+from cleaner.accounting import (
+    MediaAccounting, inotify_available, media_id_for_path, mime_class, shard_for_path,
+)
+from cleaner.db import open_db
+
+
+def write(root, rel, data):
+    p = Path(root) / rel
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_bytes(data)
+    return str(p)
+
+
+async def settle(predicate, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate() and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+class TestMediaAccounting:
+    def test_path_helpers(self):
+        assert media_id_for_path("/m", "/m/local_content/ab/cd/efgh") == "abcdefgh"
+        assert media_id_for_path("/m", "/m/local_thumbnails/ab/cd/efgh/32-32-image-png") == "abcdefgh"
+        assert media_id_for_path("/m", "/m/remote_content/x/ab/cd/ef") is None
+        assert shard_for_path("/m", "/m/local_content/ab/cd/efgh") == "local_content/ab"
+        assert mime_class("video/mp4") == "video"
+        assert mime_class("application/pdf") == "other"
+
+    def test_counters_follow_files_and_uploads(self):
+        with tempfile.TemporaryDirectory() as root:
+            acc = MediaAccounting(root)
+            a = write(root, "local_content/ab/cd/efgh", b"x" * 100)
+            acc.add_file(a, os.stat(a))
+            assert acc.by_room["unknown"] == [100, 1]
+            acc.note_upload("mxc://hs/abcdefgh", "!r:hs", "video/mp4")
+            assert acc.by_room == {"!r:hs": [100, 1]}
+            assert acc.by_class == {"video": [100, 1]}
+            assert acc.by_shard == {"local_content/ab": [100, 1]}
+
+            b = os.path.join(root, "local_content/ab/cd/dup")
+            os.link(a, b)
+            acc.add_file(b, os.stat(b))
+            assert acc.disk_bytes == 100
+            assert acc.by_shard["local_content/ab"] == [200, 2]
+
+            acc.remove_file(a)
+            assert acc.disk_bytes == 100
+            acc.remove_file(b)
+            assert acc.disk_bytes == 0
+            assert not acc.by_room and not acc.by_shard
+
+    def test_usage_ratio_tracks_changes_between_resyncs(self):
+        with tempfile.TemporaryDirectory() as root:
+            acc = MediaAccounting(root, resync_interval=3600)
+            st = os.statvfs(root)
+            total = st.f_blocks * st.f_frsize
+            base = acc.usage_ratio()
+            fake = os.stat_result((0o100644, 1, 1, 1, 0, 0, total // 10, 0, 0, 0))
+            acc.add_file(os.path.join(root, "local_content/ab/cd/big"), fake)
+            assert acc.usage_ratio() == pytest.approx(base + 0.1, abs=0.01)
+
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(not inotify_available(), reason="inotify not available")
+    async def test_inotify_watcher(self):
+        with tempfile.TemporaryDirectory() as root:
+            conn = open_db(os.path.join(root, "state", "uploads.db"))
+            conn.execute(
+                "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("$e", "!r:hs", "@u:hs", "mxc://hs/abcdold", "image/png", 10, 0),
+            )
+            conn.commit()
+            media = os.path.join(root, "media")
+            write(media, "local_content/ab/cd/old", b"o" * 10)
+            acc = MediaAccounting(media)
+            await acc.start(conn)
+            try:
+                assert acc.by_room == {"!r:hs": [10, 1]}
+                new = write(media, "local_content/ef/gh/new", b"n" * 50)
+                assert await settle(lambda: acc.disk_bytes == 60)
+                assert acc.by_shard["local_content/ef"] == [50, 1]
+                acc.note_upload("mxc://hs/efghnew", "!r:hs", "video/webm")
+                assert acc.by_room["!r:hs"] == [60, 2]
+                os.unlink(new)
+                assert await settle(lambda: acc.disk_bytes == 10)
+                assert acc.by_class == {"image": [10, 1]}
+            finally:
+                acc.close()
+                conn.close()
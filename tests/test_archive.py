@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from cleaner import archive
+from cleaner.archive import archive_files, archive_files_async, archive_path, restore_file
+from cleaner.cleaner import (
+    DAY_MS, Policy, RetentionRule, init_db, policy_from_config, run_retention,
+)
+
+
+def write_media(root, media_id, data):
+    d = Path(root) / "local_content" / media_id[:2] / media_id[2:4]
+    d.mkdir(parents=True, exist_ok=True)
+    p = d / media_id
+    p.write_bytes(data)
+    return str(p)
+
+
+class TestArchive:
+    @pytest.mark.parametrize("compression", ["gzip", "lzma"])
+    def test_restore_single_member_by_offset(self, compression):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            media = os.path.join(tmpdir, "media")
+            arc = os.path.join(tmpdir, "archive")
+            conn = init_db(os.path.join(tmpdir, "uploads.db"))
+            first = write_media(media, "aaaafirst", b"first" * 50000)
+            second = write_media(media, "bbbbsecond", os.urandom(300000))
+            original = Path(second).read_bytes()
+            freed = archive_files(conn, arc, compression, "$e", "!r:x", "mxc://x/y", 0,
+                                  [first, second])
+            assert freed == 250000 + 300000
+            assert not os.path.exists(first) and not os.path.exists(second)
+            assert os.listdir(arc) == [os.path.basename(archive_path(arc, 0, compression))]
+
+            out = os.path.join(tmpdir, "out")
+            assert restore_file(conn, second, out) == 300000
+            assert Path(out).read_bytes() == original
+            restore_file(conn, first)
+            assert Path(first).read_bytes() == b"first" * 50000
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_async_archive_compresses_off_the_loop(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            media = os.path.join(tmpdir, "media")
+            arc = os.path.join(tmpdir, "archive")
+            conn = init_db(os.path.join(tmpdir, "uploads.db"))
+            path = write_media(media, "ccccthird", b"third" * 1000)
+            threads = []
+
+            def append(*args):
+                threads.append(threading.current_thread())
+                return real(*args)
+
+            real = archive.append_member
+            with patch("cleaner.archive.append_member", append):
+                freed = await archive_files_async(conn, arc, "gzip", "$e", "!r:x", "mxc://x/z", 0, [path])
+            assert freed == 5000 and not os.path.exists(path)
+            assert threads and threads[0] is not threading.main_thread()
+            assert restore_file(conn, path) == 5000
+            conn.close()
+
+    def test_restore_unknown_path(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(os.path.join(tmpdir, "uploads.db"))
+            with pytest.raises(KeyError):
+                restore_file(conn, "/nope")
+            conn.close()
+
+    def test_archive_rules_need_root(self):
+        with pytest.raises(ValueError):
+            policy_from_config({"policy": {"rules": [{"action": "archive", "max_age_days": 1}]}})
+        with pytest.raises(ValueError):
+            policy_from_config({"policy": {"rules": [{"action": "shred"}]}})
+
+    @pytest.mark.asyncio
+    async def test_retention_archives_instead_of_redacting(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            media = os.path.join(tmpdir, "media")
+            arc = os.path.join(tmpdir, "archive")
+            conn = init_db(os.path.join(tmpdir, "uploads.db"))
+            path = write_media(media, "ccccdoc", b"pdf" * 1000)
+            old = int(time.time() * 1000) - 60 * DAY_MS
+            conn.execute(
+                "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("$doc", "!records:x", "@u:x", "mxc://x/ccccdoc", "application/pdf", 3000, old),
+            )
+            conn.commit()
+            policy = Policy(
+                rules=[RetentionRule(room="!records:x", max_age_days=30, action="archive")],
+                archive_root=arc,
+            )
+            session = MagicMock()
+            session.client.redact = AsyncMock()
+            await run_retention(session, conn, media, policy, None, False, False)
+            session.client.redact.assert_not_called()
+            assert not os.path.exists(path)
+            assert conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+            row = conn.execute("SELECT event_id, size FROM archived_media").fetchone()
+            assert row == ("$doc", 3000)
+            restore_file(conn, path)
+            assert Path(path).read_bytes() == b"pdf" * 1000
+            conn.close()
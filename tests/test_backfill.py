@@ -0,0 +1,143 @@
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from cleaner.backfill import GapBackfill
+from cleaner.cleaner import init_db
+
+
+@pytest.fixture
+def conn():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        yield conn
+        conn.close()
+
+
+def event(i):
+    return SimpleNamespace(event_id=f"$e{i}", timestamp=1000 + i)
+
+
+def room_history(n):
+    """Session whose /messages pages backwards through events 0..n-1, two per page."""
+    history = [event(i) for i in range(n)]
+    calls = []
+
+    async def get_messages(room_id, direction, from_token=None, limit=None, filter_json=None):
+        calls.append(from_token)
+        end = int(from_token)
+        start = max(0, end - 2)
+        return SimpleNamespace(
+            events=list(reversed(history[start:end])),
+            end=str(start) if start else None,
+        )
+
+    session = MagicMock()
+    session.client.get_messages = get_messages
+    return session, calls
+
+
+def sync(room_id, events, limited=False, prev_batch=None):
+    return {"rooms": {"join": {room_id: {"timeline": {
+        "events": [{"event_id": f"$e{i}", "origin_server_ts": 1000 + i} for i in events],
+        "limited": limited,
+        "prev_batch": prev_batch,
+    }}}}}
+
+
+class TestGapBackfill:
+    @pytest.mark.asyncio
+    async def test_backfills_down_to_cursor(self, conn):
+        session, calls = room_history(10)
+        seen = []
+        bf = GapBackfill(session, conn, AsyncMock(side_effect=lambda e: seen.append(e.event_id)))
+        assert bf.note_sync(sync("!r:x", [2])) == 0
+        # Events 3..7 were skipped; the limited timeline starts at 8.
+        assert bf.note_sync(sync("!r:x", [8, 9], limited=True, prev_batch="8")) == 1
+        await asyncio.gather(*bf._tasks)
+        assert seen == ["$e7", "$e6", "$e5", "$e4", "$e3"]
+        assert calls == ["8", "6", "4"]
+        assert bf.cursors["!r:x"] == ("$e9", 1009)
+
+    @pytest.mark.asyncio
+    async def test_cursors_persist(self, conn):
+        session, _ = room_history(0)
+        GapBackfill(session, conn, AsyncMock()).note_sync(sync("!r:x", [4]))
+        assert GapBackfill(session, conn, AsyncMock()).cursors == {"!r:x": ("$e4", 1004)}
+
+    @pytest.mark.asyncio
+    async def test_no_cursor_skips_backfill(self, conn):
+        session, calls = room_history(10)
+        handler = AsyncMock()
+        bf = GapBackfill(session, conn, handler)
+        assert bf.note_sync(sync("!r:x", [9], limited=True, prev_batch="9")) == 0
+        assert len(bf) == 0 and calls == []
+
+    @pytest.mark.asyncio
+    async def test_page_bound_and_handler_errors(self, conn):
+        session, calls = room_history(100)
+        handler = AsyncMock(side_effect=RuntimeError("boom"))
+        bf = GapBackfill(session, conn, handler, max_pages=3)
+        assert await bf.backfill("!r:x", "90", ("$e0", 1000)) == 6
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_does_not_block_caller(self, conn):
+        gate = asyncio.Event()
+
+        async def slow(room_id, direction, **kwargs):
+            await gate.wait()
+            return SimpleNamespace(events=[], end=None)
+
+        session = MagicMock()
+        session.client.get_messages = slow
+        bf = GapBackfill(session, conn, AsyncMock(), concurrency=1)
+        bf.note_sync(sync("!a:x", [1]))
+        bf.note_sync(sync("!b:x", [1]))
+        bf.note_sync({"rooms": {"join": {
+            "!a:x": sync("!a:x", [5], True, "5")["rooms"]["join"]["!a:x"],
+            "!b:x": sync("!b:x", [5], True, "5")["rooms"]["join"]["!b:x"],
+        }}})
+        assert len(bf) == 2
+        await bf.close()
+        assert len(bf) == 0
+
+    @pytest.mark.asyncio
+    async def test_gap_is_kept_until_cursor_is_reached(self, conn):
+        session, calls = room_history(20)
+        seen = []
+        bf = GapBackfill(session, conn, AsyncMock(side_effect=lambda e: seen.append(e.event_id)), max_pages=2)
+        bf.note_sync(sync("!r:x", [2]))
+        bf.note_sync(sync("!r:x", [18, 19], limited=True, prev_batch="18"))
+        await asyncio.gather(*bf._tasks)
+        # Two pages handled 17..14; the gap now resumes from token 14.
+        assert conn.execute("SELECT room_id, from_token, event_id FROM backfill_gaps").fetchall() == [
+            ("!r:x", "14", "$e2")
+        ]
+        bf = GapBackfill(session, conn, AsyncMock(side_effect=lambda e: seen.append(e.event_id)), max_pages=10)
+        assert bf.resume() == 1
+        await asyncio.gather(*bf._tasks)
+        assert seen == [f"$e{i}" for i in range(17, 2, -1)]
+        assert calls[-1] == "4"
+        assert conn.execute("SELECT COUNT(*) FROM backfill_gaps").fetchone()[0] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_backfill_resumes(self, conn):
+        gate = asyncio.Event()
+
+        async def stuck(room_id, direction, **kwargs):
+            await gate.wait()
+
+        session = MagicMock()
+        session.client.get_messages = stuck
+        bf = GapBackfill(session, conn, AsyncMock())
+        bf.note_sync(sync("!r:x", [1]))
+        bf.note_sync(sync("!r:x", [5], limited=True, prev_batch="5"))
+        await bf.close()
+        session, calls = room_history(5)
+        bf = GapBackfill(session, conn, AsyncMock())
+        assert bf.resume() == 1
+        await asyncio.gather(*bf._tasks)
+        assert calls == ["5", "3"]
+        assert bf.resume() == 0
@@ -1,10 +1,11 @@
 import pytest
 import tempfile
+from unittest.mock import MagicMock
 import sqlite3
 from pathlib import Path
 import cleaner.event_main as event_main
 from cleaner.cleaner import (
-    parse_mxc, find_media_files, get_disk_usage_ratio,
+    parse_mxc, find_media_files, resolve_media_paths, get_disk_usage_ratio,
     Policy, init_db, extract_mxc_and_info
 )
 
@@ -32,6 +33,20 @@ class TestCleanerBot:
             assert len(results) == 1
             assert results[0].name == f"media_{media_id}"
 
+    def test_resolve_media_paths_matches_names_and_synapse_layout(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir)
+            (root / "local_content" / "ab" / "cd").mkdir(parents=True)
+            (root / "local_content" / "ab" / "cd" / "efgh").touch()
+            (root / "local_thumbnails" / "ab" / "cd" / "efgh").mkdir(parents=True)
+            (root / "local_thumbnails" / "ab" / "cd" / "efgh" / "32-32-image-png-crop").touch()
+            (root / "media_other").touch()
+            (root / "other.png").touch()
+            found = resolve_media_paths(tmpdir, ["mxc://x/abcdefgh", "mxc://x/other", "mxc://x/", "bad"])
+            assert sorted(p.name for p in found["mxc://x/abcdefgh"]) == ["32-32-image-png-crop", "efgh"]
+            assert sorted(p.name for p in found["mxc://x/other"]) == ["media_other", "other.png"]
+            assert found["mxc://x/"] == [] and found["bad"] == []
+
     def test_policy_defaults(self):
         p = Policy()
         assert p.image_days == 90
@@ -43,7 +58,7 @@ class TestCleanerBot:
         with tempfile.TemporaryDirectory() as tmpdir:
             db_path = f"{tmpdir}/test.db"
             conn = init_db(db_path)
-            cur = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='uploads'")
+            cur = conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name='uploads'")
             assert cur.fetchone() is not None
             conn.close()
 
@@ -75,3 +90,41 @@ class TestCleanerBot:
         """Verify event_main.py module exists."""
         assert hasattr(event_main, 'main')
         assert hasattr(event_main, 'on_message')
+
+    def test_sync_filter_plaintext_is_lean(self):
+        f = event_main.build_sync_filter(["!a:example.com"], e2ee=False).serialize()
+        assert f["presence"] == {"not_types": ["*"]}
+        assert f["room"]["rooms"] == ["!a:example.com"]
+        assert f["room"]["ephemeral"]["not_types"] == ["*"]
+        assert f["room"]["state"]["lazy_load_members"] is True
+        assert f["room"]["timeline"]["contains_url"] is True
+        assert f["room"]["timeline"]["types"] == ["m.room.message"]
+
+    def test_sync_filter_e2ee_keeps_encrypted_events(self):
+        f = event_main.build_sync_filter([], e2ee=True).serialize()
+        assert "rooms" not in f["room"]
+        assert "contains_url" not in f["room"]["timeline"]
+        assert "m.room.encrypted" in f["room"]["timeline"]["types"]
+
+    def test_apply_config_swaps_policy_and_filter(self, monkeypatch):
+        from catcord_bots.config import FrameworkConfig
+        base = {"homeserver_url": "https://hs", "bot": {"mxid": "@c:x", "access_token": "t"}}
+        old = {**base, "rooms_allowlist": ["!a:x"]}
+        new = {
+            **base,
+            "rooms_allowlist": ["!a:x", "!b:x"],
+            "policy": {"disk_thresholds": {"emergency": 0.5}},
+            "sync": {"max_pending": 1},
+        }
+        runner, retention = MagicMock(), MagicMock()
+        monkeypatch.setattr(event_main, "runner", runner)
+        monkeypatch.setattr(event_main, "retention", retention)
+        monkeypatch.setattr(event_main, "backfill", None)
+        monkeypatch.setattr(event_main, "live_cfg", FrameworkConfig.from_dict(old))
+        monkeypatch.setattr(event_main, "live_policy", None)
+        event_main.apply_config(old, new, FrameworkConfig.from_dict(new))
+        assert event_main.live_policy.emergency == 0.5
+        assert event_main.live_cfg.rooms_allowlist == ["!a:x", "!b:x"]
+        retention.set_policy.assert_called_once_with(event_main.live_policy)
+        new_filter = runner.set_filter.call_args.args[0].serialize()
+        assert new_filter["room"]["rooms"] == ["!a:x", "!b:x"]
@@ -1,5 +1,9 @@
+import asyncio
+import os
+import signal
 import pytest
-from catcord_bots.config import FrameworkConfig, Homeserver, BotCreds, Notifications
+import yaml
+from catcord_bots.config import ConfigWatcher, FrameworkConfig, Homeserver, BotCreds, Notifications
 
 
 class TestConfig:
@@ -34,3 +38,64 @@ class TestConfig:
         assert cfg.notifications.send_deletion_summary is False
         assert cfg.notifications.send_zero_deletion_summaries is True
         assert len(cfg.rooms_allowlist) == 2
+
+
+def write_config(path, allowlist, emergency=0.92):
+    path.write_text(yaml.safe_dump({
+        "homeserver_url": "https://matrix.example.com",
+        "bot": {"mxid": "@bot:example.com", "access_token": "token123"},
+        "rooms_allowlist": allowlist,
+        "policy": {"disk_thresholds": {"emergency": emergency}},
+    }))
+
+
+class TestConfigWatcher:
+    def test_reload_swaps_valid_config(self, tmp_path):
+        path = tmp_path / "config.yaml"
+        write_config(path, ["!a:x"])
+        watcher = ConfigWatcher(path)
+        seen = []
+        watcher.add_callback(lambda old, raw, cfg: seen.append((old["rooms_allowlist"], cfg.rooms_allowlist)))
+        assert not watcher.reload()
+        write_config(path, ["!a:x", "!b:x"])
+        assert watcher.reload()
+        assert watcher.config.rooms_allowlist == ["!a:x", "!b:x"]
+        assert seen == [(["!a:x"], ["!a:x", "!b:x"])]
+
+    def test_invalid_config_is_rejected(self, tmp_path):
+        path = tmp_path / "config.yaml"
+        write_config(path, ["!a:x"])
+
+        def validate(raw):
+            if raw["policy"]["disk_thresholds"]["emergency"] > 1:
+                raise ValueError("emergency must be a ratio")
+
+        watcher = ConfigWatcher(path, validate=validate)
+        before = watcher.snapshot
+        write_config(path, ["!b:x"], emergency=92)
+        assert not watcher.reload()
+        path.write_text("bot: [")
+        assert not watcher.reload()
+        assert watcher.snapshot is before
+
+    @pytest.mark.asyncio
+    async def test_polls_mtime_and_handles_sighup(self, tmp_path):
+        path = tmp_path / "config.yaml"
+        write_config(path, ["!a:x"])
+        watcher = ConfigWatcher(path, poll_interval=0.01)
+        watcher.start()
+        try:
+            write_config(path, ["!polled:x", "!longer:x"])
+            for _ in range(100):
+                if watcher.config.rooms_allowlist != ["!a:x"]:
+                    break
+                await asyncio.sleep(0.01)
+            assert watcher.config.rooms_allowlist == ["!polled:x", "!longer:x"]
+
+            watcher.poll_interval = 0
+            write_config(path, ["!hup:x"])
+            os.kill(os.getpid(), signal.SIGHUP)
+            await asyncio.sleep(0.05)
+            assert watcher.config.rooms_allowlist == ["!hup:x"]
+        finally:
+            await watcher.close()
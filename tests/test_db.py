@@ -0,0 +1,129 @@
+import sqlite3
+import tempfile
+import threading
+import time
+import pytest
+from cleaner.db import MIGRATIONS, SCHEMA_VERSION, BUSY_TIMEOUT_MS, connect, migrate, open_db, schema_version
+
+
+class TestUploadsDb:
+    def test_open_db_applies_pragmas_and_schema(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = open_db(f"{tmpdir}/uploads.db")
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == BUSY_TIMEOUT_MS
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert schema_version(conn) == SCHEMA_VERSION
+            conn.close()
+
+    def test_migrates_legacy_database_in_place(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/uploads.db"
+            legacy = sqlite3.connect(path)
+            legacy.execute(
+                "CREATE TABLE uploads (event_id TEXT PRIMARY KEY, room_id TEXT, sender TEXT, "
+                "mxc_uri TEXT, mimetype TEXT, size INTEGER, timestamp INTEGER)"
+            )
+            legacy.execute("INSERT INTO uploads VALUES ('$e', '!r', '@u', 'mxc://s/m', 'image/png', 1, 2)")
+            legacy.commit()
+            legacy.close()
+            conn = open_db(path)
+            assert conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 1
+            assert schema_version(conn) == SCHEMA_VERSION
+            assert migrate(conn) == SCHEMA_VERSION
+            conn.close()
+
+    def test_interned_uploads_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = open_db(f"{tmpdir}/uploads.db")
+            rows = [
+                ("$a", "!r:x", "@u:x", "mxc://x.org/AAA", "image/png", 10, 1),
+                ("$b", "!r:x", "@u:x", "mxc://x.org/BBB", "image/png", 20, 2),
+                ("$c", "!s:x", None, "not-an-mxc", None, None, 3),
+            ]
+            conn.executemany("INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR IGNORE INTO uploads VALUES ('$a', '!z:x', '@z:x', 'mxc://z/Z', 'a/b', 1, 1)")
+            conn.commit()
+            assert conn.execute("SELECT * FROM uploads ORDER BY event_id").fetchall() == rows
+            assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] == 2
+            assert conn.execute("SELECT COUNT(*) FROM servers").fetchone()[0] == 1
+            assert conn.execute("SELECT media_id FROM upload_records WHERE event_id = '$a'").fetchone()[0] == "AAA"
+            with pytest.raises(sqlite3.IntegrityError):
+                conn.execute("INSERT INTO uploads VALUES ('$a', '!r:x', '@u:x', 'mxc://x.org/AAA', 'image/png', 1, 1)")
+            conn.execute("DELETE FROM uploads WHERE event_id = '$b'")
+            conn.commit()
+            assert conn.execute("SELECT COUNT(*) FROM upload_records").fetchone()[0] == 2
+            conn.close()
+
+    def test_migrates_flat_uploads_to_interned(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/uploads.db"
+            old = connect(path)
+            for statements in MIGRATIONS[:7]:
+                for statement in statements:
+                    old.execute(statement)
+            old.execute("PRAGMA user_version = 7")
+            old.execute("INSERT INTO uploads VALUES ('$e', '!r', '@u', 'mxc://s/m', 'image/png', 1, 2)")
+            old.commit()
+            old.close()
+            conn = open_db(path)
+            assert conn.execute("SELECT * FROM uploads").fetchall() == [
+                ("$e", "!r", "@u", "mxc://s/m", "image/png", 1, 2)
+            ]
+            kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'uploads'").fetchone()[0]
+            assert kind == "view"
+            conn.close()
+
+    def test_image_flag_is_backfilled_and_kept_by_inserts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/uploads.db"
+            old = connect(path)
+            for statements in MIGRATIONS[:10]:
+                for statement in statements:
+                    old.execute(statement)
+            old.execute("PRAGMA user_version = 10")
+            old.execute("INSERT INTO uploads VALUES ('$old', '!r', '@u', 'mxc://s/a', 'image/png', 1, 2)")
+            old.commit()
+            old.close()
+            conn = open_db(path)
+            conn.execute("INSERT INTO uploads VALUES ('$new', '!r', '@u', 'mxc://s/b', 'IMAGE/GIF', 1, 3)")
+            conn.execute("INSERT INTO uploads VALUES ('$doc', '!r', '@u', 'mxc://s/c', NULL, 1, 4)")
+            flags = dict(conn.execute("SELECT event_id, is_image FROM upload_records").fetchall())
+            assert flags == {"$old": 1, "$new": 1, "$doc": 0}
+            conn.close()
+
+    def test_rejects_newer_schema(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = connect(f"{tmpdir}/uploads.db")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+            with pytest.raises(RuntimeError):
+                migrate(conn)
+            conn.close()
+
+    def test_second_writer_waits_instead_of_failing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/uploads.db"
+            first = open_db(path)
+            first.execute("BEGIN IMMEDIATE")
+            first.execute("INSERT INTO uploads (event_id) VALUES ('$a')")
+            errors = []
+
+            def second_writer():
+                second = open_db(path)
+                try:
+                    assert second.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+                    second.execute("INSERT INTO uploads (event_id) VALUES ('$b')")
+                    second.commit()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    second.close()
+
+            t = threading.Thread(target=second_writer)
+            t.start()
+            time.sleep(0.2)
+            first.commit()
+            t.join()
+            assert errors == []
+            assert first.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 2
+            first.close()
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import tempfile
+import pytest
+from unittest.mock import AsyncMock, Mock
+from mautrix.types import EncryptedEvent
+from cleaner.cleaner import init_db
+from cleaner.decrypt_queue import PendingDecryptionQueue
+
+
+async def never_arrives(room_id, session_id, timeout=3):
+    await asyncio.sleep(3600)
+    return False
+
+
+def make_event(event_id="$e1", session_id="S1"):
+    return EncryptedEvent.deserialize({
+        "type": "m.room.encrypted",
+        "room_id": "!room:example.com",
+        "event_id": event_id,
+        "sender": "@user:example.com",
+        "origin_server_ts": 1000,
+        "content": {
+            "algorithm": "m.megolm.v1.aes-sha2",
+            "ciphertext": "abc",
+            "session_id": session_id,
+            "sender_key": "key",
+            "device_id": "DEV",
+        },
+    })
+
+
+class TestPendingDecryptionQueue:
+    @pytest.mark.asyncio
+    async def test_add_persists_and_waits_for_key(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(side_effect=never_arrives)
+            queue = PendingDecryptionQueue(conn, crypto, AsyncMock())
+            queue.add(make_event())
+            queue.add(make_event())
+            assert queue.pending_count() == 1
+            await asyncio.sleep(0)
+            crypto.wait_for_session.assert_called()
+            await queue.close()
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_retry_session_success_feeds_handler(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            decrypted = Mock()
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(side_effect=never_arrives)
+            crypto.decrypt_megolm_event = AsyncMock(return_value=decrypted)
+            handler = AsyncMock()
+            queue = PendingDecryptionQueue(conn, crypto, handler)
+            queue.add(make_event("$e1"))
+            queue.add(make_event("$e2"))
+            assert await queue.retry_session("S1") == 2
+            assert queue.pending_count() == 0
+            handler.assert_called_with(decrypted)
+            await queue.close()
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_retry_session_failure_backs_off(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(side_effect=never_arrives)
+            crypto.decrypt_megolm_event = AsyncMock(side_effect=RuntimeError("no key"))
+            queue = PendingDecryptionQueue(conn, crypto, AsyncMock(), max_attempts=2)
+            queue.add(make_event())
+            assert await queue.retry_session("S1") == 0
+            attempts = conn.execute("SELECT attempts FROM pending_decryption").fetchone()[0]
+            assert attempts == 1
+            await queue.retry_session("S1")
+            assert queue.pending_count() == 0
+            await queue.close()
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_key_arrival_triggers_retry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(return_value=True)
+            crypto.decrypt_megolm_event = AsyncMock(return_value=Mock())
+            handler = AsyncMock()
+            queue = PendingDecryptionQueue(conn, crypto, handler)
+            queue.add(make_event())
+            for _ in range(5):
+                await asyncio.sleep(0)
+            handler.assert_called_once()
+            assert queue.pending_count() == 0
+            await queue.close()
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_run_retries_due_sessions_from_previous_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            for event_id, session_id, next_attempt in (
+                ("$due", "S9", 0),
+                ("$later", "S8", 2 ** 62),
+            ):
+                conn.execute(
+                    "INSERT INTO pending_decryption VALUES (?, ?, ?, ?, 0, ?, 0)",
+                    (event_id, session_id, "!room:example.com",
+                     json.dumps(make_event(event_id, session_id).serialize()),
+                     next_attempt),
+                )
+            conn.commit()
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(side_effect=never_arrives)
+            crypto.decrypt_megolm_event = AsyncMock(return_value=Mock())
+            handler = AsyncMock()
+            queue = PendingDecryptionQueue(conn, crypto, handler)
+            queue.start()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            crypto.wait_for_session.assert_any_call(
+                "!room:example.com", "S8", timeout=queue.max_delay
+            )
+            handler.assert_called_once()
+            assert queue.pending_count() == 1
+            await queue.close()
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_retries_handle_event_once(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+
+            async def slow_decrypt(evt):
+                await asyncio.sleep(0.01)
+                return Mock()
+
+            crypto = Mock()
+            crypto.wait_for_session = AsyncMock(side_effect=never_arrives)
+            crypto.decrypt_megolm_event = AsyncMock(side_effect=slow_decrypt)
+            handler = AsyncMock()
+            queue = PendingDecryptionQueue(conn, crypto, handler)
+            queue.add(make_event())
+            results = await asyncio.gather(
+                queue.retry_session("S1"), queue.retry_session("S1")
+            )
+            assert sorted(results) == [0, 1]
+            handler.assert_called_once()
+            await queue.close()
+            conn.close()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from cleaner import dedupe
+from cleaner.cleaner import delete_upload
+from cleaner.db import open_db
+from cleaner.dedupe import replace_with_link, run_dedupe
+from cleaner.scan import MediaFile
+
+
+def make_store(root):
+    d = Path(root) / "local_content" / "ab" / "cd"
+    d.mkdir(parents=True)
+    payload = b"meme" * 2048
+    (d / "efgh1").write_bytes(payload)
+    (d / "efgh2").write_bytes(payload)
+    (d / "efgh3").write_bytes(payload)
+    (d / "other").write_bytes(b"z" * len(payload))
+    (d / "small1").write_bytes(b"tiny")
+    (d / "small2").write_bytes(b"tiny")
+    return d, len(payload)
+
+
+class TestDedupe:
+    def test_links_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d, size = make_store(tmpdir)
+            conn = open_db(os.path.join(tmpdir, "uploads.db"))
+            try:
+                result = run_dedupe(conn, tmpdir, dry_run=False, workers=2)
+                assert result.duplicates == 2
+                assert result.linked == 2
+                assert result.reclaimed_bytes == 2 * size
+                inodes = {os.stat(d / f"efgh{i}").st_ino for i in (1, 2, 3)}
+                assert len(inodes) == 1
+                assert os.stat(d / "other").st_nlink == 1
+                assert os.stat(d / "small1").st_nlink == 1
+                assert (d / "efgh2").read_bytes() == b"meme" * 2048
+                assert not list(Path(tmpdir).rglob("*.dedupe-tmp"))
+            finally:
+                conn.close()
+
+    def test_dry_run_and_hash_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d, size = make_store(tmpdir)
+            conn = open_db(os.path.join(tmpdir, "uploads.db"))
+            try:
+                result = run_dedupe(conn, tmpdir, dry_run=True, workers=2)
+                assert result.linked == 0
+                assert result.reclaimed_bytes == 2 * size
+                assert os.stat(d / "efgh2").st_nlink == 1
+                assert result.hashed == 4
+                again = run_dedupe(conn, tmpdir, dry_run=True, workers=2)
+                assert again.hashed == 0
+                assert again.duplicates == 2
+            finally:
+                conn.close()
+
+    def test_skips_file_changed_after_hashing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d, _ = make_store(tmpdir)
+            stat = lambda p: MediaFile(str(p), os.stat(p).st_size, os.stat(p).st_mtime)
+            canonical, duplicate = stat(d / "efgh1"), stat(d / "efgh2")
+            (d / "efgh2").write_bytes(b"edited" * 2048)
+            assert replace_with_link(canonical, duplicate) is False
+            assert (d / "efgh2").read_bytes() == b"edited" * 2048
+            assert not list(Path(tmpdir).rglob("*.dedupe-tmp"))
+
+    def test_skips_file_written_while_hashing(self):
+        real = dedupe.file_sha256
+
+        def racing(path):
+            digest = real(path)
+            if path.endswith("efgh3"):
+                with open(path, "ab") as f:
+                    f.write(b"!")
+            return digest
+
+        with tempfile.TemporaryDirectory() as tmpdir, patch.object(dedupe, "file_sha256", racing):
+            d, _ = make_store(tmpdir)
+            conn = open_db(os.path.join(tmpdir, "uploads.db"))
+            try:
+                result = run_dedupe(conn, tmpdir, dry_run=False, workers=2)
+                assert result.linked == 1
+                assert (d / "efgh3").read_bytes().endswith(b"!")
+                assert os.stat(d / "efgh3").st_nlink == 1
+            finally:
+                conn.close()
+
+    def test_second_run_finds_nothing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_store(tmpdir)
+            conn = open_db(os.path.join(tmpdir, "uploads.db"))
+            try:
+                run_dedupe(conn, tmpdir, dry_run=False, workers=2)
+                again = run_dedupe(conn, tmpdir, dry_run=False, workers=2)
+                assert again.duplicates == 0
+                assert again.hashed == 0
+            finally:
+                conn.close()
+
+    @pytest.mark.asyncio
+    async def test_delete_upload_counts_only_last_link(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d, size = make_store(tmpdir)
+            conn = open_db(os.path.join(tmpdir, "uploads.db"))
+            try:
+                run_dedupe(conn, tmpdir, dry_run=False, workers=2)
+                session = MagicMock()
+                session.client.redact = AsyncMock()
+                freed = []
+                for i in (1, 2, 3):
+                    freed.append(await delete_upload(
+                        session, conn, tmpdir, f"$e{i}", "!r:x", f"mxc://x/efgh{i}", "test"
+                    ))
+                assert freed == [0, 0, size]
+                count = conn.execute("SELECT COUNT(*) FROM media_hashes WHERE path LIKE '%efgh%'").fetchone()[0]
+                assert count == 0
+            finally:
+                conn.close()
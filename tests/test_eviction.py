@@ -0,0 +1,117 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from cleaner.cleaner import Policy, init_db, pressure_candidates, run_pressure
+from cleaner.eviction import EvictionQueue, eviction_key
+from cleaner.scan import scan_media
+
+
+def add_upload(conn, media, name, mime, size, ts=0):
+    (media / f"id{name}").write_bytes(b"x" * size)
+    conn.execute("INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                 (f"${name}", "!r:x", "@u:x", f"mxc://x/id{name}", mime, size, ts))
+    conn.commit()
+
+
+@pytest.fixture
+def store():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        media = Path(tmpdir) / "media"
+        media.mkdir()
+        yield conn, media
+        conn.close()
+
+
+class TestEvictionQueue:
+    def test_key_matches_pressure_order(self):
+        keys = [eviction_key("video/mp4", 10, 5), eviction_key("image/png", 99, 1),
+                eviction_key("video/mp4", 20, 9), eviction_key("video/mp4", 20, 3)]
+        assert sorted(keys) == [keys[3], keys[2], keys[0], keys[1]]
+
+    @pytest.mark.asyncio
+    async def test_refill_resolves_paths_and_is_bounded(self, store):
+        conn, media = store
+        add_upload(conn, media, "img", "image/png", 500)
+        add_upload(conn, media, "big", "video/mp4", 300)
+        add_upload(conn, media, "small", "video/mp4", 100)
+        queue = EvictionQueue(conn, str(media), capacity=2)
+        await queue.refill()
+        assert [c.event_id for c in queue.entries] == ["$big", "$small"]
+        assert queue.entries[0].paths == [media / "idbig"]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_note_upload_inserts_and_resolves(self, store):
+        conn, media = store
+        add_upload(conn, media, "small", "video/mp4", 100)
+        queue = EvictionQueue(conn, str(media), capacity=2, resolve_delay=0)
+        await queue.refill()
+        add_upload(conn, media, "new", "video/mp4", 900)
+        queue.note_upload("$new", "!r:x", "@u:x", "mxc://x/idnew", "video/mp4", 900, 0)
+        queue.note_upload("$img", "!r:x", "@u:x", "mxc://x/idimg", "image/png", 1, 0)
+        assert [c.event_id for c in queue.entries] == ["$new", "$small"]
+        await queue._resolve_task
+        assert queue.entries[0].paths == [media / "idnew"]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_burst_of_uploads_resolves_in_one_scan(self, store):
+        conn, media = store
+        queue = EvictionQueue(conn, str(media), capacity=8, resolve_delay=0.05)
+        with patch("cleaner.cleaner.scan_media", wraps=scan_media) as scan:
+            for i in range(5):
+                add_upload(conn, media, f"v{i}", "video/mp4", 100 + i)
+                queue.note_upload(f"$v{i}", "!r:x", "@u:x", f"mxc://x/idv{i}", "video/mp4", 100 + i, 0)
+            await queue._resolve_task
+        assert scan.call_count == 1
+        assert all(c.paths == [media / f"id{c.event_id[1:]}"] for c in queue.entries)
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_pop_skips_deleted_and_candidates_fall_back_to_index(self, store):
+        conn, media = store
+        add_upload(conn, media, "a", "video/mp4", 300)
+        add_upload(conn, media, "b", "video/mp4", 200)
+        add_upload(conn, media, "c", "video/mp4", 100)
+        queue = EvictionQueue(conn, str(media), capacity=2, low_water=0)
+        await queue.refill()
+        conn.execute("DELETE FROM uploads WHERE event_id = '$a'")
+        rows = list(pressure_candidates(conn, queue))
+        assert [r[0] for r in rows] == ["$b", "$c"]
+        assert rows[0][7] == [media / "idb"]
+        assert rows[1][7] is None
+        await queue.close()
+
+    def test_candidates_page_through_index_while_rows_are_deleted(self, store, monkeypatch):
+        conn, _ = store
+        monkeypatch.setattr("cleaner.cleaner.PRESSURE_PAGE", 3)
+        conn.executemany("INSERT INTO uploads VALUES (?, '!r:x', '@u:x', ?, 'video/mp4', ?, 0)",
+                         [(f"${i}", f"mxc://x/{i}", 100 - i) for i in range(10)])
+        conn.commit()
+        seen = []
+        for row in pressure_candidates(conn):
+            seen.append(row[0])
+            if len(seen) % 2:
+                conn.execute("DELETE FROM uploads WHERE event_id = ?", (row[0],))
+        assert seen == [f"${i}" for i in range(10)]
+
+    @pytest.mark.asyncio
+    async def test_run_pressure_uses_resolved_paths(self, store):
+        conn, media = store
+        add_upload(conn, media, "a", "video/mp4", 300)
+        queue = EvictionQueue(conn, str(media))
+        await queue.refill()
+        session = MagicMock()
+        session.client.redact = AsyncMock()
+        usage = iter([0.95, 0.95, 0.80, 0.80])
+        with patch("cleaner.cleaner.get_disk_usage_ratio", lambda _: next(usage)), \
+                patch("cleaner.cleaner.find_media_files", side_effect=AssertionError("scanned")):
+            await run_pressure(session, conn, str(media), Policy(), None, False, False,
+                               eviction=queue)
+        assert not os.path.exists(media / "ida")
+        assert conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+        await queue.close()
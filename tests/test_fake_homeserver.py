@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import pytest
+from mautrix.errors import MUnknownToken
+from mautrix.types import EventType, PaginationDirection, RoomEventFilter, RoomID, SyncToken
+from catcord_bots.config import OutboundConfig, RequestPolicy
+from catcord_bots.invites import join_all_invites, list_invites
+from catcord_bots.matrix import create_client, send_text, whoami
+from catcord_bots.outbound import OutboundQueue
+from catcord_bots.state import StateStore
+from catcord_bots.sync import SyncRunner
+from cleaner.backfill import GapBackfill
+from cleaner.cleaner import init_db
+from cleaner.event_main import build_sync_filter
+from cleaner.outbox import RedactionOutbox, enqueue_redaction
+from tests.fake_homeserver import FakeHomeserver
+
+FAST = RequestPolicy(backoff_base=0.01, backoff_max=0.05, rate=1000, burst=1000)
+
+
+@pytest.fixture
+def tmpdir():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+class connected:
+    """Serve ``hs`` and open a client session against it."""
+
+    def __init__(self, hs, token="token", policy=FAST):
+        self.hs = hs
+        self.token = token
+        self.policy = policy
+
+    async def __aenter__(self):
+        self._serve = self.hs.serve()
+        url = await self._serve.__aenter__()
+        self.session = create_client(self.hs.user_id, url, self.token, self.policy)
+        return self.session
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        await self._serve.__aexit__(*exc)
+
+
+class TestFakeHomeserver:
+    @pytest.mark.asyncio
+    async def test_whoami_and_auth(self):
+        hs = FakeHomeserver()
+        async with connected(hs) as session:
+            assert await whoami(session) == hs.user_id
+        async with connected(hs, token="wrong") as session:
+            with pytest.raises(MUnknownToken):
+                await whoami(session)
+
+    @pytest.mark.asyncio
+    async def test_invites_are_discovered_and_joined(self, tmpdir):
+        hs = FakeHomeserver()
+        hs.invite("!a:fake.server")
+        hs.invite("!b:fake.server")
+        state = os.path.join(tmpdir, "invites.json")
+        async with connected(hs) as session:
+            assert sorted(await list_invites(session, state)) == ["!a:fake.server", "!b:fake.server"]
+            joined = await join_all_invites(session, allowlist=["!a:fake.server"], state_path=state)
+            assert joined == ["!a:fake.server"]
+            assert await list_invites(session, state) == ["!b:fake.server"]
+        assert hs.joined == {"!a:fake.server"}
+
+    @pytest.mark.asyncio
+    async def test_sync_runner_receives_filtered_live_events(self):
+        hs = FakeHomeserver()
+        room = hs.create_room()
+        hs.add_event(room, "m.room.message", {"msgtype": "m.text", "body": "old"})
+        seen = []
+        async with connected(hs) as session:
+            runner = SyncRunner(session, build_sync_filter([], e2ee=False), timeout_ms=1000)
+
+            async def handler(evt):
+                seen.append(evt.content.body)
+
+            runner.add_handler(EventType.ROOM_MESSAGE, handler)
+            task = asyncio.create_task(runner.run())
+            while runner.iteration < 1:
+                await asyncio.sleep(0.01)
+            hs.add_event(room, "m.room.message", {"msgtype": "m.text", "body": "chat"})
+            hs.add_event(room, "m.room.message", {"msgtype": "m.image", "body": "cat.png", "url": "mxc://x/1"})
+            while not seen:
+                await asyncio.sleep(0.01)
+            runner.stop()
+            await task
+        assert seen == ["cat.png"]
+        assert hs.counts["upload_filter"] == 1
+        assert runner.since == f"s{hs.next_pos}"
+
+    @pytest.mark.asyncio
+    async def test_backfill_pages_through_large_room(self, tmpdir):
+        hs = FakeHomeserver()
+        room = hs.generate_room(2000, media_fraction=0.25, seed=7)
+        conn = init_db(os.path.join(tmpdir, "uploads.db"))
+        handled = []
+
+        async def handler(evt):
+            handled.append(str(evt.event_id))
+
+        cursor_event = hs.messages(room)[199]
+        timeline = RoomEventFilter(types=[EventType.ROOM_MESSAGE], contains_url=True)
+        async with connected(hs) as session:
+            backfill = GapBackfill(session, conn, handler, timeline_filter=timeline, page_size=100)
+            resp = await session.client.get_messages(
+                RoomID(room), PaginationDirection.BACKWARD, from_token=SyncToken(f"s{hs.next_pos}"), limit=10,
+            )
+            gap = await backfill.backfill(
+                room, resp.end, (cursor_event["event_id"], cursor_event["origin_server_ts"]),
+            )
+        conn.close()
+        expected = [e["event_id"] for e in hs.messages(room)[200:-10] if "url" in e["content"]]
+        assert gap == len(expected) and sorted(handled) == sorted(expected)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mass", [False, True])
+    async def test_redaction_outbox_rides_out_rate_limits(self, tmpdir, mass):
+        hs = FakeHomeserver(mass_redaction=mass)
+        room = hs.generate_room(50, media_fraction=1.0, seed=1)
+        targets = [e["event_id"] for e in hs.messages(room)[:20]]
+        conn = init_db(os.path.join(tmpdir, "uploads.db"))
+        for event_id in targets:
+            enqueue_redaction(conn, event_id, room, "retention")
+        conn.commit()
+        hs.inject(429, count=2, path="/redact/|/send/m.room.redaction/", retry_after_ms=20)
+        async with connected(hs) as session:
+            outbox = RedactionOutbox(session, conn, min_interval=0.0, mass_batch=100 if mass else 0)
+            assert await outbox.drain(deadline=time.monotonic() + 10) == 0
+        conn.close()
+        assert sorted(hs.redacted(room)) == sorted(targets)
+        assert len(hs.messages(room, "m.room.redaction")) == (1 if mass else 20)
+
+    @pytest.mark.asyncio
+    async def test_server_rate_limit_is_absorbed_by_retry_layer(self):
+        hs = FakeHomeserver(rate_limit=200, rate_burst=5)
+        async with connected(hs) as session:
+            results = [await whoami(session) for _ in range(30)]
+        assert results == [hs.user_id] * 30
+        assert hs.counts["whoami"] > 30
+
+    @pytest.mark.asyncio
+    async def test_outbound_queue_coalesces_into_one_event(self, tmpdir):
+        hs = FakeHomeserver(latency=0.005)
+        room = hs.create_room()
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        async with connected(hs) as session:
+            session.outbound = OutboundQueue(session, OutboundConfig(window=0.05, min_interval=0.0), store=store)
+            for i in range(5):
+                await send_text(session, room, f"line {i}")
+        store.close()
+        bodies = [e["content"]["body"] for e in hs.messages(room, "m.room.message")]
+        assert bodies == ["\n\n".join(f"line {i}" for i in range(5))]
+
+    @pytest.mark.asyncio
+    async def test_asgi_limited_sync_continues_with_messages(self):
+        hs = FakeHomeserver()
+        room = hs.generate_room(30, media_fraction=0.0)
+        sent = []
+
+        async def call(path, query):
+            body = iter([{"type": "http.request", "body": b""}])
+            scope = {
+                "type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+                "headers": [(b"authorization", b"Bearer token")],
+            }
+            sent.clear()
+            await hs(scope, lambda: asyncio.sleep(0, next(body)), lambda m: asyncio.sleep(0, sent.append(m)))
+            return sent[0]["status"], json.loads(sent[1]["body"])
+
+        status, sync = await call("/_matrix/client/v3/sync", 'filter={"room":{"timeline":{"limit":5}}}')
+        timeline = sync["rooms"]["join"][room]["timeline"]
+        assert status == 200 and timeline["limited"] and len(timeline["events"]) == 5
+        status, page = await call(
+            f"/_matrix/client/v3/rooms/{room}/messages", f"dir=b&limit=100&from={timeline['prev_batch']}",
+        )
+        ids = [e["event_id"] for e in page["chunk"][::-1] + timeline["events"]]
+        assert ids == [e["event_id"] for e in hs.messages(room)] and "end" not in page
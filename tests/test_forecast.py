@@ -0,0 +1,92 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from cleaner.cleaner import Policy, init_db
+from cleaner.forecast import (
+    GrowthForecaster, growth_rate, preemptive_cleanup, record_sample, seconds_until,
+)
+
+GB = 1024 ** 3
+
+
+class TestForecast:
+    def test_growth_rate_is_linear_slope(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            for i in range(10):
+                record_sample(conn, i * 60_000, 100 * GB + i * 60 * 1000, 200 * GB, 0)
+            assert growth_rate(conn, 3600_000, now_ms=9 * 60_000) == pytest.approx(1000)
+            assert growth_rate(conn, 1, now_ms=9 * 60_000) is None
+            conn.close()
+
+    def test_upload_inflow_floors_rate(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            # Disk flat because cleanups offset a steady 5 kB/s of uploads.
+            for i in range(5):
+                record_sample(conn, i * 1000, GB, 2 * GB, 5000)
+            assert growth_rate(conn, 60_000, now_ms=4000) == pytest.approx(5000)
+            conn.close()
+
+    def test_old_samples_pruned(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            record_sample(conn, 0, 1, 2, 0, keep_ms=1000)
+            record_sample(conn, 5000, 1, 2, 0, keep_ms=1000)
+            assert conn.execute("SELECT COUNT(*) FROM disk_samples").fetchone()[0] == 1
+            conn.close()
+
+    def test_seconds_until(self):
+        assert seconds_until(80, 100, 0.9, 1.0) == pytest.approx(10)
+        assert seconds_until(95, 100, 0.9, 1.0) == 0.0
+        assert seconds_until(80, 100, 0.9, -1.0) is None
+        assert seconds_until(80, 100, 0.9, None) is None
+
+    @pytest.mark.asyncio
+    async def test_preemptive_cleanup_takes_oldest_until_target(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            media = Path(tmpdir) / "media"
+            media.mkdir()
+            for name, mime, size, ts in (("vid", "video/mp4", 300, 1), ("img", "image/png", 500, 2),
+                                         ("doc", "application/pdf", 200, 3)):
+                (media / f"id{name}").write_bytes(b"x" * size)
+                conn.execute("INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (f"${name}", "!r:x", "@u:x", f"mxc://x/id{name}", mime, size, ts))
+            conn.commit()
+            session = MagicMock()
+            session.client.redact = AsyncMock()
+            expired, freed = await preemptive_cleanup(
+                session, conn, str(media), Policy(), target_bytes=400,
+                batch_size=1, batch_interval=0,
+            )
+            # Oldest first: the image goes before the newer, smaller document.
+            assert (expired, freed) == (2, 800)
+            assert sorted(os.listdir(media)) == ["iddoc"]
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_check_triggers_once_within_horizon(self, monkeypatch):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            st = os.statvfs(tmpdir)
+            total = st.f_blocks * st.f_frsize
+            usage = iter([0.80, 0.81, 0.82, 0.83])
+            forecaster = GrowthForecaster(
+                MagicMock(), conn, tmpdir, Policy(emergency=0.92), lambda: next(usage),
+                horizon=3600, cooldown=3600,
+            )
+            cleanup = AsyncMock(return_value=(1, 10))
+            monkeypatch.setattr("cleaner.forecast.preemptive_cleanup", cleanup)
+            # 1% of the disk per minute: emergency is ~9 minutes away.
+            assert await forecaster.check(now_ms=0) is None
+            eta = await forecaster.check(now_ms=60_000)
+            assert eta == pytest.approx(0.11 * total / (0.01 * total / 60), rel=0.01)
+            assert cleanup.await_count == 1
+            target = cleanup.await_args.args[4]
+            assert target > 0
+            await forecaster.check(now_ms=120_000)
+            assert cleanup.await_count == 1
+            conn.close()
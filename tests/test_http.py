@@ -0,0 +1,122 @@
+import asyncio
+import time
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from mautrix.errors import MatrixRequestError
+from catcord_bots.config import FrameworkConfig, RequestPolicy
+from catcord_bots.http import RetryingHTTPAPI, TokenBucket
+from catcord_bots.matrix import create_client
+
+FAST = RequestPolicy(backoff_base=0.01, backoff_max=0.05, rate=1000, burst=1000)
+
+
+class FlakyHomeserver:
+    """Answers /whoami with queued failures before succeeding."""
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+        app = web.Application()
+        app.router.add_get("/_matrix/client/v3/account/whoami", self.whoami)
+        self.server = TestServer(app)
+
+    async def whoami(self, request):
+        self.calls += 1
+        if self.failures:
+            status, body = self.failures.pop(0)
+            return web.json_response(body, status=status)
+        return web.json_response({"user_id": "@bot:x"})
+
+
+async def call_whoami(hs, policy):
+    await hs.server.start_server()
+    session = create_client("@bot:x", str(hs.server.make_url("")).rstrip("/"), "token", policy)
+    try:
+        return await session.client.whoami()
+    finally:
+        await session.close()
+        await hs.server.close()
+
+
+LIMITED = (429, {"errcode": "M_LIMIT_EXCEEDED", "error": "slow down", "retry_after_ms": 50})
+
+
+class TestRetryingHTTPAPI:
+    @pytest.mark.asyncio
+    async def test_retries_429_after_retry_after_ms(self):
+        hs = FlakyHomeserver([LIMITED])
+        start = time.monotonic()
+        me = await call_whoami(hs, FAST)
+        assert str(me.user_id) == "@bot:x"
+        assert hs.calls == 2
+        assert time.monotonic() - start >= 0.05
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_5xx(self):
+        hs = FlakyHomeserver([(502, {}), (503, {"errcode": "M_UNKNOWN", "error": "busy"})])
+        await call_whoami(hs, FAST)
+        assert hs.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_gives_up_and_exposes_retry_after(self):
+        hs = FlakyHomeserver([LIMITED] * 3)
+        policy = RequestPolicy(max_retries=1, backoff_base=0.01, rate=1000, burst=1000)
+        with pytest.raises(MatrixRequestError) as exc:
+            await call_whoami(hs, policy)
+        assert exc.value.http_status == 429
+        assert exc.value.retry_after_ms == 50
+        assert hs.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self):
+        hs = FlakyHomeserver([(403, {"errcode": "M_FORBIDDEN", "error": "no"})])
+        with pytest.raises(MatrixRequestError):
+            await call_whoami(hs, FAST)
+        assert hs.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_shared_bucket_and_pool_limits(self):
+        policy = RequestPolicy(pool_limit=7, pool_limit_per_host=3)
+        a = RetryingHTTPAPI("http://hs.example:8008", "t", policy)
+        b = RetryingHTTPAPI("http://hs.example:8008/", "t", policy)
+        c = RetryingHTTPAPI("http://other.example", "t", policy)
+        try:
+            assert a.bucket is b.bucket and a.bucket is not c.bucket
+            assert a.session.connector.limit == 7
+            assert a.session.connector.limit_per_host == 3
+            assert a.default_retry_count == 0
+        finally:
+            for api in (a, b, c):
+                await api.session.close()
+
+
+class TestTokenBucket:
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        delays = [bucket.reserve() for _ in range(5)]
+        assert delays[:3] == [0.0, 0.0, 0.0]
+        assert 0.05 < delays[3] <= 0.1 < delays[4] <= 0.2
+
+    @pytest.mark.asyncio
+    async def test_penalize_pauses_and_reward_recovers(self):
+        bucket = TokenBucket(rate=100, burst=100)
+        bucket.penalize(0.05)
+        assert bucket.rate == 50
+        start = time.monotonic()
+        await bucket.acquire()
+        assert time.monotonic() - start >= 0.04
+        for _ in range(20):
+            bucket.reward()
+        assert bucket.rate == 100
+
+
+class TestRequestPolicyConfig:
+    def test_from_dict(self):
+        cfg = FrameworkConfig.from_dict({
+            "homeserver_url": "http://hs",
+            "bot": {"mxid": "@bot:x", "access_token": "t"},
+            "http": {"rate": 5, "max_retries": 2},
+        })
+        assert cfg.http.rate == 5.0 and cfg.http.max_retries == 2
+        assert cfg.http.burst == RequestPolicy().burst
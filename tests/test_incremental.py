@@ -0,0 +1,97 @@
+import tempfile
+import time
+import pytest
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock, patch
+from cleaner.cleaner import DAY_MS, Policy, RetentionRule, init_db, rule_case_sql
+from cleaner.scan import scan_media
+from cleaner.incremental import IncrementalRetention, expired_batch, next_expiry
+
+
+def insert(conn, event_id, mimetype, timestamp, media_id="m"):
+    conn.execute(
+        "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (event_id, "!room:example.com", "@u:example.com",
+         f"mxc://example.com/{media_id}", mimetype, 10, timestamp),
+    )
+    conn.commit()
+
+
+class TestIncrementalRetention:
+    def test_next_expiry_per_rule(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            policy = Policy(
+                image_days=90,
+                non_image_days=30,
+                rules=[RetentionRule(mimetype="video/*", max_age_days=14)],
+            )
+            assert next_expiry(conn, policy) == {}
+            insert(conn, "$i", "image/png", 1000)
+            insert(conn, "$v", "video/mp4", 2000)
+            insert(conn, "$d", "application/pdf", 3000)
+            assert next_expiry(conn, policy) == {
+                0: 2000 + 14 * DAY_MS,
+                1: 1000 + 90 * DAY_MS,
+                2: 3000 + 30 * DAY_MS,
+            }
+            conn.close()
+
+    def test_next_expiry_stops_at_oldest_match(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            policy = Policy(rules=[RetentionRule(mimetype="video/*", max_age_days=None)])
+            insert(conn, "$v", "video/mp4", 1000)
+            assert next_expiry(conn, policy) == {}
+            insert(conn, "$d", "application/pdf", 3000)
+            assert next_expiry(conn, policy) == {2: 3000 + 30 * DAY_MS}
+            case_sql, params = rule_case_sql(policy)
+            plan = " ".join(str(r) for r in conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT u.timestamp FROM upload_records u "
+                f"INDEXED BY idx_upload_records_timestamp WHERE ({case_sql}) = ? "
+                f"AND u.timestamp IS NOT NULL ORDER BY u.timestamp LIMIT 1", params + [2],
+            ))
+            assert "TEMP B-TREE" not in plan
+            conn.close()
+
+    def test_expired_batch_respects_rule_cutoffs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            policy = Policy(image_days=90, non_image_days=30)
+            now = 200 * DAY_MS
+            insert(conn, "$old_img", "image/png", now - 100 * DAY_MS)
+            insert(conn, "$new_img", "image/png", now - 40 * DAY_MS)
+            insert(conn, "$old_vid", "video/mp4", now - 40 * DAY_MS)
+            rows = expired_batch(conn, policy, 10, now_ms=now)
+            assert [r[0] for r in rows] == ["$old_vid", "$old_img"]
+            assert len(expired_batch(conn, policy, 1, now_ms=now)) == 1
+            conn.close()
+
+    @pytest.mark.asyncio
+    async def test_expire_due_deletes_in_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            old = int(time.time() * 1000) - 40 * DAY_MS
+            for i in range(5):
+                insert(conn, f"$e{i}", "video/mp4", old + i, media_id=f"vid{i}")
+            (Path(tmpdir) / "vid0").write_bytes(b"x" * 100)
+            session = Mock()
+            session.client.redact = AsyncMock()
+            inc = IncrementalRetention(
+                session, conn, tmpdir, Policy(), batch_size=2, batch_interval=0
+            )
+            with patch("cleaner.cleaner.scan_media", wraps=scan_media) as scan:
+                deleted, freed = await inc.expire_due()
+            assert scan.call_count == 3
+            assert deleted == 5
+            assert freed == 100
+            assert session.client.redact.call_count == 5
+            assert conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+            conn.close()
+
+    def test_note_upload_moves_schedule_forward(self):
+        inc = IncrementalRetention(Mock(), Mock(), "/tmp", Policy())
+        inc.note_upload("!r", "@u", "video/mp4", 10, 1000)
+        assert inc.next_due() == 1000 + 30 * DAY_MS
+        inc.note_upload("!r", "@u", "video/mp4", 10, 5000)
+        assert inc.next_due() == 1000 + 30 * DAY_MS
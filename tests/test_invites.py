@@ -0,0 +1,91 @@
+import asyncio
+import json
+import tempfile
+from unittest.mock import MagicMock
+import pytest
+from catcord_bots.invites import INVITE_FILTER, join_all_invites, list_invites
+
+
+class FakeAPI:
+    """Serves canned sync responses and records requests."""
+
+    def __init__(self, syncs, fail=()):
+        self.syncs = list(syncs)
+        self.fail = set(fail)
+        self.queries = []
+        self.joins = []
+        self.running = 0
+        self.peak = 0
+
+    async def request(self, method, path, query_params=None, content=None):
+        if method == "GET":
+            self.queries.append(query_params)
+            return self.syncs.pop(0)
+        room_id = path.split("/")[-2]
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if room_id in self.fail:
+            raise RuntimeError("forbidden")
+        self.joins.append(room_id)
+        return {}
+
+
+def session_for(api):
+    session = MagicMock()
+    session.client.api = api
+    return session
+
+
+def sync(token, invite=(), join=(), leave=()):
+    return {"next_batch": token, "rooms": {
+        "invite": {r: {} for r in invite},
+        "join": {r: {} for r in join},
+        "leave": {r: {} for r in leave},
+    }}
+
+
+class TestListInvites:
+    @pytest.mark.asyncio
+    async def test_uses_minimal_filter(self):
+        api = FakeAPI([sync("s1", invite=["!a:x"])])
+        assert await list_invites(session_for(api)) == ["!a:x"]
+        query = api.queries[0]
+        assert json.loads(query["filter"]) == INVITE_FILTER
+        assert "since" not in query
+
+    @pytest.mark.asyncio
+    async def test_persists_since_and_pending_invites(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/invites.json"
+            api = FakeAPI([
+                sync("s1", invite=["!a:x", "!b:x"]),
+                sync("s2", invite=["!c:x"], join=["!a:x"]),
+                sync("s3", leave=["!b:x"]),
+            ])
+            session = session_for(api)
+            assert await list_invites(session, path) == ["!a:x", "!b:x"]
+            assert await list_invites(session, path) == ["!b:x", "!c:x"]
+            assert await list_invites(session, path) == ["!c:x"]
+            assert [q.get("since") for q in api.queries] == [None, "s1", "s2"]
+            assert json.load(open(path)) == {"since": "s3", "invites": ["!c:x"]}
+
+
+class TestJoinAllInvites:
+    @pytest.mark.asyncio
+    async def test_joins_concurrently_within_bound(self):
+        rooms = [f"!r{i}:x" for i in range(6)]
+        api = FakeAPI([sync("s1", invite=rooms)])
+        joined = await join_all_invites(session_for(api), concurrency=2)
+        assert joined == rooms
+        assert api.peak == 2
+
+    @pytest.mark.asyncio
+    async def test_allowlist_and_failed_joins_stay_pending(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/invites.json"
+            api = FakeAPI([sync("s1", invite=["!a:x", "!b:x", "!c:x"])], fail={"!b:x"})
+            joined = await join_all_invites(session_for(api), allowlist=["!a:x", "!b:x"], state_path=path)
+            assert joined == ["!a:x"]
+            assert json.load(open(path))["invites"] == ["!b:x", "!c:x"]
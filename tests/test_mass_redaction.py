@@ -0,0 +1,105 @@
+import tempfile
+from pathlib import Path
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from catcord_bots.matrix import create_client
+from cleaner.cleaner import init_db
+from cleaner.outbox import MASS_REDACTION_FEATURE, RedactionOutbox, enqueue_redaction, outbox_size
+
+
+class StubHomeserver:
+    """Records redaction requests the way a homeserver would see them."""
+
+    def __init__(self, mass: bool, accept_mass: bool = True):
+        self.mass = mass
+        self.accept_mass = accept_mass
+        self.batches = []
+        self.singles = []
+        app = web.Application()
+        app.router.add_get("/_matrix/client/versions", self.versions)
+        app.router.add_put("/_matrix/client/v3/rooms/{room}/send/m.room.redaction/{txn}", self.send)
+        app.router.add_put("/_matrix/client/v3/rooms/{room}/redact/{event}/{txn}", self.redact)
+        self.server = TestServer(app)
+
+    async def versions(self, request):
+        return web.json_response({
+            "versions": ["v1.11"],
+            "unstable_features": {MASS_REDACTION_FEATURE: self.mass},
+        })
+
+    async def send(self, request):
+        body = await request.json()
+        if not self.accept_mass:
+            return web.json_response({"errcode": "M_BAD_JSON", "error": "redacts must be a string"}, status=400)
+        self.batches.append((request.match_info["room"], body["redacts"], body.get("reason")))
+        return web.json_response({"event_id": f"$batch{len(self.batches)}"})
+
+    async def redact(self, request):
+        self.singles.append((request.match_info["room"], request.match_info["event"]))
+        return web.json_response({"event_id": f"$single{len(self.singles)}"})
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        yield conn
+        conn.close()
+
+
+async def drain_against(hs: StubHomeserver, conn, **kwargs) -> int:
+    await hs.server.start_server()
+    session = create_client("@cleaner:x", str(hs.server.make_url("")).rstrip("/"), "token")
+    try:
+        return await RedactionOutbox(session, conn, min_interval=0, **kwargs).drain()
+    finally:
+        await session.close()
+        await hs.server.close()
+
+
+def fill(conn):
+    for i in range(5):
+        enqueue_redaction(conn, f"$a{i}", "!a:x", "Catcord cleanup: pressure")
+    for i in range(2):
+        enqueue_redaction(conn, f"$b{i}", "!b:x", "Catcord cleanup: pressure")
+    conn.commit()
+
+
+class TestMassRedaction:
+    @pytest.mark.asyncio
+    async def test_batches_by_room_when_supported(self, db):
+        fill(db)
+        hs = StubHomeserver(mass=True)
+        assert await drain_against(hs, db, mass_batch=3) == 0
+        assert hs.singles == []
+        rooms = [room for room, _, _ in hs.batches]
+        assert sorted(rooms) == ["!a:x", "!a:x", "!b:x"]
+        sent = sorted(e for _, ids, _ in hs.batches for e in ids)
+        assert sent == sorted([f"$a{i}" for i in range(5)] + ["$b0", "$b1"])
+        assert all(reason == "Catcord cleanup: pressure" for _, _, reason in hs.batches)
+
+    @pytest.mark.asyncio
+    async def test_per_event_without_capability(self, db):
+        fill(db)
+        hs = StubHomeserver(mass=False)
+        assert await drain_against(hs, db) == 0
+        assert hs.batches == []
+        assert len(hs.singles) == 7
+
+    @pytest.mark.asyncio
+    async def test_falls_back_when_batch_rejected(self, db):
+        fill(db)
+        hs = StubHomeserver(mass=True, accept_mass=False)
+        assert await drain_against(hs, db) == 0
+        assert hs.batches == []
+        assert len(hs.singles) == 7
+        assert outbox_size(db) == 0
+
+    @pytest.mark.asyncio
+    async def test_mass_batch_zero_never_probes(self, db):
+        fill(db)
+        hs = StubHomeserver(mass=True)
+        assert await drain_against(hs, db, mass_batch=0) == 0
+        assert hs.batches == []
+        assert len(hs.singles) == 7
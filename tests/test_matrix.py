@@ -1,6 +1,12 @@
+import sys
+import tempfile
+import types
 import pytest
-from unittest.mock import Mock, AsyncMock
-from catcord_bots.matrix import MatrixSession
+from unittest.mock import Mock, AsyncMock, MagicMock, patch
+from mautrix.types import (
+    EncryptionAlgorithm, Member, Membership, RoomEncryptionStateEventContent, RoomID, UserID,
+)
+from catcord_bots.matrix import MatrixSession, create_client_e2ee, open_state_store, whoami
 
 
 class TestMatrix:
@@ -12,3 +18,96 @@ class TestMatrix:
         session = MatrixSession(api=mock_api, client=Mock())
         await session.close()
         mock_api.session.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_whoami_uses_resolved_user_id(self):
+        client = Mock(whoami=AsyncMock(return_value=Mock(user_id="@bot:x")))
+        assert await whoami(MatrixSession(api=Mock(), client=client)) == "@bot:x"
+        assert await whoami(MatrixSession(api=Mock(), client=client, user_id="@bot:x")) == "@bot:x"
+        assert client.whoami.await_count == 1
+
+
+class TestStateStore:
+    @pytest.mark.asyncio
+    async def test_memory_store_has_find_shared_rooms(self):
+        store, db = await open_state_store({"state_store": {"type": "memory"}}, "")
+        assert db is None
+        assert await store.find_shared_rooms("@u:x") == []
+
+    @pytest.mark.asyncio
+    async def test_sqlite_store_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = {"state_store": {"type": "sqlite", "path": f"{tmpdir}/state.db"}}
+            store, db = await open_state_store(cfg, "")
+            await store.set_encryption_info(RoomID("!r:x"), RoomEncryptionStateEventContent(
+                algorithm=EncryptionAlgorithm.MEGOLM_V1
+            ))
+            await store.set_members(
+                RoomID("!r:x"), {UserID("@u:x"): Member(membership=Membership.JOIN)}
+            )
+            await db.stop()
+
+            store, db = await open_state_store(cfg, "")
+            try:
+                assert await store.has_full_member_list(RoomID("!r:x"))
+                assert await store.is_encrypted(RoomID("!r:x"))
+                assert await store.find_shared_rooms(UserID("@u:x")) == ["!r:x"]
+            finally:
+                await db.stop()
+
+    @pytest.mark.asyncio
+    async def test_rejects_unknown_type(self):
+        with pytest.raises(ValueError):
+            await open_state_store({"state_store": {"type": "redis"}}, "")
+
+
+class TestE2EEStartup:
+    @pytest.mark.asyncio
+    async def test_warm_start_skips_cached_work(self):
+        # Stand-ins for the olm-backed modules, so this runs without libolm.
+        crypto_mod = types.ModuleType("mautrix.crypto")
+        store_mod = types.ModuleType("mautrix.crypto.store")
+        store_cls = MagicMock()
+        store_cls.upgrade_table.upgrades = [object()] * 3
+        store_cls.return_value.open = AsyncMock()
+        store_cls.return_value.put_device_id = AsyncMock()
+        db = MagicMock(start=AsyncMock(), stop=AsyncMock())
+        create_db = MagicMock(return_value=db)
+        machine = MagicMock(load=AsyncMock(), share_keys=AsyncMock())
+        machine.account.shared = False
+        client = MagicMock(whoami=AsyncMock(return_value=Mock(user_id="@bot:x", device_id="DEV")))
+        crypto_mod.OlmMachine = MagicMock(return_value=machine)
+        store_mod.PgCryptoStore = store_cls
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                patch.dict(sys.modules, {"mautrix.crypto": crypto_mod, "mautrix.crypto.store": store_mod}), \
+                patch("mautrix.util.async_db.Database.create", create_db), \
+                patch("catcord_bots.matrix.Client", MagicMock(return_value=client)):
+            cfg = {
+                "postgres": {"host": "db", "username": "u", "password": "p", "database": "d"},
+                "pickle_key": "k",
+                "state_store": {"type": "memory"},
+                "startup_cache": f"{tmpdir}/startup.json",
+                "debug_timing": True,
+            }
+            cold = await create_client_e2ee("@bot:x", "http://hs", "token", cfg)
+            await cold.close()
+            assert client.whoami.await_count == 1
+            assert machine.share_keys.await_count == 1
+            assert create_db.call_args.kwargs["upgrade_table"] is store_cls.upgrade_table
+            assert (cold.user_id, cold.device_id) == ("@bot:x", "DEV")
+
+            machine.account.shared = True
+            warm = await create_client_e2ee("@bot:x", "http://hs", "token", cfg)
+            await warm.close()
+            assert client.whoami.await_count == 1
+            assert machine.share_keys.await_count == 1
+            assert create_db.call_args.kwargs["upgrade_table"] is None
+            assert client.device_id == "DEV"
+            assert (warm.user_id, warm.device_id) == ("@bot:x", "DEV")
+            assert await whoami(warm) == "@bot:x"
+            assert client.whoami.await_count == 1
+
+            # A new access token invalidates the cache.
+            await (await create_client_e2ee("@bot:x", "http://hs", "other", cfg)).close()
+            assert client.whoami.await_count == 2
@@ -1,7 +1,8 @@
 """Tests for news bot."""
 import pytest
 from news.format import format_digest
-from news.state import payload_fingerprint, should_send
+from news.state import payload_fingerprint
+from catcord_bots.state import StateStore, should_send
 import tempfile
 import os
 import sys
@@ -94,21 +95,21 @@ def test_payload_fingerprint_changes():
 def test_should_send_first_time():
     """Test should send on first run."""
     with tempfile.TemporaryDirectory() as tmpdir:
-        state_path = os.path.join(tmpdir, "test.fp")
-        assert should_send(state_path, "abc123", False)
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        assert should_send("digest", "abc123", False, store=store)
 
 
 def test_should_send_dedupe():
     """Test deduplication works."""
     with tempfile.TemporaryDirectory() as tmpdir:
-        state_path = os.path.join(tmpdir, "test.fp")
-        assert should_send(state_path, "abc123", False)
-        assert not should_send(state_path, "abc123", False)
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        assert should_send("digest", "abc123", False, store=store)
+        assert not should_send("digest", "abc123", False, store=store)
 
 
 def test_should_send_force():
     """Test force override works."""
     with tempfile.TemporaryDirectory() as tmpdir:
-        state_path = os.path.join(tmpdir, "test.fp")
-        should_send(state_path, "abc123", False)
-        assert should_send(state_path, "abc123", True)
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        should_send("digest", "abc123", False, store=store)
+        assert should_send("digest", "abc123", True, store=store)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import tempfile
+from unittest.mock import AsyncMock, Mock
+import pytest
+from catcord_bots.config import OutboundConfig
+from catcord_bots.matrix import MatrixSession, notify, send_text
+from catcord_bots.outbound import OutboundQueue
+from catcord_bots.state import StateStore
+
+
+@pytest.fixture
+def store():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        yield store
+        store.close()
+
+
+def make_session(send=None):
+    client = Mock()
+    client.send_text = send or AsyncMock()
+    return MatrixSession(api=Mock(), client=client)
+
+
+def sent_bodies(session):
+    return [(str(c.args[0]), c.args[1]) for c in session.client.send_text.await_args_list]
+
+
+FAST = OutboundConfig(window=0.02, min_interval=0.0)
+
+
+class TestOutboundQueue:
+    @pytest.mark.asyncio
+    async def test_coalesces_per_room_within_window(self, store):
+        session = make_session()
+        queue = OutboundQueue(session, FAST, store=store)
+        for i in range(5):
+            queue.enqueue("!a:x", f"a{i}")
+        queue.enqueue("!b:x", "b0")
+        await asyncio.sleep(0.1)
+        assert sorted(sent_bodies(session)) == [("!a:x", "a0\n\na1\n\na2\n\na3\n\na4"), ("!b:x", "b0")]
+        assert queue.pending() == 0
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_send_text_routes_through_queue(self, store):
+        session = make_session()
+        session.outbound = OutboundQueue(session, FAST, store=store)
+        await send_text(session, "!a:x", "one")
+        await send_text(session, "!a:x", "two")
+        session.client.send_text.assert_not_awaited()
+        await session.outbound.close()
+        assert sent_bodies(session) == [("!a:x", "one\n\ntwo")]
+
+    @pytest.mark.asyncio
+    async def test_min_interval_spaces_sends(self, store):
+        session = make_session()
+        queue = OutboundQueue(session, OutboundConfig(window=0.0, min_interval=0.1), store=store)
+        queue.enqueue("!a:x", "first")
+        await asyncio.sleep(0.02)
+        queue.enqueue("!a:x", "second")
+        await asyncio.sleep(0.03)
+        assert sent_bodies(session) == [("!a:x", "first")]
+        await asyncio.sleep(0.12)
+        assert sent_bodies(session) == [("!a:x", "first"), ("!a:x", "second")]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_splits_at_max_chars(self, store):
+        session = make_session()
+        queue = OutboundQueue(session, OutboundConfig(window=10, max_chars=10), store=store)
+        for body in ["aaaa", "bbbb", "cccc"]:
+            queue.enqueue("!a:x", body)
+        assert await queue.flush("!a:x") == 2
+        assert [b for _, b in sent_bodies(session)] == ["aaaa\n\nbbbb", "cccc"]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_unsent_messages_survive_restart(self, store):
+        first = OutboundQueue(make_session(), OutboundConfig(window=10), store=store)
+        first.enqueue("!a:x", "queued")
+        await first.close(flush=False)
+
+        session = make_session()
+        second = OutboundQueue(session, FAST, store=store)
+        assert second.start() == 1
+        await asyncio.sleep(0.1)
+        assert sent_bodies(session) == [("!a:x", "queued")]
+
+    @pytest.mark.asyncio
+    async def test_failed_send_is_retried(self, store):
+        send = AsyncMock(side_effect=[RuntimeError("502"), None])
+        session = make_session(send)
+        failures = []
+        queue = OutboundQueue(session, FAST, store=store, retry_delay=0.02,
+                              on_failure=lambda room, e, n: failures.append((room, str(e), n)))
+        queue.enqueue("!a:x", "hello")
+        await asyncio.sleep(0.03)
+        assert queue.pending() == 1
+        assert queue.failed == 1 and queue.last_error == "!a:x: 502"
+        assert failures == [("!a:x", "502", 1)]
+        await asyncio.sleep(0.1)
+        assert queue.pending() == 0 and send.await_count == 2
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_notify_logs_queued_and_close_reports_undelivered(self, store, capsys):
+        session = make_session(AsyncMock(side_effect=RuntimeError("down")))
+        session.outbound = OutboundQueue(session, OutboundConfig(window=10), store=store)
+        assert await notify(session, "!a:x", "hello")
+        assert "Queued message for !a:x" in capsys.readouterr().out
+        await session.outbound.close()
+        out = capsys.readouterr().out
+        assert "Outbound send of 1 messages to !a:x failed" in out
+        assert "1 messages to !a:x not delivered" in out
+        assert session.outbound.pending() == 1
+
+    @pytest.mark.asyncio
+    async def test_notify_without_queue_logs_send_errors(self, capsys):
+        session = make_session(AsyncMock(side_effect=RuntimeError("down")))
+        assert not await notify(session, "!a:x", "hello", what="digest")
+        assert "Failed to send digest to !a:x: down" in capsys.readouterr().out
+
+    @pytest.mark.asyncio
+    async def test_other_process_lease_is_respected(self, store):
+        other = OutboundQueue(make_session(), OutboundConfig(window=10), store=store)
+        other.enqueue("!a:x", "mine")
+        assert len(other._claim("!a:x")) == 1
+        session = make_session()
+        queue = OutboundQueue(session, OutboundConfig(window=10), store=store)
+        assert await queue.flush("!a:x") == 0
+        session.client.send_text.assert_not_awaited()
+        await other.close()
+        await queue.close()
@@ -0,0 +1,133 @@
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from mautrix.errors import MLimitExceeded, MNotFound
+from cleaner.cleaner import delete_upload, expire_upload, init_db, policy_from_config
+from cleaner.outbox import RedactionOutbox, enqueue_redaction, outbox_size
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        yield conn, Path(tmpdir)
+        conn.close()
+
+
+def session_with(redact):
+    session = MagicMock()
+    session.client.redact = redact
+    return session
+
+
+class TestRedactionOutbox:
+    @pytest.mark.asyncio
+    async def test_deferred_delete_unlinks_without_network(self, db):
+        conn, root = db
+        media = root / "media"
+        media.mkdir()
+        (media / "idvid").write_bytes(b"x" * 100)
+        conn.execute("INSERT INTO uploads VALUES ('$v', '!r:x', '@u:x', 'mxc://x/idvid', 'video/mp4', 100, 0)")
+        conn.commit()
+        redact = AsyncMock()
+        freed = await delete_upload(session_with(redact), conn, str(media), "$v", "!r:x",
+                                    "mxc://x/idvid", "emergency", defer_redaction=True)
+        assert freed == 100
+        assert not (media / "idvid").exists()
+        redact.assert_not_called()
+        assert conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+        row = conn.execute("SELECT event_id, room_id, reason FROM redaction_outbox").fetchone()
+        assert row == ("$v", "!r:x", "Catcord cleanup: emergency")
+
+    @pytest.mark.asyncio
+    async def test_expire_upload_follows_policy(self, db):
+        conn, root = db
+        conn.execute("INSERT INTO uploads VALUES ('$v', '!r:x', '@u:x', 'mxc://x/idvid', 'video/mp4', 1, 0)")
+        conn.commit()
+        redact = AsyncMock()
+        policy = policy_from_config({"policy": {"redaction_outbox": {"enabled": True}}})
+        assert policy.redaction_outbox
+        await expire_upload(session_with(redact), conn, str(root), policy, 1,
+                            "$v", "!r:x", "mxc://x/idvid", 0, "pressure")
+        redact.assert_not_called()
+        assert outbox_size(conn) == 1
+
+    @pytest.mark.asyncio
+    async def test_drain_sends_and_drops_permanent_failures(self, db):
+        conn, _ = db
+        enqueue_redaction(conn, "$a", "!r:x", "r")
+        enqueue_redaction(conn, "$gone", "!r:x", "r")
+        conn.commit()
+
+        async def redact(room_id, event_id, reason=None):
+            if event_id == "$gone":
+                raise MNotFound(404, "not found")
+
+        outbox = RedactionOutbox(session_with(AsyncMock(side_effect=redact)), conn, min_interval=0)
+        assert await outbox.drain() == 0
+
+    @pytest.mark.asyncio
+    async def test_failures_back_off(self, db):
+        conn, _ = db
+        enqueue_redaction(conn, "$a", "!r:x", "r")
+        conn.commit()
+        redact = AsyncMock(side_effect=MLimitExceeded(429, "slow down"))
+        outbox = RedactionOutbox(session_with(redact), conn, min_interval=0, base_delay=60)
+        assert await outbox.send_one() == 60
+        assert await outbox.send_one() is None
+        attempts, err = conn.execute("SELECT attempts, last_error FROM redaction_outbox").fetchone()
+        assert attempts == 1 and "slow down" in err
+        assert redact.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_drain_respects_deadline(self, db):
+        conn, _ = db
+        for i in range(3):
+            enqueue_redaction(conn, f"${i}", "!r:x", "r")
+        conn.commit()
+        redact = AsyncMock()
+        outbox = RedactionOutbox(session_with(redact), conn, min_interval=10)
+        assert await outbox.drain(deadline=time.monotonic() + 0.05) == 2
+        assert redact.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_drainers_never_send_a_row_twice(self, db):
+        conn, tmpdir = db
+        for i in range(20):
+            enqueue_redaction(conn, f"${i}", "!r:x", "r")
+        conn.commit()
+        sent = []
+
+        async def redact(room_id, event_id, reason=None):
+            sent.append(event_id)
+            await asyncio.sleep(0.001)
+
+        other = init_db(f"{tmpdir}/uploads.db")
+        drainers = [
+            RedactionOutbox(session_with(AsyncMock(side_effect=redact)), c, min_interval=0, mass_batch=0)
+            for c in (conn, other)
+        ]
+        await asyncio.gather(*(d.drain() for d in drainers))
+        other.close()
+        assert sorted(sent) == sorted(f"${i}" for i in range(20))
+        assert outbox_size(conn) == 0
+
+    @pytest.mark.asyncio
+    async def test_claimed_rows_wait_for_the_lease(self, db):
+        conn, _ = db
+        enqueue_redaction(conn, "$a", "!r:x", "r")
+        conn.commit()
+        first = RedactionOutbox(session_with(AsyncMock()), conn, mass_batch=0)
+        assert [r[0] for r in first._claim(10)] == ["$a"]
+        second = RedactionOutbox(session_with(AsyncMock()), conn, mass_batch=0)
+        assert await second.send_one() is None
+        first._release(["$a"])
+        assert await second.send_one() is not None and outbox_size(conn) == 0
+
+    def test_failed_with_no_rows(self, db):
+        conn, _ = db
+        outbox = RedactionOutbox(session_with(AsyncMock()), conn, min_interval=0.5)
+        assert outbox._failed([], RuntimeError("boom")) == 0.5
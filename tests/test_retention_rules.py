@@ -0,0 +1,72 @@
+import tempfile
+from cleaner.cleaner import (
+    DAY_MS, Policy, RetentionRule, compile_retention_query, init_db, iter_expired,
+    policy_from_config,
+)
+
+NOW = 1000 * DAY_MS
+
+
+def insert(conn, event_id, mimetype, age_days, room="!a:example.com",
+           sender="@u:example.com", size=10):
+    conn.execute(
+        "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (event_id, room, sender, f"mxc://example.com/{event_id[1:]}", mimetype, size,
+         NOW - age_days * DAY_MS),
+    )
+    conn.commit()
+
+
+class TestRetentionRules:
+    def test_policy_from_config_parses_rules(self):
+        policy = policy_from_config({"policy": {
+            "retention_days": {"image": 60},
+            "rules": [
+                {"mimetype": "video/*", "max_age_days": 14},
+                {"room": "!keep:example.com", "max_age_days": None},
+            ],
+        }})
+        assert policy.image_days == 60
+        assert policy.rules[0] == RetentionRule(mimetype="video/*", max_age_days=14)
+        assert policy.rules[1].room == "!keep:example.com"
+        assert policy.rules[1].max_age_days is None
+        assert len(policy.effective_rules()) == 4
+
+    def test_default_policy_matches_legacy_behaviour(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            insert(conn, "$img_old", "image/png", 100)
+            insert(conn, "$img_new", "image/png", 50)
+            insert(conn, "$doc_old", "application/pdf", 40)
+            insert(conn, "$doc_new", "application/pdf", 10)
+            ids = [r[0] for r in iter_expired(conn, Policy(), now_ms=NOW)]
+            assert ids == ["$doc_old", "$img_old"]
+            conn.close()
+
+    def test_rules_first_match_wins(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            policy = Policy(rules=[
+                RetentionRule(room="!keep:example.com", max_age_days=None),
+                RetentionRule(mimetype="video/*", max_age_days=14),
+                RetentionRule(mimetype="application/*", max_age_days=60),
+                RetentionRule(sender="@spam:example.com", min_size=1000, max_age_days=1),
+            ])
+            insert(conn, "$vid", "video/mp4", 20)
+            insert(conn, "$vid_kept", "video/mp4", 500, room="!keep:example.com")
+            insert(conn, "$doc", "application/pdf", 40)
+            insert(conn, "$big_spam", "text/plain", 2, sender="@spam:example.com", size=5000)
+            insert(conn, "$small_spam", "text/plain", 2, sender="@spam:example.com", size=5)
+            ids = sorted(r[0] for r in iter_expired(conn, policy, now_ms=NOW))
+            assert ids == ["$big_spam", "$vid"]
+            assert policy.rule_for("!a", "@u", "video/webm", 1) == 1
+            conn.close()
+
+    def test_query_reads_expiry_index_in_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = init_db(f"{tmpdir}/uploads.db")
+            sql, params = compile_retention_query(Policy(), NOW, limit=20)
+            plan = " ".join(str(r) for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+            assert "idx_upload_records_expiry" in plan
+            assert "TEMP B-TREE FOR ORDER BY" not in plan
+            conn.close()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from pathlib import Path
+from cleaner.cleaner import count_media_files
+from cleaner.scan import MediaFile, scan_media
+
+
+def make_tree(root):
+    expected = {}
+    for shard in ("ab", "cd"):
+        for sub in ("01", "02"):
+            d = Path(root) / "local_content" / shard / sub
+            d.mkdir(parents=True)
+            for i in range(3):
+                p = d / f"file{i}"
+                p.write_bytes(b"x" * (i + 1))
+                expected[str(p)] = i + 1
+    return expected
+
+
+class TestScan:
+    def test_scan_media_matches_os_walk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            expected = make_tree(tmpdir)
+            found = {f.path: f.size for f in scan_media(tmpdir, workers=4)}
+            assert found == expected
+            walked = sum(len(files) for _, _, files in os.walk(tmpdir))
+            assert count_media_files(tmpdir) == walked == len(expected)
+
+    def test_scan_media_records_mtime(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            p = Path(tmpdir) / "a"
+            p.write_bytes(b"abc")
+            os.utime(p, (100, 200))
+            assert list(scan_media(tmpdir)) == [MediaFile(str(p), 3, 200.0)]
+
+    def test_scan_media_missing_root_and_early_stop(self):
+        assert list(scan_media("/nonexistent/media/root")) == []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_tree(tmpdir)
+            gen = scan_media(tmpdir, workers=2)
+            next(gen)
+            gen.close()
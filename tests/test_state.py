@@ -1,7 +1,16 @@
 import pytest
 import tempfile
 import os
-from catcord_bots.state import payload_fingerprint, should_send
+import time
+from catcord_bots.state import StateStore, payload_fingerprint, should_send
+
+
+@pytest.fixture
+def store():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = StateStore(os.path.join(tmpdir, "state.db"))
+        yield store
+        store.close()
 
 
 class TestState:
@@ -17,23 +26,64 @@ class TestState:
         p2 = {"mode": "retention", "actions": {"deleted_count": 6}}
         assert payload_fingerprint(p1) != payload_fingerprint(p2)
 
-    def test_should_send_first_time(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            state_path = os.path.join(tmpdir, "test.fp")
-            fp = "abc123"
-            assert should_send(state_path, fp, False)
-            assert os.path.exists(state_path)
-
-    def test_should_send_dedupe(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            state_path = os.path.join(tmpdir, "test.fp")
-            fp = "abc123"
-            should_send(state_path, fp, False)
-            assert not should_send(state_path, fp, False)
-
-    def test_should_send_print_effective_config_override(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            state_path = os.path.join(tmpdir, "test.fp")
-            fp = "abc123"
-            should_send(state_path, fp, False)
-            assert should_send(state_path, fp, True)
+    def test_should_send_first_time(self, store):
+        assert should_send("retention", "abc123", False, store=store)
+        assert store.get("fingerprint:retention") == "abc123"
+
+    def test_should_send_dedupe(self, store):
+        should_send("retention", "abc123", False, store=store)
+        assert not should_send("retention", "abc123", False, store=store)
+        assert should_send("pressure", "abc123", False, store=store)
+
+    def test_should_send_print_effective_config_override(self, store):
+        should_send("retention", "abc123", False, store=store)
+        assert should_send("retention", "abc123", True, store=store)
+
+    def test_should_send_ttl_expires(self, store):
+        assert should_send("retention", "abc123", False, store=store, ttl=0.01)
+        time.sleep(0.02)
+        assert should_send("retention", "abc123", False, store=store, ttl=0.01)
+
+
+class TestStateStore:
+    def test_get_set_delete_and_ttl(self, store):
+        assert store.get("k") is None
+        store.set("k", "v")
+        assert store.get("k") == "v"
+        store.set("t", "v", ttl=0.01)
+        time.sleep(0.02)
+        assert store.get("t") is None
+        store.delete("k")
+        assert store.get("k") is None
+
+    def test_compare_and_set(self, store):
+        assert store.compare_and_set("k", None, "a")
+        assert not store.compare_and_set("k", None, "b")
+        assert store.compare_and_set("k", "a", "b")
+        assert store.get("k") == "b"
+        assert store.compare_and_set("k", "b", None)
+        assert store.get("k") is None
+
+    def test_processes_share_the_file(self, store):
+        other = StateStore(store.path, cache_ttl=0)
+        assert should_send("digest", "fp1", False, store=store)
+        assert not should_send("digest", "fp1", False, store=other)
+        assert other.compare_and_set("k", None, "x")
+        # The first store's cache never serves stale data to compare_and_set.
+        assert not store.compare_and_set("k", None, "y")
+        other.close()
+
+    def test_history_is_pruned(self, store):
+        store.history_size = 3
+        for fp in ["a", "b", "b", "c", "d"]:
+            should_send("retention", fp, False, store=store)
+        assert [fp for fp, _ in store.fingerprint_history("retention")] == ["d", "c", "b"]
+        assert store.fingerprint_history("pressure") == []
+
+    def test_imports_legacy_files(self, store):
+        state_dir = os.path.dirname(store.path)
+        with open(os.path.join(state_dir, "retention_last.fp"), "w") as f:
+            f.write("old\n")
+        assert store.import_legacy_fingerprints(state_dir) == ["retention"]
+        assert not should_send("retention", "old", False, store=store)
+        assert os.path.exists(os.path.join(state_dir, "retention_last.fp.migrated"))
@@ -0,0 +1,122 @@
+import tempfile
+from unittest.mock import AsyncMock, patch
+import pytest
+from cleaner.cleaner import init_db
+from cleaner.accounting import MediaAccounting
+from cleaner.db import MIGRATIONS, connect, migrate
+from cleaner.stats import format_usage_report, run_stats, usage_report
+
+JAN = 1704067200000  # 2024-01-01
+FEB = 1706745600000  # 2024-02-01
+
+
+@pytest.fixture
+def conn():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = init_db(f"{tmpdir}/uploads.db")
+        yield conn
+        conn.close()
+
+
+def insert(conn, event_id, room, sender, mimetype, size, ts):
+    conn.execute(
+        "INSERT OR IGNORE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (event_id, room, sender, f"mxc://x/{event_id[1:]}", mimetype, size, ts),
+    )
+    conn.commit()
+
+
+def aggregates(conn):
+    return {
+        t: conn.execute(f"SELECT * FROM {t} ORDER BY 1").fetchall()
+        for t in ("usage_by_room", "usage_by_sender", "usage_by_class", "usage_by_month")
+    }
+
+
+def recomputed(conn):
+    """Aggregates rebuilt from scratch, for comparison with the triggers."""
+    class_sql = (
+        "COALESCE(NULLIF(CASE WHEN instr(mimetype, '/') > 0 "
+        "THEN substr(mimetype, 1, instr(mimetype, '/') - 1) ELSE mimetype END, ''), 'unknown')"
+    )
+    return {
+        "usage_by_room": conn.execute(
+            "SELECT COALESCE(room, 0), SUM(COALESCE(size, 0)), COUNT(*) FROM upload_records GROUP BY 1 ORDER BY 1"
+        ).fetchall(),
+        "usage_by_sender": conn.execute(
+            "SELECT COALESCE(sender, 0), SUM(COALESCE(size, 0)), COUNT(*) FROM upload_records GROUP BY 1 ORDER BY 1"
+        ).fetchall(),
+        "usage_by_class": conn.execute(
+            f"SELECT {class_sql}, SUM(COALESCE(size, 0)), COUNT(*) FROM uploads GROUP BY 1 ORDER BY 1"
+        ).fetchall(),
+        "usage_by_month": conn.execute(
+            "SELECT strftime('%Y-%m', timestamp / 1000, 'unixepoch'), SUM(COALESCE(size, 0)), COUNT(*) "
+            "FROM uploads GROUP BY 1 ORDER BY 1"
+        ).fetchall(),
+    }
+
+
+class TestUsageAggregates:
+    def test_triggers_track_inserts_and_deletes(self, conn):
+        insert(conn, "$a", "!r:x", "@u:x", "image/png", 100, JAN)
+        insert(conn, "$b", "!r:x", "@v:x", "video/mp4", 1000, FEB)
+        insert(conn, "$c", "!s:x", "@u:x", None, 10, FEB)
+        insert(conn, "$a", "!r:x", "@u:x", "image/png", 100, JAN)  # ignored duplicate
+        assert aggregates(conn) == recomputed(conn)
+        conn.execute("DELETE FROM uploads WHERE event_id = '$b'")
+        conn.commit()
+        assert aggregates(conn) == recomputed(conn)
+        classes = dict((c, b) for c, b, _ in aggregates(conn)["usage_by_class"])
+        assert classes == {"image": 100, "unknown": 10}
+
+    def test_migration_seeds_existing_uploads(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/uploads.db"
+            old = connect(path)
+            for statements in MIGRATIONS[:8]:
+                for statement in statements:
+                    old.execute(statement)
+            old.execute("PRAGMA user_version = 8")
+            insert(old, "$a", "!r:x", "@u:x", "image/png", 100, JAN)
+            insert(old, "$b", "!r:x", "@u:x", "audio/ogg", 5, FEB)
+            migrate(old)
+            assert aggregates(old) == recomputed(old)
+            old.close()
+
+
+class TestUsageReport:
+    def test_report_ranks_by_bytes(self, conn):
+        insert(conn, "$a", "!small:x", "@u:x", "image/png", 10, JAN)
+        insert(conn, "$b", "!big:x", "@v:x", "video/mp4", 1000, FEB)
+        insert(conn, "$c", "!big:x", "@v:x", "video/mp4", 1000, FEB)
+        report = usage_report(conn, top=1)
+        assert report.total_bytes == 2010 and report.total_count == 3
+        assert report.rooms == [("!big:x", 2000, 2)]
+        assert report.senders == [("@v:x", 2000, 2)]
+        assert report.months == [("2024-02", 2000, 2), ("2024-01", 10, 1)]
+        text = format_usage_report(report)
+        assert "!big:x: 2.0 KiB (2 files)" in text
+        assert "!small:x" not in text
+
+    def test_classes_match_live_accounting(self, conn, tmp_path):
+        rows = [
+            ("$a", "image/png", 10), ("$b", "application/pdf", 20),
+            ("$c", "text/plain", 30), ("$d", None, 40), ("$e", "audio/ogg", 5),
+        ]
+        acc = MediaAccounting(str(tmp_path))
+        for event_id, mimetype, size in rows:
+            insert(conn, event_id, "!r:x", "@u:x", mimetype, size, JAN)
+            acc.note_upload(f"mxc://x/{event_id[1:]}", "!r:x", mimetype)
+        report = usage_report(conn)
+        assert report.classes == [("other", 90, 3), ("image", 10, 1), ("audio", 5, 1)]
+        assert {c for c, _, _ in report.classes} == {c for _, c in acc.uploads.values()}
+
+    @pytest.mark.asyncio
+    async def test_run_stats_sends_unless_dry_run(self, conn):
+        insert(conn, "$a", "!r:x", "@u:x", "image/png", 10, JAN)
+        with patch("cleaner.stats.notify", new=AsyncMock()) as send:
+            await run_stats(None, conn, "!log:x", dry_run=True)
+            send.assert_not_called()
+            await run_stats(None, conn, "!log:x")
+            send.assert_awaited_once()
+            assert "uploads: 1" in send.await_args.args[2]
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import tempfile
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from mautrix.types import EventFilter, Filter
+from catcord_bots.sync import SyncRunner
+
+
+class FakeClient:
+    """Serves canned sync responses and records the since tokens it was asked for."""
+
+    def __init__(self, responses, on_sync=None):
+        self.responses = list(responses)
+        self.since = []
+        self.on_sync = on_sync
+        self.create_filter = AsyncMock(return_value="F1")
+        self.handlers = []
+        self.batch_tasks = []
+
+    def add_event_handler(self, event_type, handler, wait_sync=False):
+        self.handlers.append(handler)
+
+    async def sync(self, since=None, timeout=None, filter_id=None, full_state=False):
+        self.since.append(since)
+        if self.on_sync:
+            await self.on_sync(len(self.since))
+        if not self.responses:
+            await asyncio.Event().wait()
+        item = self.responses.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def handle_sync(self, data):
+        tasks = [asyncio.ensure_future(h(data)) for h in self.handlers]
+        self.batch_tasks.append(tasks)
+        return tasks
+
+
+def batch(token):
+    return {"next_batch": token, "account_data": {"events": [1]}, "rooms": {"join": {}}}
+
+
+def runner_for(client, **kwargs):
+    session = MagicMock()
+    session.client = client
+    return SyncRunner(session, **kwargs)
+
+
+async def run_until(runner, client, syncs):
+    task = asyncio.create_task(runner.run())
+    while len(client.since) < syncs:
+        await asyncio.sleep(0.001)
+    runner.stop()
+    await asyncio.wait_for(task, 1)
+
+
+FILTER = Filter(presence=EventFilter(not_types=["*"]))
+
+
+class TestSyncRunner:
+    @pytest.mark.asyncio
+    async def test_persists_since_and_filter_id(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/sync.json"
+            client = FakeClient([batch("s1"), batch("s2")])
+            runner = runner_for(client, sync_filter=FILTER, state_path=path)
+            await run_until(runner, client, 3)
+            assert client.since == [None, "s1", "s2"]
+            assert json.load(open(path))["since"] == "s2"
+
+            client = FakeClient([batch("s3")])
+            runner = runner_for(client, sync_filter=FILTER, state_path=path)
+            await run_until(runner, client, 1)
+            client.create_filter.assert_not_awaited()
+            assert runner.filter_id == "F1" and client.since[0] == "s2"
+
+            other = Filter(presence=EventFilter(not_types=["m.presence"]))
+            client = FakeClient([])
+            runner = runner_for(client, sync_filter=other, state_path=path)
+            await run_until(runner, client, 1)
+            client.create_filter.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_backs_off_after_errors(self):
+        client = FakeClient([RuntimeError("502"), RuntimeError("502"), batch("s1")])
+        runner = runner_for(client, backoff_base=0.01)
+        timings = []
+        runner.add_timing_hook(timings.append)
+        await run_until(runner, client, 4)
+        assert client.since == [None, None, None, "s1"]
+        assert [t.iteration for t in timings] == [1]
+
+    @pytest.mark.asyncio
+    async def test_token_waits_for_handlers_and_backpressure(self):
+        release = asyncio.Event()
+        started = []
+
+        async def slow(data):
+            started.append(data["next_batch"])
+            await release.wait()
+
+        client = FakeClient([batch("s1"), batch("s2"), batch("s3")])
+        runner = runner_for(client, max_pending=1)
+        client.add_event_handler(None, slow)
+        task = asyncio.create_task(runner.run())
+        while len(started) < 2:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+        # Two handlers pending > max_pending: no third sync, nothing committed.
+        assert client.since == [None, "s1"]
+        assert runner.since is None
+        release.set()
+        while len(client.since) < 4:
+            await asyncio.sleep(0.001)
+        runner.stop()
+        await asyncio.wait_for(task, 1)
+        assert runner.since == "s3"
+
+    @pytest.mark.asyncio
+    async def test_handler_concurrency_is_bounded(self):
+        client = FakeClient([])
+        runner = runner_for(client, max_concurrency=2)
+        running = 0
+        peak = 0
+
+        async def handler(evt):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        runner.add_handler("m.room.message", handler)
+        await asyncio.gather(*(client.handlers[0](i) for i in range(6)))
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_prunes_account_data_and_runs_hooks(self):
+        client = FakeClient([batch("s1")])
+        runner = runner_for(client)
+        seen = []
+        runner.add_sync_hook(seen.append)
+        runner.add_sync_hook(lambda data: 1 / 0)
+        await run_until(runner, client, 2)
+        assert seen and "account_data" not in seen[0]
+
+    @pytest.mark.asyncio
+    async def test_set_filter_keeps_since(self):
+        client = FakeClient([batch("s1"), batch("s2")])
+        runner = runner_for(client, sync_filter=FILTER)
+
+        async def swap(n):
+            if n == 2:
+                runner.set_filter(Filter(presence=EventFilter(not_types=["m.presence"])))
+
+        client.on_sync = swap
+        await run_until(runner, client, 3)
+        assert client.create_filter.await_count == 2
+        assert client.since == [None, "s1", "s2"]